@@ -53,6 +53,10 @@ let deviceState_2 = false;
 let lastFlow_2 = 0.0;
 let lastSetpoint_2 = 0.0;
 
+// Receiver state of the packed status uplink (0x22): sequence and the
+// fixed-point values per MFC that delta frames apply to
+let packedState = { seq: null, nodes: {} };
+
 function decodeUplink(bytes, setpoint_1, setpoint_2, flow_1, flow_2) {
   const results = [];
 
@@ -107,16 +111,157 @@ function decodeUplink(bytes, setpoint_1, setpoint_2, flow_1, flow_2) {
       setpoint_2 = setpointValue.toFixed(2);
       flow_2 = flowValue.toFixed(2);
     }
+  } else if (payloadType === 0x22) {
+    // Packed status uplink (see mass-flow-controller/status_payload.py)
+    const nodes = decodePackedStatus(bytes);
+    if (nodes === null) {
+      results.push({
+        type: "warning",
+        message: "Packed status gap; waiting for the next keyframe",
+      });
+      return [results, setpoint_1, setpoint_2, flow_1, flow_2];
+    }
+    for (const node of nodes) {
+      const setpointText = node.setpoint === null ? null : node.setpoint.toFixed(2);
+      results.push({
+        type: "status",
+        mfcId: node.mfcId,
+        setpoint: setpointText,
+        flow: node.flow.toFixed(2),
+        gasCode: node.gasCode,
+        unit: "LN/min",
+      });
+
+      if (node.mfcId == 0) {
+        if (setpointText !== null) setpoint_1 = setpointText;
+        flow_1 = node.flow.toFixed(2);
+      } else if (node.mfcId == 1) {
+        if (setpointText !== null) setpoint_2 = setpointText;
+        flow_2 = node.flow.toFixed(2);
+      }
+    }
   }
 
   return [results, setpoint_1, setpoint_2, flow_1, flow_2];
 }
 
+function decodePackedStatus(bytes) {
+  // [0x22, keyframe bit | seq, slots, bitmap..., records...]; values are
+  // int16 with 1 LSB = scale / 16384 (-32768 = unknown). Returns the
+  // present nodes, or null when a delta can't be applied (missed frame).
+  const Q_PER_SCALE = 16384;
+  const Q_UNKNOWN = -32768;
+  const view = new DataView(new Uint8Array(bytes).buffer);
+  const keyframe = (bytes[1] & 0x80) !== 0;
+  const seq = bytes[1] & 0x7f;
+  const slots = bytes[2];
+  let pos = 3 + Math.ceil(slots / 8);
+
+  if (!keyframe && (packedState.seq === null || seq !== ((packedState.seq + 1) & 0x7f))) {
+    packedState.seq = null;
+    return null;
+  }
+  packedState.seq = seq;
+
+  const nodes = [];
+  for (let mfcId = 0; mfcId < slots; mfcId++) {
+    if (!(bytes[3 + (mfcId >> 3)] & (1 << (mfcId & 7)))) continue;
+
+    let state;
+    if (keyframe) {
+      state = {
+        gasCode: view.getUint8(pos),
+        scale: view.getFloat32(pos + 1, false),
+        flow: view.getInt16(pos + 5, false),
+        setpoint: view.getInt16(pos + 7, false),
+      };
+      packedState.nodes[mfcId] = state;
+      pos += 9;
+    } else {
+      state = packedState.nodes[mfcId];
+      if (state === undefined) {
+        packedState.seq = null;
+        return null;
+      }
+      const header = view.getUint8(pos);
+      pos += 1;
+      if (header & 0x01) {
+        state.flow += header & 0x02 ? view.getInt16(pos, false) : view.getInt8(pos);
+        pos += header & 0x02 ? 2 : 1;
+      }
+      if (header & 0x04) {
+        state.setpoint += header & 0x08 ? view.getInt16(pos, false) : view.getInt8(pos);
+        pos += header & 0x08 ? 2 : 1;
+      }
+    }
+
+    nodes.push({
+      mfcId: mfcId,
+      gasCode: state.gasCode === 0xff ? null : state.gasCode,
+      flow: (state.flow * state.scale) / Q_PER_SCALE,
+      setpoint: state.setpoint === Q_UNKNOWN ? null : (state.setpoint * state.scale) / Q_PER_SCALE,
+    });
+  }
+  return nodes;
+}
+
 function bytesToFloat(bytes) {
   const view = new DataView(new Uint8Array(bytes).buffer);
   return view.getFloat32(0, false);
 }
 
+function floatToHalf(value) {
+  // IEEE 754 binary16 bits of `value` (round to nearest even)
+  const f32 = new Float32Array([value]);
+  const x = new Uint32Array(f32.buffer)[0];
+  const sign = (x >>> 16) & 0x8000;
+  const exp = ((x >>> 23) & 0xff) - 127 + 15;
+  let mant = x & 0x7fffff;
+  if (exp >= 31) throw new Error(`Flow ${value} does not fit a half float`);
+  if (exp <= 0) {
+    if (exp < -10) return sign;
+    mant |= 0x800000;
+    const shift = 14 - exp;
+    let half = mant >> shift;
+    const rem = mant & ((1 << shift) - 1);
+    const halfway = 1 << (shift - 1);
+    if (rem > halfway || (rem === halfway && (half & 1))) half++;
+    return sign | half;
+  }
+  let half = (exp << 10) | (mant >> 13);
+  const rem = mant & 0x1fff;
+  if (rem > 0x1000 || (rem === 0x1000 && (half & 1))) half++;
+  return sign | half;
+}
+
+function encodeProfile(mfcId, repeat, segments) {
+  // 0x30 setpoint profile downlink (see trajectory.py): [0x30, mfc,
+  // repeat, per segment: op, f16 flow (step/ramp), u16 duration]. Durations
+  // go in tenths of a second up to 6553.5 s, else in seconds (op bit 7).
+  // No segments: stop the MFC's profile.
+  const OPS = { step: 0x01, ramp: 0x02, dwell: 0x03 };
+  if (!segments || segments.length === 0) return [0x30, mfcId];
+
+  const out = [0x30, mfcId, repeat];
+  for (const seg of segments) {
+    let op = OPS[seg.type];
+    if (op === undefined) throw new Error(`Unknown segment type ${seg.type}`);
+    let duration = Math.round((seg.duration || 0) * 10);
+    if (duration > 0xffff) {
+      op |= 0x80;
+      duration = Math.round(seg.duration);
+    }
+    if (duration > 0xffff) throw new Error(`Segment duration ${seg.duration} too long`);
+    out.push(op);
+    if (seg.type !== "dwell") {
+      const half = floatToHalf(Number(seg.flow));
+      out.push(half >> 8, half & 0xff);
+    }
+    out.push(duration >> 8, duration & 0xff);
+  }
+  return out;
+}
+
 app.get("/", (req, res) => {
   res.send(`
     <h1>MFC LoRaWAN Controller</h1>
@@ -319,6 +464,23 @@ app.post("/setpoint-2", async (req, res) => {
   res.json({ ok: true });
 });
 
+app.post("/profile", async (req, res) => {
+  // {mfc: 1|2, repeat: n (0 = until stopped), segments: [{type, flow, duration}]}
+  const { mfc, repeat = 1, segments = [] } = req.body;
+  if (mfc != 1 && mfc != 2) return res.status(400).json({ error: "mfc must be 1 or 2" });
+
+  let bytes;
+  try {
+    bytes = encodeProfile(mfc - 1, repeat & 0xff, segments);
+  } catch (err) {
+    return res.status(400).json({ error: err.message });
+  }
+  if (bytes.length > 32) return res.status(400).json({ error: "Profile too long for one downlink" });
+
+  await sendDownlink(bytes, 15, mfc);
+  res.json({ ok: true, bytes: bytes.length });
+});
+
 io.on("connection", (s) => {
   s.emit("initial", {
     lastValue_1,
@@ -30,6 +30,7 @@
 #include <string>
 #include <iostream>
 #include <cstring>
+#include <cerrno>
 #include <cmath>
 #include <poll.h>
 #include <fcntl.h>
@@ -72,6 +73,20 @@ FILE* status_fp = nullptr;
 int status_fd = -1;
 std::string partial;
 bool statusPublisherRunning = false;
+// MFC_PACKED_UPLINK=1: the publisher prints one PACKED:<hex> frame (type
+// 0x22, all nodes) per cycle and it replaces the per-node 0x20 uplinks
+bool packedUplink = false;
+
+// Binary status frames from the publisher on a pipe passed as MFC_DATA_FD
+// (see mass-flow-controller/data_channel.py); -1: parse stdout lines
+int data_fd = -1;
+std::string dataPartial;
+
+const uint8_t DATA_STATUS_CYCLE = 0x01;
+const uint8_t DATA_PACKED_UPLINK = 0x02;
+const uint32_t DATA_MAX_FRAME = 64 * 1024;
+const size_t DATA_CYCLE_HEADER = 10;   // f64 epoch, u8 gps_fix, u8 count
+const size_t DATA_STATUS_RECORD = 13;  // u8 id, u8 flags, char[2], u8 gas, f32 flow, f32 setpoint
 
 const std::map<std::string, uint8_t> GAS_MAP = {
         {"AIR", 0x00},
@@ -254,7 +269,32 @@ void sendRefreshToPython() {
 FILE* startStatusPublisher() {
     std::stringstream cmd;
     cmd << "bash -c \"cd /home/pi/Documents/Radiolib/examples/NonArduino/Raspberry_copy/mass-flow-controller && source /home/pi/Documents/Radiolib/examples/NonArduino/Raspberry_copy/mass-flow-controller/.venv/bin/activate >/dev/null 2>&1 && python3 mfc_status_publisher.py\"";
+    // The child inherits the pipe's write end and learns its number from
+    // MFC_DATA_FD; our read end is close-on-exec
+    int dataPipe[2];
+    bool haveDataPipe = pipe(dataPipe) == 0;
+    if (haveDataPipe) {
+        fcntl(dataPipe[0], F_SETFD, FD_CLOEXEC);
+        setenv("MFC_DATA_FD", std::to_string(dataPipe[1]).c_str(), 1);
+    } else {
+        printf("[WARNING] pipe() failed, reading status from stdout\n");
+    }
+
     FILE* fp = popen(cmd.str().c_str(), "r");
+
+    if (haveDataPipe) {
+        unsetenv("MFC_DATA_FD");
+        close(dataPipe[1]);
+        if (fp) {
+            int dataFlags = fcntl(dataPipe[0], F_GETFL, 0);
+            fcntl(dataPipe[0], F_SETFL, dataFlags | O_NONBLOCK);
+            data_fd = dataPipe[0];
+            dataPartial.clear();
+        } else {
+            close(dataPipe[0]);
+        }
+    }
+
     if(!fp) {
         printf("[ERROR] Failed to start status publisher\n");
         return nullptr;
@@ -312,6 +352,55 @@ void sendGasToPython(uint8_t mfc_id, uint8_t gas_code) {
     }
 }
 
+// Forward a 0x30 setpoint profile downlink; the publisher runs it locally
+void sendProfileToPython(const uint8_t* frame, size_t len) {
+    const char* host = "127.0.0.1";
+    const int port = 8765;
+    int fd = socket(AF_INET, SOCK_STREAM, 0);
+    if (fd < 0) {
+        printf("[WARNING] socket() failed for profile command\n");
+        return;
+    }
+    struct sockaddr_in addr;
+    memset(&addr, 0, sizeof(addr));
+    addr.sin_family = AF_INET;
+    addr.sin_port = htons(port);
+    addr.sin_addr.s_addr = inet_addr(host);
+    if (connect(fd, (struct sockaddr*)&addr, sizeof(addr)) < 0) {
+        close(fd);
+        printf("[WARNING] Could not connect to TCP %s:%d for profile command\n", host, port);
+        return;
+    }
+    try {
+        static const char hexDigits[] = "0123456789abcdef";
+        std::string hex;
+        for (size_t i = 0; i < len; i++) {
+            hex += hexDigits[frame[i] >> 4];
+            hex += hexDigits[frame[i] & 0x0F];
+        }
+        nlohmann::json cmd;
+        cmd["action"] = "profile";
+        cmd["payload"] = hex;
+        std::string s = cmd.dump() + "\n";
+        ssize_t w = write(fd, s.c_str(), s.size());
+        if (w < 0) {
+            printf("[WARNING] Failed to write profile command to socket\n");
+            close(fd);
+            return;
+        }
+        char buf[512];
+        ssize_t r = read(fd, buf, sizeof(buf) - 1);
+        if (r > 0) {
+            buf[r] = '\0';
+            printf("[INFO] Profile command response: %s\n", buf);
+        }
+        close(fd);
+    } catch (...) {
+        close(fd);
+        printf("[WARNING] Exception while sending profile command\n");
+    }
+}
+
 void downlinkAction(const uint8_t *uplink, size_t uplinkLen) {
     uint8_t downlink[32];
     size_t dlLen = sizeof(downlink);
@@ -351,6 +440,10 @@ void downlinkAction(const uint8_t *uplink, size_t uplinkLen) {
                 printf("Received command to refresh data\n");
                 sendRefreshToPython();
 
+            } else if (cmd == 0x30 && dlLen >= 2) {
+                printf("Command: PROFILE for MFC %u (%zu bytes)\n", downlink[1], dlLen);
+                sendProfileToPython(downlink, dlLen);
+
             } else if (cmd == 0x21 && dlLen <= 10) {
                 printf("Command: GAS for calibration\n");
                 if (dlLen < 3) {
@@ -454,6 +547,147 @@ void sendStatus(float setpoint, float flow, uint8_t mfc_id, char device[2]) {
     downlinkAction(uplink, sizeof(uplink));
 }
 
+// Largest US915 payload (DR4); longer frames would be rejected by the MAC
+const size_t MAX_UPLINK = 242;
+
+void sendPackedStatus(const uint8_t* frame, size_t len) {
+    if (len < 3 || len > MAX_UPLINK || frame[0] != 0x22) {
+        printf("[WARNING] Bad packed status frame (%zu bytes)\n", len);
+        return;
+    }
+    printf("[INFO] Sending packed status uplink: %zu bytes (%s)\n", len, (frame[1] & 0x80) ? "keyframe" : "delta");
+    downlinkAction(frame, len);
+}
+
+void sendPackedStatus(const std::string& hex) {
+    uint8_t uplink[MAX_UPLINK];
+    size_t len = hex.size() / 2;
+
+    if (hex.size() % 2 != 0 || len > sizeof(uplink)) {
+        printf("[WARNING] Bad packed status frame (%zu hex chars)\n", hex.size());
+        return;
+    }
+    for (size_t i = 0; i < len; i++) {
+        char byteHex[3] = { hex[2 * i], hex[2 * i + 1], '\0' };
+        char* endPtr = nullptr;
+        long value = strtol(byteHex, &endPtr, 16);
+        if (*endPtr != '\0') {
+            printf("[WARNING] Bad packed status frame: %s\n", hex.c_str());
+            return;
+        }
+        uplink[i] = static_cast<uint8_t>(value);
+    }
+    sendPackedStatus(uplink, len);
+}
+
+// Latest status of MFC 0/1 -> globals and (unless packed) a 0x20 uplink
+void updateStatus(int mfc_id, float flow, float setpoint, bool hasSetpoint, const char device[2]) {
+    if (mfc_id == 0) {
+        flow_1 = flow;
+        if (hasSetpoint) {
+            mfcSetpoint_1 = setpoint;
+            device_1[0] = device[0];
+            device_1[1] = device[1];
+        }
+        if (!packedUplink) {
+            sendStatus(setpoint, flow, mfc_id, device_1);
+        }
+    } else if (mfc_id == 1) {
+        flow_2 = flow;
+        if (hasSetpoint) {
+            mfcSetpoint_2 = setpoint;
+            device_2[0] = device[0];
+            device_2[1] = device[1];
+        }
+        if (!packedUplink) {
+            sendStatus(setpoint, flow, mfc_id, device_2);
+        }
+    }
+}
+
+//-------------------------DATA CHANNEL------------------------------
+
+uint32_t readU32LE(const uint8_t* p) {
+    return (uint32_t)p[0] | ((uint32_t)p[1] << 8) | ((uint32_t)p[2] << 16) | ((uint32_t)p[3] << 24);
+}
+
+float readF32LE(const uint8_t* p) {
+    uint32_t raw = readU32LE(p);
+    float value;
+    memcpy(&value, &raw, sizeof(float));
+    return value;
+}
+
+void handleDataFrame(uint8_t type, const uint8_t* payload, size_t len) {
+    if (type == DATA_STATUS_CYCLE) {
+        if (len < DATA_CYCLE_HEADER || len < DATA_CYCLE_HEADER + payload[9] * DATA_STATUS_RECORD) {
+            printf("[WARNING] Short status cycle frame (%zu bytes)\n", len);
+            return;
+        }
+        uint8_t count = payload[9];
+        for (uint8_t i = 0; i < count; i++) {
+            const uint8_t* rec = payload + DATA_CYCLE_HEADER + i * DATA_STATUS_RECORD;
+            int mfc_id = rec[0];
+            bool hasSetpoint = (rec[1] & 0x01) != 0;
+            char device[3] = { (char)rec[2], (char)rec[3], '\0' };
+            uint8_t gasCode = rec[4];
+            float flow = readF32LE(rec + 5);
+            float setpoint = readF32LE(rec + 9);
+
+            if (mfc_id > 1) {
+                continue;
+            }
+            if (gasCode != 0xFF) {
+                printf("[INFO] Status  Device=%s MFC%d - Flow=%.4f, Setpoint=%.4f, Gas=0x%02X\n", device, mfc_id, flow, setpoint, gasCode);
+            } else {
+                printf("[INFO] Status  Device=%s MFC%d - Flow=%.4f, Setpoint=%.4f\n", device, mfc_id, flow, setpoint);
+            }
+            updateStatus(mfc_id, flow, setpoint, hasSetpoint, device);
+        }
+    } else if (type == DATA_PACKED_UPLINK) {
+        if (packedUplink) {
+            sendPackedStatus(payload, len);
+        }
+    } else {
+        printf("[WARNING] Unknown data channel frame type 0x%02X (%zu bytes)\n", type, len);
+    }
+}
+
+void pollDataChannel() {
+    uint8_t buf[1024];
+    for (;;) {
+        ssize_t n = read(data_fd, buf, sizeof(buf));
+        if (n > 0) {
+            dataPartial.append(reinterpret_cast<const char*>(buf), n);
+            continue;
+        }
+        if (n == 0 || (errno != EAGAIN && errno != EWOULDBLOCK)) {
+            printf("[WARNING] Status publisher closed the data channel\n");
+            close(data_fd);
+            data_fd = -1;
+        }
+        break;
+    }
+
+    // [u32 length][u8 type][payload], length counts type + payload
+    const uint8_t* data = reinterpret_cast<const uint8_t*>(dataPartial.data());
+    size_t pos = 0;
+    while (dataPartial.size() - pos >= 4) {
+        uint32_t len = readU32LE(data + pos);
+        if (len == 0 || len > DATA_MAX_FRAME) {
+            printf("[ERROR] Corrupt data channel frame (length %u), discarding buffer\n", len);
+            pos = dataPartial.size();
+            break;
+        }
+        if (dataPartial.size() - pos < 4 + (size_t)len) {
+            break;
+        }
+        handleDataFrame(data[pos + 4], data + pos + 5, len - 1);
+        pos += 4 + len;
+    }
+    dataPartial.erase(0, pos);
+}
+
 
 //-------------------------MAIN--------------------------------------
 
@@ -495,6 +729,12 @@ int main(int argc, char** argv) {
 
     printf("Ready!\n");
 
+    const char* packedEnv = getenv("MFC_PACKED_UPLINK");
+    packedUplink = packedEnv && strcmp(packedEnv, "1") == 0;
+    if (packedUplink) {
+        printf("[INFO] Packed multi-node status uplinks enabled\n");
+    }
+
     status_fp = startStatusPublisher();
     status_fd = status_fp ? fileno(status_fp) : -1;
     partial = "";
@@ -533,7 +773,8 @@ int main(int argc, char** argv) {
                         if(!line.empty() && line.back() == '\r') line.pop_back();
                         partial.erase(0, pos+1);
                        
-                        if (line.rfind("STATUS:", 0) == 0) {
+                        // With the data channel up, status only arrives there
+                        if (data_fd < 0 && line.rfind("STATUS:", 0) == 0) {
                             char device[3] = "XX";
                             int mfc_id = -1;
                             float flow = 0.0f;
@@ -573,29 +814,17 @@ int main(int argc, char** argv) {
                                     printf("[INFO] Status  Device=%c%c MFC%d - Flow=%.4f, Setpoint=%.4f\n", device[0], device[1], mfc_id, flow, setpoint);
                                 }
                                 
-                                if (mfc_id == 0) {
-                                    flow_1 = flow;
-                                    if (parseResult == 6) {
-                                        mfcSetpoint_1 = setpoint;
-                                        device_1[0] = device[0];
-                                        device_1[1] = device[1];
-                                    }
-                                    sendStatus(setpoint, flow, mfc_id, device_1);
-                                } else {
-                                    flow_2 = flow;
-                                    if (parseResult == 6) {
-                                        mfcSetpoint_2 = setpoint;
-                                        device_2[0] = device[0];
-                                        device_2[1] = device[1];
-                                    }
-                                
-                                    sendStatus(setpoint, flow, mfc_id, device_2);
-                                }
+                                updateStatus(mfc_id, flow, setpoint, parseResult == 6, device);
                             } else {
                                 printf("[WARNING] Failed to parse status: %s (result=%d, id=%d)\n", line.c_str(), parseResult, mfc_id);
                                 // errorUplink(0x01, 0x03);
                             }
 
+                        } else if(data_fd < 0 && line.rfind("PACKED:", 0) == 0) {
+                            if (packedUplink) {
+                                sendPackedStatus(line.substr(7));
+                            }
+
                         } else if(line.rfind("ERROR:",0) == 0) {
                             printf("[Status publisher] %s\n", line.c_str());
                             //errorUplink(0x01, 0x02);
@@ -609,6 +838,10 @@ int main(int argc, char** argv) {
                 }
             }
         }
+        if(data_fd >= 0) {
+            pollDataChannel();
+        }
+
         if(!statusPublisherRunning) {
             hearbeatUplink();
 
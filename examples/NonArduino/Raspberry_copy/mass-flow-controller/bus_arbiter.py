@@ -0,0 +1,148 @@
+"""
+Single owner of the RS-485 port.
+
+Raw ASCII frames (serial_io.transact on the shared serial.Serial) and
+propar library calls (instrument.writeParameter / readParameter) used to
+hit /dev/ttyUSB0 from independent code paths, so one stack's
+reset_input_buffer() could swallow the other's reply. Every bus access
+now goes through one BusArbiter thread which runs jobs one at a time,
+highest priority first (lower number = sooner), FIFO within a priority.
+Callers get a concurrent.futures.Future back.
+
+Parameter reads and writes are sent as ProPar ASCII frames on the same
+serial handle as every other raw frame, not through propar.instrument:
+the propar library opens its own handle with its own reader thread,
+which queueing jobs cannot keep from eating replies meant for us. The
+publisher only uses propar for node discovery and closes it right after
+(shared_resources.discover_nodes).
+"""
+
+import itertools
+import queue
+import threading
+from concurrent.futures import Future
+from typing import Callable, Optional
+
+import serial_io
+from propar_ascii import build_read_request, build_write_request, decode_read_reply, \
+    decode_write_reply, param_for_dde
+
+# Lower value runs first
+PRIORITY_SHUTDOWN = 0
+PRIORITY_SETPOINT = 10
+PRIORITY_COMMAND = 20
+PRIORITY_POLL = 50
+
+_STOP = object()
+
+
+def _then(future: Future, fn: Callable) -> Future:
+    """Future of fn(result of `future`), failing if either fails."""
+    result = Future()
+
+    def done(f: Future):
+        try:
+            result.set_result(fn(f.result()))
+        except BaseException as e:
+            result.set_exception(e)
+
+    future.add_done_callback(done)
+    return result
+
+
+class BusArbiter:
+    """Bus-owner thread with a priority queue of jobs."""
+
+    def __init__(self, serial_factory: Callable):
+        """
+        Args:
+            serial_factory: () -> serial.Serial, the only handle on the port
+        """
+        self._serial_factory = serial_factory
+
+        self._queue = queue.PriorityQueue()
+        self._seq = itertools.count()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    # --------------------------------------------------
+    # LIFECYCLE
+    # --------------------------------------------------
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(
+                target=self._run, name="bus-arbiter", daemon=True
+            )
+            self._thread.start()
+
+    def stop(self, timeout: float = 5.0):
+        """Finish the jobs already queued, then stop the thread."""
+        with self._lock:
+            thread = self._thread
+            self._thread = None
+        if thread is None:
+            return
+        # Lowest priority: everything queued before stop() still runs
+        self._queue.put((float("inf"), next(self._seq), _STOP, None))
+        thread.join(timeout)
+
+    @property
+    def running(self) -> bool:
+        thread = self._thread
+        return thread is not None and thread.is_alive()
+
+    # --------------------------------------------------
+    # JOBS
+    # --------------------------------------------------
+
+    def submit(self, fn: Callable, priority: int = PRIORITY_COMMAND) -> Future:
+        """Run fn() on the bus thread; returns a Future for its result."""
+        if not self.running:
+            self.start()
+        future = Future()
+        self._queue.put((priority, next(self._seq), fn, future))
+        return future
+
+    def transact(self, cmd: bytes, address: Optional[int] = None,
+                 priority: int = PRIORITY_POLL) -> Future:
+        """Raw ASCII frame exchange (reply frame bytes)."""
+        return self.submit(
+            lambda: serial_io.transact(self._serial_factory(), cmd, address),
+            priority,
+        )
+
+    def write_parameter(self, address: int, dde: int, value,
+                        priority: int = PRIORITY_SETPOINT) -> Future:
+        """Write DDE `dde` of node `address`; True once the node acknowledged."""
+        frame = build_write_request(address, param_for_dde(dde), value)
+        return _then(self.transact(frame, address, priority), decode_write_reply)
+
+    def read_parameter(self, address: int, dde: int,
+                       priority: int = PRIORITY_SETPOINT) -> Future:
+        """Read DDE `dde` of node `address`."""
+        spec = param_for_dde(dde)
+        return _then(
+            self.transact(build_read_request(address, (spec,)), address, priority),
+            lambda reply: decode_read_reply(reply, (spec,))[spec.name],
+        )
+
+    # --------------------------------------------------
+    # INTERNALS
+    # --------------------------------------------------
+
+    def _run(self):
+        while True:
+            _, _, fn, future = self._queue.get()
+            if fn is _STOP:
+                break
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                result = fn()
+            except BaseException as e:
+                future.set_exception(e)
+            else:
+                future.set_result(result)
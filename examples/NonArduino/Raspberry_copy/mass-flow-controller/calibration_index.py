@@ -0,0 +1,371 @@
+"""
+Precompiled binary calibration index.
+
+`compile_index` turns the calibration TSV into a sorted array of
+fixed-width records keyed by (serial, gas). `CalibrationIndex` mmaps
+that file and binary-searches it, so opening it costs one mmap() and a
+lookup only decodes the records it actually touches.
+
+Layout (little endian):
+
+    header  : magic "MFCCALIX", version u16, record size u16,
+              record count u32, source TSV mtime (ns) i64 and
+              size i64 at compile time, padded to HEADER_SIZE bytes
+    records : sorted by the 48-byte (serial, gas) key
+
+    serial   24s   NUL padded, sort key part 1
+    gas      24s   NUL padded, sort key part 2
+    device    8s
+    flags     B    bit 0: default calibration for this serial
+    (pad)    7x
+    cal_date 24s   NUL padded "Cal Date" text (empty = None)
+    slope, offset, cal_min, cal_max, max_flow   5 x f64 (NaN = None)
+"""
+
+import math
+import mmap
+import os
+import struct
+import sys
+import tempfile
+from typing import List, Optional
+
+from calibration_loader import (
+    Calibration,
+    CalibrationLoader,
+    clean_serial,
+    iter_calibration_rows,
+)
+
+INDEX_MAGIC = b"MFCCALIX"
+INDEX_VERSION = 3
+INDEX_SUFFIX = ".calidx"
+
+HEADER = struct.Struct("<8sHHIqq")
+HEADER_SIZE = 32
+
+SERIAL_LEN = 24
+GAS_LEN = 24
+KEY_LEN = SERIAL_LEN + GAS_LEN
+RECORD = struct.Struct("<24s24s8sB7x24s5d")
+CAL_DATE_LEN = 24
+
+FLAG_DEFAULT = 0x01
+
+
+def default_index_path(tsv_path: str) -> str:
+    return os.path.splitext(tsv_path)[0] + INDEX_SUFFIX
+
+
+def source_stamp(tsv_path: str):
+    """(mtime_ns, size) of the TSV, as stored in the index header."""
+    st = os.stat(tsv_path)
+    return st.st_mtime_ns, st.st_size
+
+
+def _pad(text: str, length: int, what: str) -> bytes:
+    raw = text.encode("ascii")
+    if len(raw) > length:
+        raise ValueError(f"{what} '{text}' longer than {length} bytes")
+    return raw.ljust(length, b"\x00")
+
+
+def _key(serial: str, gas: str) -> bytes:
+    return _pad(serial, SERIAL_LEN, "Serial") + _pad(gas, GAS_LEN, "Gas")
+
+
+# --------------------------------------------------
+# COMPILE
+# --------------------------------------------------
+
+def compile_index(tsv_path: str, index_path: Optional[str] = None) -> str:
+    """
+    Compile `tsv_path` into a binary index and return its path.
+
+    Same semantics as CalibrationLoader: the last row wins for a
+    duplicated (serial, gas) pair, and the gas of the first row seen
+    for a serial is its default. The file is written next to the
+    target and renamed into place, so readers never see a partial index.
+    """
+    index_path = index_path or default_index_path(tsv_path)
+    # Stamped before parsing: a TSV changed mid-compile reads as stale
+    tsv_mtime, tsv_size = source_stamp(tsv_path)
+
+    by_key = {}
+    default_serials = set()
+    for serial, cal in iter_calibration_rows(tsv_path):
+        key = _key(serial, cal.gas)
+        if serial not in default_serials:
+            default_serials.add(serial)
+            flags = FLAG_DEFAULT
+        else:
+            flags = by_key.get(key, (0, None))[0]
+        by_key[key] = (flags, cal)
+
+    # A private temp file per writer: the publisher and a setpoint
+    # controller may recompile the same index at the same moment
+    fd, tmp_path = tempfile.mkstemp(
+        dir=os.path.dirname(os.path.abspath(index_path)),
+        prefix=os.path.basename(index_path) + ".",
+        suffix=".tmp",
+    )
+    try:
+        os.fchmod(fd, 0o644)
+        with os.fdopen(fd, "wb") as f:
+            header = HEADER.pack(
+                INDEX_MAGIC, INDEX_VERSION, RECORD.size, len(by_key), tsv_mtime, tsv_size,
+            )
+            f.write(header.ljust(HEADER_SIZE, b"\x00"))
+
+            for key in sorted(by_key):
+                flags, cal = by_key[key]
+                f.write(RECORD.pack(
+                    key[:SERIAL_LEN],
+                    key[SERIAL_LEN:],
+                    _pad(cal.device, 8, "Device"),
+                    flags,
+                    _pad(cal.cal_date or "", CAL_DATE_LEN, "Cal Date"),
+                    cal.slope,
+                    cal.offset,
+                    cal.cal_min,
+                    cal.cal_max,
+                    cal.max_flow if cal.max_flow is not None else math.nan,
+                ))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, index_path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+    print(
+        f"[CalibrationIndex] Compiled {len(by_key)} calibrations "
+        f"({len(default_serials)} devices) into {index_path}",
+        flush=True,
+    )
+    return index_path
+
+
+# --------------------------------------------------
+# READ
+# --------------------------------------------------
+
+class CalibrationIndex:
+    """
+    Memory-mapped reader for a compiled calibration index.
+
+    Drop-in for CalibrationLoader lookups:
+    get / get_for_gas / find_best_calibration / available_gases
+    """
+
+    def __init__(self, index_path: str):
+        self.filepath = index_path
+
+        with open(index_path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, record_size, count, tsv_mtime, tsv_size = HEADER.unpack_from(self._mm, 0)
+        if magic != INDEX_MAGIC or version != INDEX_VERSION:
+            self._mm.close()
+            raise ValueError(f"{index_path} is not a v{INDEX_VERSION} calibration index")
+        if record_size != RECORD.size or len(self._mm) < HEADER_SIZE + count * record_size:
+            self._mm.close()
+            raise ValueError(f"{index_path} is truncated or has an unexpected layout")
+
+        self._count = count
+        # (mtime_ns, size) of the TSV this index was compiled from
+        self.source_stamp = (tsv_mtime, tsv_size)
+
+    def __len__(self):
+        return self._count
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self._mm.close()
+
+    # --------------------------------------------------
+    # PUBLIC API — BACKWARD COMPATIBLE
+    # --------------------------------------------------
+
+    def get(self, serial: str) -> Calibration:
+        serial_key = clean_serial(serial)
+
+        for pos in self._serial_range(serial_key):
+            if self._mm[self._offset(pos) + KEY_LEN + 8] & FLAG_DEFAULT:
+                return self._decode(pos)
+
+        raise KeyError(f"No calibration found for {serial_key}")
+
+    def get_for_gas(self, serial: str, gas: str) -> Calibration:
+        serial_key = clean_serial(serial)
+        gas_key = gas.strip().upper()
+
+        pos = self._find(serial_key, gas_key)
+        if pos is None:
+            available = self.available_gases(serial_key)
+            raise KeyError(
+                f"No calibration for serial={serial_key}, gas={gas_key}. "
+                f"Available gases: {available}"
+            )
+        return self._decode(pos)
+
+    def find_best_calibration(self, serial: str, gas: str):
+        serial_key = clean_serial(serial)
+        gas_key = gas.strip().upper()
+
+        pos = self._find(serial_key, gas_key)
+        if pos is not None:
+            return self._decode(pos), gas_key
+
+        available = self.available_gases(serial_key)
+
+        if available:
+            chosen = available[0]
+            print(
+                f"[CalibrationIndex] Gas '{gas_key}' not found for serial "
+                f"'{serial_key}'. Using '{chosen}' instead.",
+                flush=True,
+            )
+            return self._decode(self._find(serial_key, chosen)), chosen
+
+        print(
+            f"[CalibrationIndex] No calibrations found for serial "
+            f"'{serial_key}'.",
+            flush=True,
+        )
+        return None, None
+
+    def available_gases(self, serial: str) -> List[str]:
+        serial_key = clean_serial(serial)
+        gases = []
+        for pos in self._serial_range(serial_key):
+            off = self._offset(pos) + SERIAL_LEN
+            gases.append(self._mm[off:off + GAS_LEN].rstrip(b"\x00").decode("ascii"))
+        # Records are key-sorted, so gases already come out sorted
+        return gases
+
+    def resolve_serial(self, partial: str) -> List[str]:
+        """Known serials starting with `partial` (or a full MFC name)."""
+        prefix_text = clean_serial(partial.split("-")[-1])
+        try:
+            prefix = prefix_text.encode("ascii")
+        except UnicodeEncodeError:
+            return []
+        if not prefix or len(prefix) > SERIAL_LEN:
+            return []
+
+        matches = []
+        pos = self._lower_bound(prefix)
+        while pos < self._count:
+            off = self._offset(pos)
+            serial = self._mm[off:off + SERIAL_LEN].rstrip(b"\x00")
+            if not serial.startswith(prefix):
+                break
+            text = serial.decode("ascii")
+            if not matches or matches[-1] != text:
+                matches.append(text)
+            pos += 1
+        return matches
+
+    # --------------------------------------------------
+    # INTERNALS
+    # --------------------------------------------------
+
+    def _offset(self, pos: int) -> int:
+        return HEADER_SIZE + pos * RECORD.size
+
+    def _key_at(self, pos: int) -> bytes:
+        off = self._offset(pos)
+        return self._mm[off:off + KEY_LEN]
+
+    def _lower_bound(self, key: bytes) -> int:
+        lo, hi = 0, self._count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._key_at(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def _find(self, serial_key: str, gas_key: str) -> Optional[int]:
+        try:
+            key = _key(serial_key, gas_key)
+        except (ValueError, UnicodeEncodeError):
+            return None
+        pos = self._lower_bound(key)
+        if pos < self._count and self._key_at(pos) == key:
+            return pos
+        return None
+
+    def _serial_range(self, serial_key: str):
+        try:
+            prefix = _pad(serial_key, SERIAL_LEN, "Serial")
+        except (ValueError, UnicodeEncodeError):
+            return range(0)
+
+        start = self._lower_bound(prefix + b"\x00" * GAS_LEN)
+        end = start
+        while end < self._count:
+            off = self._offset(end)
+            if self._mm[off:off + SERIAL_LEN] != prefix:
+                break
+            end += 1
+        return range(start, end)
+
+    def _decode(self, pos: int) -> Calibration:
+        _, gas, device, _, cal_date, slope, offset, cal_min, cal_max, max_flow = (
+            RECORD.unpack_from(self._mm, self._offset(pos))
+        )
+        return Calibration(
+            device=device.rstrip(b"\x00").decode("ascii"),
+            gas=gas.rstrip(b"\x00").decode("ascii"),
+            slope=slope,
+            offset=offset,
+            cal_min=cal_min,
+            cal_max=cal_max,
+            max_flow=None if math.isnan(max_flow) else max_flow,
+            cal_date=cal_date.rstrip(b"\x00").decode("ascii") or None,
+        )
+
+
+def open_calibrations(tsv_path: str, index_path: Optional[str] = None):
+    """
+    Return a CalibrationIndex for `tsv_path`, compiling it first if the
+    index is missing, from an older index version or compiled from a
+    TSV with a different mtime or size (any change, not only a newer
+    file: a restored older TSV counts too). Falls back to a plain
+    CalibrationLoader if the index can't be built or opened.
+    """
+    index_path = index_path or default_index_path(tsv_path)
+
+    try:
+        stamp = source_stamp(tsv_path)
+        try:
+            index = CalibrationIndex(index_path)
+        except (FileNotFoundError, ValueError):
+            # Missing, or written by an older version of this module
+            index = None
+        if index is not None:
+            if index.source_stamp == stamp:
+                return index
+            index.close()
+        compile_index(tsv_path, index_path)
+        return CalibrationIndex(index_path)
+    except Exception as e:
+        print(f"[CalibrationIndex] Index unavailable ({e}); parsing {tsv_path}", flush=True)
+        return CalibrationLoader(tsv_path)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) not in (2, 3):
+        print(f"Usage: {sys.argv[0]} <calibration_file> [index_file]")
+        sys.exit(1)
+    compile_index(sys.argv[1], sys.argv[2] if len(sys.argv) == 3 else None)
@@ -1,9 +1,16 @@
+import bisect
 import csv
-from dataclasses import dataclass
-from typing import Dict, Tuple, Optional
+import os
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Dict, Iterator, List, Tuple, Optional
 
+# Full-scale ProPar register value (100 %)
+REGISTER_FULL_SCALE = 32000
 
-@dataclass
+
+@dataclass(frozen=True)
 class Calibration:
     device: str
     gas: str
@@ -12,6 +19,27 @@ class Calibration:
     cal_min: float
     cal_max: float
     max_flow: Optional[float]
+    # "Cal Date" as written in the calibration file (provenance only)
+    cal_date: Optional[str] = None
+
+    # Precomputed conversion coefficients (register counts <-> flow)
+    flow_per_count: float = field(init=False, repr=False, compare=False)
+    count_per_flow: float = field(init=False, repr=False, compare=False)
+
+    def __post_init__(self):
+        # Frozen dataclass: normalize through object.__setattr__ once
+        for name in ("slope", "offset", "cal_min", "cal_max"):
+            object.__setattr__(self, name, float(getattr(self, name)))
+        if self.max_flow is not None:
+            object.__setattr__(self, "max_flow", float(self.max_flow))
+
+        if self.slope == 0:
+            # No flow maps to a register; the loaders skip the row
+            raise ValueError(f"Zero slope for {self.device} / {self.gas}")
+
+        flow_per_count = self.slope * 100.0 / REGISTER_FULL_SCALE
+        object.__setattr__(self, "flow_per_count", flow_per_count)
+        object.__setattr__(self, "count_per_flow", 1.0 / flow_per_count)
 
 
 class CalibrationLoader:
@@ -22,6 +50,7 @@ class CalibrationLoader:
     - No silent gas overwrite
     - Fast lookup
     - Numeric normalization
+    - Immutable records (safe to share between threads)
     - Backwards compatible with get(serial)
     """
 
@@ -34,7 +63,15 @@ class CalibrationLoader:
         # Secondary map: serial -> default Calibration (first seen)
         self._default_by_serial: Dict[str, Calibration] = {}
 
+        # Secondary indexes (built once after loading, sorted)
+        self._gases_by_serial: Dict[str, List[str]] = {}
+        self._serials_by_gas: Dict[str, List[str]] = {}
+
+        # Sorted serials for prefix lookups (bisect)
+        self._sorted_serials: List[str] = []
+
         self._load_calibrations()
+        self._build_indexes()
 
     # --------------------------------------------------
     # PUBLIC API — BACKWARD COMPATIBLE
@@ -102,60 +139,51 @@ class CalibrationLoader:
         )
         return None, None
 
-    def available_gases(self, serial: str):
+    def available_gases(self, serial: str) -> List[str]:
         serial_key = self._clean_serial(serial)
-        return sorted(
-            gas for (s, gas) in self._cal_by_pair.keys() if s == serial_key
-        )
+        return list(self._gases_by_serial.get(serial_key, ()))
+
+    def serials_for_gas(self, gas: str) -> List[str]:
+        """All serials calibrated for `gas`, sorted."""
+        return list(self._serials_by_gas.get(gas.strip().upper(), ()))
+
+    def resolve_serial(self, partial: str) -> List[str]:
+        """
+        Resolve a partial serial to the known serials it prefixes.
+        Accepts a full MFC name (e.g. BL-20C2H2-M24200697B) as well.
+        O(log n + matches).
+        """
+        prefix = self._clean_serial(partial.split("-")[-1])
+        if not prefix:
+            return []
+
+        start = bisect.bisect_left(self._sorted_serials, prefix)
+        matches = []
+        for serial in self._sorted_serials[start:]:
+            if not serial.startswith(prefix):
+                break
+            matches.append(serial)
+        return matches
 
     # --------------------------------------------------
     # INTERNALS
     # --------------------------------------------------
 
     def _clean_serial(self, serial: str) -> str:
-        return serial.split("\x00")[0].strip()
-
-    def _safe_float(self, value: str) -> Optional[float]:
-        if value is None:
-            return None
-        value = value.strip()
-        if value == "":
-            return None
-        return float(value)
+        return clean_serial(serial)
 
     def _load_calibrations(self):
         loaded = 0
 
-        with open(self.filepath, newline="") as f:
-            reader = csv.DictReader(f, delimiter="\t")
+        for serial, cal in iter_calibration_rows(self.filepath):
+            # Primary mapping
+            self._cal_by_pair[(serial, cal.gas)] = cal
 
-            for row in reader:
-                try:
-                    device = row["MFC"].split("-")[0]
-                    serial = self._clean_serial(row["MFC"].split("-")[2])
-                    gas = row["Cal Species"].strip().upper()
+            # Default mapping (first one wins — deterministic)
+            if serial not in self._default_by_serial:
+                self._default_by_serial[serial] = cal
 
-                    cal = Calibration(
-                        device=device,
-                        gas=gas,
-                        slope=float(row["Slope"]),
-                        offset=float(row["Offset"]),
-                        cal_min=float(row["Cal Min [SLPM]"]),
-                        cal_max=float(row["Cal Max [SLPM]"]),
-                        max_flow=self._safe_float(row["Max Flow [SLPM]"]),
-                    )
-
-                    # Primary mapping
-                    self._cal_by_pair[(serial, gas)] = cal
-
-                    # Default mapping (first one wins — deterministic)
-                    if serial not in self._default_by_serial:
-                        self._default_by_serial[serial] = cal
-
-                    loaded += 1
-
-                except Exception as e:
-                    print(f"Skipping bad calibration row: {e}", flush=True)
+            loaded += 1
 
         print(
             f"[CalibrationLoader] Loaded {loaded} calibrations "
@@ -163,13 +191,189 @@ class CalibrationLoader:
             flush=True,
         )
 
+    def _build_indexes(self):
+        gases_by_serial: Dict[str, List[str]] = {}
+        serials_by_gas: Dict[str, List[str]] = {}
+
+        for serial, gas in self._cal_by_pair:
+            gases_by_serial.setdefault(serial, []).append(gas)
+            serials_by_gas.setdefault(gas, []).append(serial)
+
+        for values in gases_by_serial.values():
+            values.sort()
+        for values in serials_by_gas.values():
+            values.sort()
+
+        self._gases_by_serial = gases_by_serial
+        self._serials_by_gas = serials_by_gas
+        self._sorted_serials = sorted(gases_by_serial)
+
+
+# --------------------------------------------------
+# TSV PARSING (shared with calibration_index)
+# --------------------------------------------------
+
+def clean_serial(serial: str) -> str:
+    return serial.split("\x00")[0].strip()
+
+
+def _safe_float(value: str) -> Optional[float]:
+    if value is None:
+        return None
+    value = value.strip()
+    if value == "":
+        return None
+    return float(value)
+
+
+def iter_calibration_rows(filepath: str) -> Iterator[Tuple[str, Calibration]]:
+    """
+    Yield (serial, Calibration) for every valid row of the TSV,
+    in file order. Bad rows are reported and skipped.
+    """
+    with open(filepath, newline="") as f:
+        reader = csv.DictReader(f, delimiter="\t")
+
+        for row in reader:
+            try:
+                device = row["MFC"].split("-")[0]
+                serial = clean_serial(row["MFC"].split("-")[2])
+                gas = row["Cal Species"].strip().upper()
+
+                cal = Calibration(
+                    device=device,
+                    gas=gas,
+                    slope=float(row["Slope"]),
+                    offset=float(row["Offset"]),
+                    cal_min=float(row["Cal Min [SLPM]"]),
+                    cal_max=float(row["Cal Max [SLPM]"]),
+                    max_flow=_safe_float(row["Max Flow [SLPM]"]),
+                    cal_date=(row.get("Cal Date") or "").strip() or None,
+                )
+            except Exception as e:
+                print(f"Skipping bad calibration row: {e}", flush=True)
+                continue
+
+            yield serial, cal
+
+
+class CalibrationRegistry:
+    """
+    Process-wide, hot-reloadable calibration cache.
+
+    - Parses the calibration file once and serves every lookup from
+      the same immutable CalibrationLoader
+    - Re-stats the file at most every `check_interval` seconds and
+      reloads only when its mtime/size/inode changed
+    - Builds the new table off to the side and swaps the reference in
+      one assignment, so readers never observe a half-loaded table
+    - Keeps serving the previous table if a reload fails
+    """
+
+    def __init__(self, filepath: str, check_interval: float = 2.0):
+        self.filepath = filepath
+        self.check_interval = check_interval
+
+        self._lock = threading.Lock()
+        self._loader: Optional[CalibrationLoader] = None
+        self._stamp = None
+        self._next_check = 0.0
+
+    # --------------------------------------------------
+    # PUBLIC API — same lookups as CalibrationLoader
+    # --------------------------------------------------
+
+    def current(self) -> CalibrationLoader:
+        """Return the live table, reloading first if the file changed."""
+        loader = self._loader
+        if loader is not None and time.monotonic() < self._next_check:
+            return loader
+
+        with self._lock:
+            now = time.monotonic()
+            if self._loader is not None and now < self._next_check:
+                return self._loader
+            self._next_check = now + self.check_interval
+
+            stamp = self._file_stamp()
+            if self._loader is not None and stamp == self._stamp:
+                return self._loader
+
+            try:
+                fresh = CalibrationLoader(self.filepath)
+            except Exception as e:
+                if self._loader is None:
+                    raise
+                print(
+                    f"[CalibrationRegistry] Reload of {self.filepath} failed, "
+                    f"keeping previous table: {e}",
+                    flush=True,
+                )
+                return self._loader
+
+            # Single reference assignment: atomic for concurrent readers
+            self._loader = fresh
+            self._stamp = stamp
+            return fresh
+
+    def reload(self) -> CalibrationLoader:
+        """Force a stat on the next lookup."""
+        self._next_check = 0.0
+        return self.current()
+
+    def get(self, serial: str) -> Calibration:
+        return self.current().get(serial)
+
+    def get_for_gas(self, serial: str, gas: str) -> Calibration:
+        return self.current().get_for_gas(serial, gas)
+
+    def find_best_calibration(self, serial: str, gas: str):
+        return self.current().find_best_calibration(serial, gas)
+
+    def available_gases(self, serial: str):
+        return self.current().available_gases(serial)
+
+    def serials_for_gas(self, gas: str):
+        return self.current().serials_for_gas(gas)
+
+    def resolve_serial(self, partial: str):
+        return self.current().resolve_serial(partial)
+
+    # --------------------------------------------------
+    # INTERNALS
+    # --------------------------------------------------
+
+    def _file_stamp(self):
+        try:
+            st = os.stat(self.filepath)
+        except OSError:
+            return None
+        return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+
+_registries: Dict[str, CalibrationRegistry] = {}
+_registries_lock = threading.Lock()
+
+
+def get_registry(filepath: str) -> CalibrationRegistry:
+    """Return the shared CalibrationRegistry for `filepath` (created once)."""
+    key = os.path.abspath(filepath)
+    registry = _registries.get(key)
+    if registry is None:
+        with _registries_lock:
+            registry = _registries.get(key)
+            if registry is None:
+                registry = CalibrationRegistry(filepath)
+                _registries[key] = registry
+    return registry
+
 
 # --------------------------------------------------
 # OPTIONAL UTILITY (unchanged behavior)
 # --------------------------------------------------
 
 def apply_calibration(raw_flow: float, cal: Calibration) -> float:
-    corrected = float(cal.slope) * float(raw_flow) + float(cal.offset)
+    corrected = cal.slope * float(raw_flow) + cal.offset
 
     if corrected < cal.cal_min:
         corrected = cal.cal_min
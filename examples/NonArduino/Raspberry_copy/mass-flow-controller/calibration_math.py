@@ -0,0 +1,244 @@
+"""
+Calibration math: ProPar register counts <-> calibrated flow.
+
+    flow     = register * flow_per_count + offset
+    register = trunc((flow - offset) / slope * 32000 / 100)
+
+with flow_per_count = slope * 100 / 32000 (the slope is per percent of
+full scale, see Calibration). Setpoints are quantized by truncation to
+whole counts, and the flow the instrument will actually regulate to is
+the quantized register converted back.
+
+The scalar functions are what the publisher and the command line tools
+use for one node at a time. The *_array functions do the same on NumPy
+arrays of raw registers or flows, either against one Calibration or per
+sample against a CalibrationTable: every (serial, gas) calibration as
+coefficient columns, gathered by a row index per sample. Reprocessing a
+telemetry log, precomputing a setpoint table or validating calibrations
+across a fleet then costs a few array operations instead of a Python
+loop per value.
+
+NumPy is optional: only the array API needs it.
+"""
+
+import math
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple, Union
+
+from calibration_loader import (
+    REGISTER_FULL_SCALE,
+    Calibration,
+    clean_serial,
+    iter_calibration_rows,
+)
+
+try:
+    import numpy as np
+except ImportError:  # array API unavailable, scalar helpers still work
+    np = None
+
+
+# --------------------------------------------------
+# SCALAR
+# --------------------------------------------------
+
+def raw_to_calibrated_flow(raw_value: int, cal: Calibration) -> float:
+    return float(raw_value) * cal.flow_per_count + cal.offset
+
+
+def flow_to_register(desired_flow: float, cal: Calibration) -> Tuple[int, float, float]:
+    """
+    Returns:
+        (register, raw_percent, applied_flow): the truncated register,
+        the exact (unquantized) percent of full scale, and the flow the
+        register corresponds to.
+    """
+    # Divide, don't multiply by count_per_flow: the reciprocal's rounding
+    # truncates to a different register for a few % of setpoints
+    raw_percent = (desired_flow - cal.offset) / cal.slope
+    register = int(raw_percent * REGISTER_FULL_SCALE / 100)
+    applied_flow = float(register) * cal.flow_per_count + cal.offset
+    return register, raw_percent, applied_flow
+
+
+def register_to_percent(register: int) -> float:
+    return float(register) * 100.0 / REGISTER_FULL_SCALE
+
+
+def clip_flow(flow: float, cal: Calibration) -> float:
+    """Clamp a requested flow into the calibrated range."""
+    return max(cal.cal_min, min(cal.cal_max, flow))
+
+
+# --------------------------------------------------
+# CALIBRATION TABLE
+# --------------------------------------------------
+
+def _require_numpy():
+    if np is None:
+        raise RuntimeError("numpy is required for the calibration array API")
+
+
+class CalibrationTable:
+    """
+    Calibrations as columns (slope, offset, cal_min, cal_max,
+    flow_per_count, count_per_flow), one row per (serial, gas).
+
+    Each column has one extra trailing NaN entry, so a row index of -1
+    (unknown calibration) gathers NaN instead of another row's values.
+    """
+
+    COLUMNS = ("slope", "offset", "cal_min", "cal_max", "flow_per_count", "count_per_flow")
+
+    def __init__(self, entries: Iterable[Tuple[str, Calibration]]):
+        """
+        Args:
+            entries: (serial, Calibration) pairs; the last one wins for
+                a repeated (serial, gas)
+        """
+        _require_numpy()
+        by_key: Dict[Tuple[str, str], Calibration] = {}
+        for serial, cal in entries:
+            by_key[(clean_serial(serial), cal.gas.strip().upper())] = cal
+
+        self.keys: List[Tuple[str, str]] = sorted(by_key)
+        self.calibrations: List[Calibration] = [by_key[key] for key in self.keys]
+        self._rows: Dict[Tuple[str, str], int] = {key: i for i, key in enumerate(self.keys)}
+
+        for name in self.COLUMNS:
+            column = np.empty(len(self.keys) + 1, dtype=np.float64)
+            column[:-1] = [getattr(cal, name) for cal in self.calibrations]
+            column[-1] = math.nan
+            setattr(self, name, column)
+
+    @classmethod
+    def from_file(cls, tsv_path: str) -> "CalibrationTable":
+        return cls(iter_calibration_rows(tsv_path))
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def row(self, serial: str, gas: str) -> int:
+        """Row of one (serial, gas); KeyError if there is none."""
+        key = (clean_serial(serial), gas.strip().upper())
+        try:
+            return self._rows[key]
+        except KeyError:
+            raise KeyError(f"No calibration for serial={key[0]} gas={key[1]}") from None
+
+    def rows(self, serials: Sequence[str], gases: Union[str, Sequence[str]],
+             strict: bool = False):
+        """
+        Row index per sample, -1 where no calibration exists.
+
+        Only the distinct (serial, gas) pairs are looked up; the result
+        is gathered from those, so a log with millions of rows and a
+        handful of devices costs a handful of dict lookups.
+
+        Args:
+            gases: one gas for every sample, or one per sample
+            strict: raise KeyError instead of returning -1
+        """
+        serials = np.asarray(serials, dtype=object)
+        if isinstance(gases, str):
+            gases = np.full(serials.shape, gases, dtype=object)
+        else:
+            gases = np.asarray(gases, dtype=object)
+        if serials.shape != gases.shape:
+            raise ValueError("serials and gases must have the same shape")
+
+        # Factorize each column, then the pair as one integer code
+        serial_values, serial_codes = np.unique(serials.astype(str), return_inverse=True)
+        gas_values, gas_codes = np.unique(gases.astype(str), return_inverse=True)
+        pair_codes = serial_codes.ravel() * len(gas_values) + gas_codes.ravel()
+        unique, inverse = np.unique(pair_codes, return_inverse=True)
+
+        lookup = np.empty(len(unique), dtype=np.int64)
+        for i, code in enumerate(unique):
+            serial = str(serial_values[code // len(gas_values)])
+            gas = str(gas_values[code % len(gas_values)])
+            key = (clean_serial(serial), gas.strip().upper())
+            row = self._rows.get(key, -1)
+            if row < 0 and strict:
+                raise KeyError(f"No calibration for serial={key[0]} gas={key[1]}")
+            lookup[i] = row
+        return lookup[inverse].reshape(serials.shape)
+
+    def gather(self, name: str, rows):
+        """Column `name` per sample (NaN for row -1)."""
+        return getattr(self, name)[np.asarray(rows, dtype=np.int64)]
+
+
+# --------------------------------------------------
+# ARRAYS
+# --------------------------------------------------
+
+def _coefficients(cal, rows, *names):
+    if isinstance(cal, CalibrationTable):
+        if rows is None:
+            raise ValueError("Per-row conversion needs `rows` (CalibrationTable.rows)")
+        return [cal.gather(name, rows) for name in names]
+    return [getattr(cal, name) for name in names]
+
+
+def raw_to_flow_array(raw, cal: Union[Calibration, CalibrationTable], rows=None):
+    """
+    Calibrated flow for an array of raw registers.
+
+    Args:
+        cal: one Calibration for every sample, or a CalibrationTable
+            with `rows` (one row index per sample, broadcastable)
+    """
+    _require_numpy()
+    flow_per_count, offset = _coefficients(cal, rows, "flow_per_count", "offset")
+    return np.asarray(raw, dtype=np.float64) * flow_per_count + offset
+
+
+def flow_to_register_array(flows, cal: Union[Calibration, CalibrationTable], rows=None):
+    """
+    Vectorized flow_to_register.
+
+    Returns:
+        (registers int64, raw_percent, applied_flow) arrays; samples
+        without a calibration (row -1) get register 0 and NaN floats.
+    """
+    _require_numpy()
+    offset, slope, flow_per_count = _coefficients(
+        cal, rows, "offset", "slope", "flow_per_count"
+    )
+    # Same operation order as flow_to_register, so both truncate alike
+    raw_percent = (np.asarray(flows, dtype=np.float64) - offset) / slope
+    counts = raw_percent * REGISTER_FULL_SCALE / 100
+    valid = np.isfinite(counts)
+    registers = np.trunc(np.where(valid, counts, 0.0)).astype(np.int64)
+    applied = np.where(valid, registers * flow_per_count + offset, np.nan)
+    return registers, raw_percent, applied
+
+
+def clip_flow_array(flows, cal: Union[Calibration, CalibrationTable], rows=None):
+    """Clamp requested flows into each sample's calibrated range."""
+    _require_numpy()
+    cal_min, cal_max = _coefficients(cal, rows, "cal_min", "cal_max")
+    return np.minimum(np.maximum(np.asarray(flows, dtype=np.float64), cal_min), cal_max)
+
+
+def setpoint_table(cal: Calibration, step: Optional[float] = None):
+    """
+    Every setpoint the instrument can hold within the calibrated range.
+
+    Args:
+        step: flow spacing of the table (default: one register count)
+
+    Returns:
+        (flows, registers, applied_flow) arrays
+    """
+    _require_numpy()
+    if step is None:
+        low = flow_to_register(cal.cal_min, cal)[0]
+        high = flow_to_register(cal.cal_max, cal)[0]
+        registers = np.arange(min(low, high), max(low, high) + 1, dtype=np.int64)
+        registers = registers[(registers >= 0) & (registers <= REGISTER_FULL_SCALE)]
+        applied = registers * cal.flow_per_count + cal.offset
+        return applied.copy(), registers, applied
+    flows = np.arange(cal.cal_min, cal.cal_max + step / 2, step, dtype=np.float64)
+    registers, _, applied = flow_to_register_array(flows, cal)
+    return flows, registers, applied
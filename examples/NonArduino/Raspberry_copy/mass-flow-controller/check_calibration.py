@@ -1,28 +1,78 @@
 #!/usr/bin/env python3
+"""
+Batch calibration lookup.
+
+Usage:
+    check_calibration.py <calibration_file> <serial> <gas> [<serial> <gas> ...]
+    check_calibration.py <calibration_file> -   < queries.tsv
+
+Queries read from stdin are one "serial<TAB>gas" pair per line.
+Serials may be partial (prefix) or full MFC names; gas may be "*"
+to list every calibration of the matching devices.
+"""
 import sys
 
-def check_calibration_file(calib_file, serial, gas):
-    found = False
-    with open(calib_file, 'r') as f:
-        for line in f:
-            if line.strip() == '' or line.startswith('MFC'):
-                continue
-            parts = line.split('\t')
-            if len(parts) < 2:
-                continue
-            device = parts[0].strip()
-            cal_gas = parts[1].strip().upper()
-            if serial in device and cal_gas == gas.upper():
-                print(f"Found calibration: {line.strip()}")
+from calibration_loader import CalibrationLoader
+
+
+def _read_stdin_queries():
+    queries = []
+    for line in sys.stdin:
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        if "\t" in line:
+            serial, gas = line.split("\t", 1)
+        else:
+            serial, _, gas = line.partition(" ")
+        queries.append((serial.strip(), gas.strip() or "*"))
+    return queries
+
+
+def check_calibrations(loader, queries):
+    """
+    Resolve every (serial, gas) query through the loader's indexes.
+    Returns the number of queries with no match.
+    """
+    missing = 0
+
+    for serial, gas in queries:
+        serials = loader.resolve_serial(serial)
+        gas_key = gas.strip().upper()
+
+        found = False
+        for serial_key in serials:
+            gases = loader.available_gases(serial_key) if gas_key == "*" else [gas_key]
+            for gas_name in gases:
+                try:
+                    cal = loader.get_for_gas(serial_key, gas_name)
+                except KeyError:
+                    continue
+                print(
+                    f"Found calibration: {cal.device}-{serial_key} {cal.gas} "
+                    f"slope={cal.slope} offset={cal.offset} "
+                    f"range=[{cal.cal_min}, {cal.cal_max}]"
+                )
                 found = True
-    if not found:
-        print(f"No calibration found for device '{serial}' and gas '{gas}'")
+
+        if not found:
+            missing += 1
+            print(f"No calibration found for device '{serial}' and gas '{gas}'")
+
+    return missing
+
 
 if __name__ == "__main__":
-    if len(sys.argv) != 4:
-        print(f"Usage: {sys.argv[0]} <calibration_file> <device_serial> <gas>")
+    if len(sys.argv) == 3 and sys.argv[2] == "-":
+        queries = _read_stdin_queries()
+    elif len(sys.argv) >= 4 and len(sys.argv) % 2 == 0:
+        args = sys.argv[2:]
+        queries = list(zip(args[0::2], args[1::2]))
+    else:
+        print(f"Usage: {sys.argv[0]} <calibration_file> <device_serial> <gas> [<device_serial> <gas> ...]")
+        print(f"       {sys.argv[0]} <calibration_file> -   (serial<TAB>gas pairs on stdin)")
         sys.exit(1)
-    calib_file = sys.argv[1]
-    serial = sys.argv[2]
-    gas = sys.argv[3]
-    check_calibration_file(calib_file, serial, gas)
+
+    loader = CalibrationLoader(sys.argv[1])
+    missing = check_calibrations(loader, queries)
+    sys.exit(1 if missing else 0)
@@ -0,0 +1,164 @@
+"""
+Binary data channel from the status publisher to main.cpp.
+
+main.cpp used to scrape STATUS:/PACKED: lines out of the publisher's
+stdout, sharing the pipe with every INFO/DEBUG message and a full
+COMBINED JSON dump per cycle. When it passes a pipe write end in
+MFC_DATA_FD, the publisher instead sends typed, length-prefixed frames
+there, one os.write() per poll cycle, and stdout is left to human logs.
+
+    frame        u32 length (of type + payload), u8 type, payload
+    STATUS_CYCLE f64 epoch, u8 gps_fix, u8 count, count x record:
+                 u8 mfc_id, u8 flags (bit 0: setpoint valid),
+                 char device[2], u8 gas code (0xFF unknown),
+                 f32 flow, f32 setpoint
+    PACKED_UPLINK the 0x22 LoRa payload (see status_payload.py)
+
+All fields are little endian. The fd is non-blocking: if main.cpp falls
+behind (it sleeps between loops and blocks on uplinks), whole cycles are
+dropped rather than stalling the bus, and a partially written frame is
+always completed before the next one so the stream stays in sync.
+"""
+
+import errno
+import logging
+import os
+import struct
+from typing import Iterable, Optional, Sequence, Tuple
+
+log = logging.getLogger(__name__)
+
+FRAME_HEADER = struct.Struct("<IB")
+STATUS_CYCLE = 0x01
+PACKED_UPLINK = 0x02
+
+CYCLE_HEADER = struct.Struct("<dBB")
+STATUS_RECORD = struct.Struct("<BB2sBff")
+SETPOINT_VALID = 0x01
+
+# main.cpp refuses frames above this size (corrupt stream)
+MAX_FRAME = 64 * 1024
+
+
+def encode_frame(frame_type: int, payload: bytes) -> bytes:
+    if len(payload) + 1 > MAX_FRAME:
+        raise ValueError(f"Frame too large ({len(payload)} bytes)")
+    return FRAME_HEADER.pack(len(payload) + 1, frame_type) + payload
+
+
+def encode_status_cycle(epoch: float, gps_fix: bool, nodes: Sequence[dict]) -> bytes:
+    """
+    Args:
+        nodes: [{"id", "device", "gas", "flow", "setpoint"}]; setpoint
+            and gas may be None
+    """
+    if len(nodes) > 255:
+        raise ValueError("At most 255 nodes per status cycle")
+    parts = [CYCLE_HEADER.pack(epoch, 1 if gps_fix else 0, len(nodes))]
+    for node in nodes:
+        setpoint = node.get("setpoint")
+        gas = node.get("gas")
+        parts.append(STATUS_RECORD.pack(
+            node["id"],
+            SETPOINT_VALID if setpoint is not None else 0,
+            str(node.get("device") or "XX").encode("ascii", "replace")[:2].ljust(2, b"X"),
+            gas if gas is not None and 0 <= gas <= 0xFE else 0xFF,
+            node["flow"],
+            setpoint if setpoint is not None else 0.0,
+        ))
+    return b"".join(parts)
+
+
+class DataChannel:
+    """Non-blocking frame writer on an inherited pipe fd."""
+
+    def __init__(self, fd: int):
+        self.fd = fd
+        os.set_blocking(fd, False)
+        self._backlog = b""         # tail of a partially written frame
+        self._dropped = 0
+        self._closed = False
+
+    @classmethod
+    def from_env(cls, name: str = "MFC_DATA_FD") -> Optional["DataChannel"]:
+        """Channel on the fd number in `name`, or None if unset/invalid."""
+        value = os.getenv(name, "").strip()
+        if not value:
+            return None
+        try:
+            fd = int(value)
+            os.fstat(fd)
+            return cls(fd)
+        except (ValueError, OSError) as e:
+            log.warning("Ignoring %s=%r: %s", name, value, e)
+            return None
+
+    @property
+    def closed(self) -> bool:
+        return self._closed
+
+    def send(self, frames: Iterable[Tuple[int, bytes]]) -> bool:
+        """
+        Write all frames of one cycle with a single os.write().
+
+        Returns:
+            True if the whole cycle was written (or is queued behind a
+            partial write), False if it was dropped.
+        """
+        if self._closed:
+            return False
+        data = b"".join(encode_frame(t, payload) for t, payload in frames)
+
+        if self._backlog and not self._write_backlog():
+            self._drop()
+            return False
+        try:
+            written = os.write(self.fd, data)
+        except BlockingIOError:
+            self._drop()
+            return False
+        except OSError as e:
+            self._fail(e)
+            return False
+
+        if written < len(data):
+            # Never leave half a frame: the rest goes out before anything else
+            self._backlog = data[written:]
+        if self._dropped:
+            log.warning("Data channel dropped %d cycles (reader too slow)", self._dropped)
+            self._dropped = 0
+        return True
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        try:
+            os.close(self.fd)
+        except OSError:
+            pass
+
+    # --------------------------------------------------
+    # INTERNALS
+    # --------------------------------------------------
+
+    def _write_backlog(self) -> bool:
+        try:
+            written = os.write(self.fd, self._backlog)
+        except BlockingIOError:
+            return False
+        except OSError as e:
+            self._fail(e)
+            return False
+        self._backlog = self._backlog[written:]
+        return not self._backlog
+
+    def _drop(self):
+        self._dropped += 1
+
+    def _fail(self, e: OSError):
+        if e.errno == errno.EPIPE:
+            log.warning("Data channel reader went away; channel closed")
+        else:
+            log.error("Data channel write failed: %s; channel closed", e)
+        self.close()
@@ -0,0 +1,348 @@
+"""
+Closed-loop flow trim on top of the open-loop setpoint.
+
+flow_to_register turns a requested flow into a register once; whatever
+the instrument then actually delivers (quantization, its own tracking
+offset) stays as a persistent flow error until the next downlink. With
+trim enabled, FlowTrimLoop re-reads the measured flow of every node
+that has a requested flow every `interval` seconds and adds a PI
+correction, in register counts, to the planned register:
+
+    error    = (requested flow - calibrated measured flow) * count_per_flow
+    trim     = kp * error + integral,  integral += ki * error * dt
+
+The correction is bounded to +-max_trim counts and may move at most
+`rate` counts per second. The integral only accumulates while the
+output is not saturated (or while the error pulls it back out), so a
+long saturation cannot wind it up. After each new setpoint the loop
+waits `settle` seconds for the instrument's own controller before it
+looks at the error again. A node whose measure read or trim write fails
+`max_failures` times in a row drops to "fault" and is left alone until
+its next setpoint, or until trim is enabled for it again.
+
+Trim writes and setpoint writes share the bus queue (FIFO within a
+priority). The publisher calls set_target() before it queues a setpoint
+and the loop queues its own write under the same lock after checking
+the node's generation, so a trim computed for the old setpoint is either
+queued ahead of the new one or not at all.
+"""
+
+import logging
+import threading
+import time
+from concurrent.futures import Future
+from dataclasses import dataclass
+from typing import Callable, Dict, Optional
+
+from calibration_loader import REGISTER_FULL_SCALE, Calibration
+from calibration_math import raw_to_calibrated_flow
+
+log = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class TrimConfig:
+    kp: float = 0.2                 # counts per count of error
+    ki: float = 0.5                 # counts per count of error per second
+    max_trim: float = 640.0         # +-counts (2 % of full scale)
+    rate: float = 160.0             # counts per second (0.5 % of full scale)
+    interval: float = 1.0           # seconds between measure reads
+    settle: float = 3.0             # seconds after a new setpoint
+    deadband: float = 2.0           # counts of error ignored
+    max_failures: int = 3
+
+
+def _clamp(value: float, low: float, high: float) -> float:
+    return max(low, min(high, value))
+
+
+class PITrim:
+    """PI state of one node; pure arithmetic (no bus, no clock)."""
+
+    def __init__(self, config: TrimConfig):
+        self.config = config
+        self.integral = 0.0
+        self.trim = 0.0
+
+    def reset(self):
+        self.integral = 0.0
+        self.trim = 0.0
+
+    def update(self, error: float, dt: float, base_register: int) -> float:
+        """
+        New trim (counts) for an error of `error` counts after `dt` seconds.
+
+        Args:
+            base_register: the open-loop register; base + trim is kept
+                within 0..REGISTER_FULL_SCALE
+        """
+        c = self.config
+        if abs(error) <= c.deadband:
+            error = 0.0
+
+        candidate = self.integral + c.ki * error * dt
+        desired = c.kp * error + candidate
+
+        low = max(-c.max_trim, -base_register, self.trim - c.rate * dt)
+        high = min(c.max_trim, REGISTER_FULL_SCALE - base_register, self.trim + c.rate * dt)
+        limited = _clamp(desired, low, high)
+
+        # Conditional integration: freeze the integral while saturated,
+        # unless the error already pulls the output back into range
+        if limited == desired or (desired > limited) != (error > 0):
+            self.integral = _clamp(candidate, -c.max_trim, c.max_trim)
+        self.trim = limited
+        return limited
+
+
+class _Node:
+    __slots__ = ("target", "register", "cal", "pi", "state", "settle_until",
+                 "next_at", "last_at", "failures", "written", "flow", "error", "generation")
+
+    def __init__(self, config: TrimConfig):
+        self.target: Optional[float] = None
+        self.register = 0
+        self.cal: Optional[Calibration] = None
+        self.pi = PITrim(config)
+        self.state = "idle"
+        self.settle_until = 0.0
+        self.next_at = 0.0
+        self.last_at: Optional[float] = None
+        self.failures = 0
+        self.written: Optional[int] = None     # None: device register unknown
+        self.flow: Optional[float] = None
+        self.error: Optional[float] = None
+        # Bumped by every setpoint/enable/release; stale trims are dropped
+        self.generation = 0
+
+
+class FlowTrimLoop:
+    """Background PI trim of every enabled node with a requested flow."""
+
+    def __init__(self, read_measure: Callable[[int], Optional[int]],
+                 submit_write: Callable[[int, int], Future],
+                 config: TrimConfig = TrimConfig(), enabled: bool = True,
+                 clock: Callable[[], float] = time.monotonic):
+        """
+        Args:
+            read_measure: mfc_id -> measure register (None on failure);
+                runs on the loop thread without the lock
+            submit_write: (mfc_id, register) -> Future of success; only
+                queues the write and must not block, it is called with
+                the lock held so no setpoint can slip in front of it
+            enabled: trim nodes by default (else only after enable())
+        """
+        self.read_measure = read_measure
+        self.submit_write = submit_write
+        self.config = config
+        self.default_enabled = enabled
+        self._clock = clock
+
+        self._cond = threading.Condition()
+        self._nodes: Dict[int, _Node] = {}
+        self._enabled: Dict[int, bool] = {}
+        self._closed = False
+        self._thread = threading.Thread(target=self._loop, name="flow-trim", daemon=True)
+        self._thread.start()
+
+    # --------------------------------------------------
+    # PUBLIC
+    # --------------------------------------------------
+
+    def set_target(self, mfc_id: int, flow: float, register: int, cal: Calibration):
+        """
+        A setpoint is about to be queued: trim around `register` toward
+        `flow`. Call before queuing the write; report its outcome with
+        readback() or release().
+        """
+        with self._cond:
+            node = self._nodes.setdefault(mfc_id, _Node(self.config))
+            node.generation += 1
+            node.target = flow
+            node.register = register
+            node.cal = cal
+            node.written = register
+            node.pi.reset()             # the write replaced any trimmed register
+            node.failures = 0
+            node.last_at = None
+            now = self._clock()
+            node.settle_until = now + self.config.settle
+            node.next_at = node.settle_until
+            node.state = self._armed_state(mfc_id, node)     # clears a fault
+            self._cond.notify_all()
+
+    def readback(self, mfc_id: int, register: int, readback: Optional[int]):
+        """
+        The setpoint write of `register` succeeded and read back as
+        `readback` (None if the read failed). A readback that differs
+        means the device does not hold `register`; the next step then
+        writes even if its trimmed register equals the planned one.
+        """
+        with self._cond:
+            node = self._nodes.get(mfc_id)
+            if node is not None and node.register == register and readback != register:
+                node.written = readback
+
+    def release(self, mfc_id: int):
+        """The setpoint write failed: stop trimming until the next setpoint."""
+        with self._cond:
+            node = self._nodes.get(mfc_id)
+            if node is None:
+                return
+            node.generation += 1
+            node.target = None
+            node.written = None
+            node.pi.reset()
+            if node.state != "fault":
+                node.state = self._armed_state(mfc_id, node)
+            self._cond.notify_all()
+
+    def enable(self, mfc_id: int, enabled: bool = True) -> Optional[int]:
+        """
+        Turn trim on/off for one node (clears a fault).
+
+        Returns:
+            the open-loop register to restore when disabling a node that
+            was trimmed, else None
+        """
+        with self._cond:
+            self._enabled[mfc_id] = enabled
+            node = self._nodes.get(mfc_id)
+            if node is None:
+                return None
+            node.generation += 1
+            restore = None
+            if not enabled and node.written is not None and node.written != node.register:
+                restore = node.register
+                node.written = node.register
+            node.pi.reset()
+            node.failures = 0
+            node.last_at = None
+            node.state = self._armed_state(mfc_id, node)
+            node.next_at = max(self._clock(), node.settle_until)
+            self._cond.notify_all()
+            return restore
+
+    def target(self, mfc_id: int) -> Optional[float]:
+        """Requested flow of a node trim is actively holding, else None."""
+        with self._cond:
+            node = self._nodes.get(mfc_id)
+            if node is None or node.state != "active":
+                return None
+            return node.target
+
+    def progress(self) -> Dict[int, dict]:
+        """Trim state per node that ever had a setpoint."""
+        with self._cond:
+            return {
+                i: {
+                    "state": node.state,
+                    "target": round(node.target, 4) if node.target is not None else None,
+                    "flow": round(node.flow, 4) if node.flow is not None else None,
+                    "error": round(node.error, 4) if node.error is not None else None,
+                    "register": node.register,
+                    "trim": round(float(node.pi.trim), 1),
+                }
+                for i, node in sorted(self._nodes.items())
+            }
+
+    def close(self, timeout: float = 5.0):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join(timeout)
+
+    # --------------------------------------------------
+    # INTERNALS
+    # --------------------------------------------------
+
+    def _armed_state(self, mfc_id: int, node: _Node) -> str:
+        if not self._enabled.get(mfc_id, self.default_enabled):
+            return "disabled"
+        if node.target is None or node.target <= 0 or node.cal is None:
+            return "idle"
+        return "active"
+
+    def _loop(self):
+        while True:
+            with self._cond:
+                while True:
+                    if self._closed:
+                        return
+                    now = self._clock()
+                    active = [(i, n) for i, n in self._nodes.items() if n.state == "active"]
+                    due = [(i, n) for i, n in active if n.next_at <= now]
+                    if due:
+                        break
+                    wait = min((n.next_at for _, n in active), default=None)
+                    self._cond.wait(None if wait is None else wait - now)
+                for _, node in due:
+                    node.next_at = now + self.config.interval
+
+            for mfc_id, node in due:
+                self._step(mfc_id, node)
+
+    def _step(self, mfc_id: int, node: _Node):
+        with self._cond:
+            generation = node.generation
+        try:
+            measure = self.read_measure(mfc_id)
+        except Exception as e:
+            log.debug("Trim read of MFC %s failed: %s", mfc_id, e)
+            measure = None
+
+        with self._cond:
+            if node.state != "active" or node.generation != generation:
+                return          # a new setpoint or disable during the read
+            if measure is None:
+                self._fail(mfc_id, node, "measure read")
+                return
+            now = self._clock()
+            dt = self.config.interval if node.last_at is None else now - node.last_at
+            # A stalled loop must not turn into one huge integral step
+            dt = min(dt, 3 * self.config.interval)
+            node.last_at = now
+            node.flow = raw_to_calibrated_flow(measure, node.cal)
+            node.error = node.target - node.flow
+            trim = node.pi.update(node.error * node.cal.count_per_flow, dt, node.register)
+            register = int(round(node.register + trim))
+            if register == node.written:
+                node.failures = 0
+                return
+            # Queued under the lock: a setpoint whose set_target() comes
+            # later also queues later and overwrites this write
+            try:
+                future = self.submit_write(mfc_id, register)
+            except Exception as e:
+                log.debug("Trim write to MFC %s failed: %s", mfc_id, e)
+                future = None
+
+        ok = False
+        if future is not None:
+            try:
+                ok = bool(future.result())
+            except Exception as e:
+                log.debug("Trim write to MFC %s failed: %s", mfc_id, e)
+
+        with self._cond:
+            if node.state != "active" or node.generation != generation:
+                return          # a new setpoint or disable followed the write
+            if ok:
+                node.failures = 0
+                node.written = register
+                log.debug(
+                    "TRIM mfc=%s target=%.4f flow=%.4f trim=%.1f register=%s",
+                    mfc_id, node.target, node.flow, node.pi.trim, register,
+                )
+            else:
+                self._fail(mfc_id, node, "register write")
+
+    def _fail(self, mfc_id: int, node: _Node, what: str):
+        node.failures += 1
+        if node.failures >= self.config.max_failures:
+            node.state = "fault"
+            node.pi.reset()
+            log.warning(
+                "Flow trim disabled for MFC %s: %d failed %ss in a row",
+                mfc_id, node.failures, what,
+            )
@@ -1,46 +1,177 @@
+"""
+GPS time source.
+
+A background thread keeps /dev/serial0 open, parses every RMC sentence
+and records the last valid fix together with the monotonic clock at
+which it arrived. get_timestamp() then extrapolates from that anchor
+with time.monotonic(): no serial I/O on the caller's path, sub-second
+resolution, and immune to system clock steps. When the fix is older
+than STALE_AFTER seconds (no antenna, no lock, no receiver) it falls
+back to the system clock.
+"""
+
+import os
+import threading
 import time
+from datetime import datetime, timezone
+from typing import NamedTuple, Optional
+
 import serial
 import pynmea2
-from datetime import datetime, timezone
 
+GPS_PORT = '/dev/serial0'
+GPS_BAUD = 9600
+# A fix older than this (seconds) is stale: RMC normally arrives at 1 Hz
+STALE_AFTER = float(os.getenv("MFC_GPS_STALE", "3.0"))
+# Delay between attempts to (re)open the GPS port
+REOPEN_DELAY = 5.0
 
-def get_timestamp(timeout: float = 2.0) -> str:
-    """Try to read an RMC sentence from GPS and return UTC timestamp in ISO format.
-    Falls back to system UTC time if GPS isn't available or no valid sentence is received.
-    """
-    start = time.time()
-    try:
-        ser = serial.Serial('/dev/serial0', 9600, timeout=0.5)
-    except Exception:
-        return datetime.now(timezone.utc).replace(microsecond=0).isoformat().replace('+00:00', 'Z')
-
-    try:
-        while time.time() - start < timeout:
+
+class GpsTime(NamedTuple):
+    utc: datetime
+    fresh: bool                 # True: extrapolated from a recent GPS fix
+    age: Optional[float]        # seconds since that fix, None if never fixed
+
+
+def format_timestamp(utc: datetime) -> str:
+    return utc.isoformat(timespec='milliseconds').replace('+00:00', 'Z')
+
+
+class GpsTimeService:
+    """Long-lived NMEA reader keeping the last fix and its monotonic anchor."""
+
+    def __init__(self, port: str = GPS_PORT, baud: int = GPS_BAUD,
+                 stale_after: float = STALE_AFTER):
+        self.port = port
+        self.baud = baud
+        self.stale_after = stale_after
+
+        self._lock = threading.Lock()
+        self._fix_event = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        # (utc epoch seconds, time.monotonic()) of the last valid RMC
+        self._anchor: Optional[tuple] = None
+
+    # --------------------------------------------------
+    # LIFECYCLE
+    # --------------------------------------------------
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="gps", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout: float = 2.0):
+        self._stop.set()
+        thread = self._thread
+        if thread is not None:
+            thread.join(timeout)
+        self._thread = None
+
+    def wait_for_fix(self, timeout: float) -> bool:
+        return self._fix_event.wait(timeout)
+
+    # --------------------------------------------------
+    # TIME
+    # --------------------------------------------------
+
+    def now(self) -> GpsTime:
+        anchor = self._anchor
+        if anchor is not None:
+            fix_epoch, fix_mono = anchor
+            age = time.monotonic() - fix_mono
+            if age <= self.stale_after:
+                utc = datetime.fromtimestamp(fix_epoch + age, timezone.utc)
+                return GpsTime(utc, True, age)
+        else:
+            age = None
+        return GpsTime(datetime.now(timezone.utc), False, age)
+
+    # --------------------------------------------------
+    # INTERNALS
+    # --------------------------------------------------
+
+    def _run(self):
+        while not self._stop.is_set():
             try:
-                line = ser.readline().decode('ascii', errors='replace').strip()
+                ser = serial.Serial(self.port, self.baud, timeout=0.5)
             except Exception:
+                self._stop.wait(REOPEN_DELAY)
                 continue
-            if not line:
-                continue
-            if line.startswith(('$GPRMC', '$GNRMC')):
+
+            try:
+                while not self._stop.is_set():
+                    line = ser.readline()
+                    if line:
+                        self._handle_line(line)
+            except Exception:
+                # Port vanished or read error: reopen after a pause
+                self._stop.wait(REOPEN_DELAY)
+            finally:
                 try:
-                    msg = pynmea2.parse(line)
-                    now = datetime.now(timezone.utc)
-                    ts = datetime(now.year, now.month, now.day,
-                                  msg.timestamp.hour, msg.timestamp.minute, msg.timestamp.second,
-                                  tzinfo=timezone.utc)
-                    return ts.replace(microsecond=0).isoformat().replace('+00:00', 'Z')
+                    ser.close()
                 except Exception:
-                    continue
-    finally:
+                    pass
+
+    def _handle_line(self, raw: bytes):
+        received = time.monotonic()
+        line = raw.decode('ascii', errors='replace').strip()
+        if not line.startswith(('$GPRMC', '$GNRMC')):
+            return
         try:
-            ser.close()
+            msg = pynmea2.parse(line)
         except Exception:
-            pass
+            return
+        # 'A' = valid fix; 'V' sentences carry the receiver's free-running clock
+        if getattr(msg, 'status', None) != 'A' or not msg.datestamp or not msg.timestamp:
+            return
+
+        fix = datetime.combine(msg.datestamp, msg.timestamp.replace(tzinfo=None))
+        fix = fix.replace(tzinfo=timezone.utc)
+        self._anchor = (fix.timestamp(), received)
+        self._fix_event.set()
+
+
+_service: Optional[GpsTimeService] = None
+_service_lock = threading.Lock()
+
+
+def get_service() -> GpsTimeService:
+    """Process-wide GPS service, started on first use."""
+    global _service
+    with _service_lock:
+        if _service is None:
+            _service = GpsTimeService()
+            _service.start()
+        return _service
+
+
+def get_time() -> GpsTime:
+    """Current UTC time plus fix freshness; never blocks on the GPS port."""
+    return get_service().now()
+
+
+def get_timestamp() -> str:
+    """UTC timestamp in ISO format with milliseconds, e.g. 2024-06-20T16:32:24.125Z.
+    Extrapolated from the last GPS fix; system UTC time if the fix is stale.
+    """
+    return format_timestamp(get_time().utc)
+
 
-    # fallback
-    return datetime.now(timezone.utc).replace(microsecond=0).isoformat().replace('+00:00', 'Z')
+def stop_service():
+    global _service
+    with _service_lock:
+        service, _service = _service, None
+    if service is not None:
+        service.stop()
 
 
 if __name__ == '__main__':
-    print(get_timestamp())
+    service = get_service()
+    service.wait_for_fix(2.0)
+    t = service.now()
+    print(format_timestamp(t.utc), "gps" if t.fresh else "system")
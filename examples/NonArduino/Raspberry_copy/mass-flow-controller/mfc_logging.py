@@ -0,0 +1,155 @@
+"""
+Logging setup for the status publisher, with an in-memory flight recorder.
+
+Diagnostics go through the stdlib `logging` module with %-style
+arguments, so a message is only formatted when something actually
+emits it. Stdout keeps the "LEVEL: message" lines main.cpp forwards
+(INFO:, WARNING:, ERROR:), at MFC_LOG_LEVEL.
+
+Independently of that level, the FlightRecorder handler keeps the last
+N records of every level (DEBUG included) in a ring buffer. Records are
+stored unformatted; they are only rendered when the buffer is dumped:
+to MFC_FLIGHT_DUMP when an ERROR is logged (at most once a minute, from
+a background thread) or on demand through the "debug_dump" socket
+action. Post-mortem detail costs one LogRecord per call on the hot
+path, not a formatted string and a stdout flush.
+"""
+
+import collections
+import logging
+import os
+import sys
+import threading
+import time
+from typing import List, Optional
+
+DEFAULT_CAPACITY = 2000
+DEFAULT_DUMP_INTERVAL = 60.0
+
+CONSOLE_FORMAT = "%(levelname)s: %(message)s"
+RECORD_FORMAT = "%(asctime)s.%(msecs)03dZ %(levelname)s %(name)s: %(message)s"
+RECORD_DATEFMT = "%Y-%m-%dT%H:%M:%S"
+
+
+class FlightRecorder(logging.Handler):
+    """Bounded ring of unformatted LogRecords, dumped on error or request."""
+
+    def __init__(self, capacity: int = DEFAULT_CAPACITY, dump_path: Optional[str] = None,
+                 dump_interval: float = DEFAULT_DUMP_INTERVAL):
+        """
+        Args:
+            capacity: records kept (oldest dropped first)
+            dump_path: file the buffer is appended to on ERROR (None: never)
+            dump_interval: minimum seconds between automatic dumps
+        """
+        super().__init__(logging.DEBUG)
+        self.dump_path = dump_path
+        self.dump_interval = dump_interval
+        formatter = logging.Formatter(RECORD_FORMAT, RECORD_DATEFMT)
+        formatter.converter = time.gmtime
+        self.setFormatter(formatter)
+
+        self._records = collections.deque(maxlen=capacity)
+        self._dump_lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._last_dump: Optional[float] = None
+
+    def handle(self, record: logging.LogRecord) -> bool:
+        # deque.append is atomic: no handler lock, no formatting here
+        self._records.append(record)
+        if record.levelno >= logging.ERROR and self.dump_path:
+            self._dump_on_error(record)
+        return True
+
+    def emit(self, record: logging.LogRecord):
+        self._records.append(record)
+
+    def lines(self, limit: Optional[int] = None) -> List[str]:
+        """Render the newest `limit` records (all by default), oldest first."""
+        records = list(self._records)
+        if limit is not None:
+            records = records[-limit:] if limit > 0 else []
+        return [self._render(r) for r in records]
+
+    def dump(self, path: Optional[str] = None, reason: str = "requested") -> int:
+        """Append the whole buffer to `path` (default dump_path); returns records written."""
+        return self._write(path or self.dump_path, list(self._records), reason)
+
+    # --------------------------------------------------
+    # INTERNALS
+    # --------------------------------------------------
+
+    def _render(self, record: logging.LogRecord) -> str:
+        try:
+            return self.format(record)
+        except Exception as e:
+            return f"{record.levelname} {record.name}: <unformattable {record.msg!r}: {e}>"
+
+    def _dump_on_error(self, record: logging.LogRecord):
+        now = time.monotonic()
+        with self._dump_lock:
+            if self._last_dump is not None and now - self._last_dump < self.dump_interval:
+                return
+            self._last_dump = now
+        snapshot = list(self._records)
+        reason = f"error: {self._render(record)}"
+        threading.Thread(
+            target=self._write, args=(self.dump_path, snapshot, reason),
+            name="flight-dump", daemon=True,
+        ).start()
+
+    def _write(self, path: Optional[str], records, reason: str) -> int:
+        if not path:
+            return 0
+        stamp = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+        text = "\n".join(self._render(r) for r in records)
+        try:
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with self._write_lock, open(path, "a") as f:
+                f.write(f"=== flight recorder {stamp} ({len(records)} records, {reason}) ===\n")
+                if text:
+                    f.write(text + "\n")
+        except OSError as e:
+            # Not through logging: an ERROR here would trigger another dump
+            print(f"WARNING: Flight recorder dump to {path} failed: {e}", flush=True)
+            return 0
+        return len(records)
+
+
+_recorder: Optional[FlightRecorder] = None
+
+
+def setup_logging(level: str = "INFO", capacity: int = DEFAULT_CAPACITY,
+                  dump_path: Optional[str] = None) -> FlightRecorder:
+    """
+    Route all loggers to stdout at `level` and into the flight recorder.
+
+    Safe to call more than once; the handlers are replaced.
+    """
+    global _recorder
+    # Keep the "FATAL:" prefix the publisher always used
+    logging.addLevelName(logging.CRITICAL, "FATAL")
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        if getattr(handler, "_mfc_handler", False):
+            root.removeHandler(handler)
+
+    console = logging.StreamHandler(sys.stdout)
+    console.setLevel(getattr(logging, str(level).upper(), logging.INFO))
+    console.setFormatter(logging.Formatter(CONSOLE_FORMAT))
+    console._mfc_handler = True
+
+    _recorder = FlightRecorder(capacity, dump_path)
+    _recorder._mfc_handler = True
+
+    root.addHandler(console)
+    root.addHandler(_recorder)
+    # Everything reaches the recorder; the console handler filters
+    root.setLevel(logging.DEBUG)
+    return _recorder
+
+
+def get_recorder() -> Optional[FlightRecorder]:
+    return _recorder
@@ -3,7 +3,9 @@ import serial
 import threading
 import sys
 from calibration_loader import CalibrationLoader
+from calibration_math import clip_flow, flow_to_register, raw_to_calibrated_flow
 from shared_resources import get_bus
+from serial_io import transact
 
 PORT = '/dev/ttyUSB0'
 BAUD = 38400
@@ -79,27 +81,10 @@ def parse_raw_value(reply: bytes) -> int:
     return int(value_hex, 16)
 
 
-def raw_to_calibrated_flow(raw_value: int, cal) -> float:
-    raw_percent = float(raw_value) * 100.0 / 32000.0
-    return float(cal.slope) * raw_percent + float(cal.offset)
-
-
-def flow_to_register(desired_flow: float, cal) -> tuple[int, float, float]:
-    raw_percent = (desired_flow - float(cal.offset)) / float(cal.slope)
-    register = int(raw_percent * 32000 / 100)
-    applied_raw_percent = float(register) * 100.0 / 32000.0
-    applied_flow = float(cal.slope) * applied_raw_percent + float(cal.offset)
-    return register, raw_percent, applied_flow
-
 # ------------------ Serial IO ------------------
 
 def send_command(cmd: bytes) -> bytes:
-    ser.reset_input_buffer()
-    ser.write(cmd)
-    reply = ser.read(100)
-    if not reply:
-        raise RuntimeError("No response")
-    return reply
+    return transact(ser, cmd)
 
 # ------------------ Control loop ------------------
 
@@ -130,24 +115,17 @@ def control_loop(cal, address):
             if user.lower() == 'q':
                 break
 
-            desired_flow = float(user)
-            
-            if desired_flow < cal.cal_min:
-                desired_flow = cal.cal_min
-            if desired_flow > cal.cal_max:
-                desired_flow = cal.cal_max
-   
+            desired_flow = clip_flow(float(user), cal)
+
             # if not (cal.cal_min <= desired_flow <= cal.cal_max):
             #     print("Outside calibration range")
             #     continue
 
-            raw_percent = (desired_flow - cal.offset) / cal.slope
-
-            if not (0 <= raw_percent <= 100):
+            register, raw_percent_quantized, applied_flow = flow_to_register(desired_flow, cal)
+            if not (0 <= raw_percent_quantized <= 100):
                 print("Command exceeds device limits")
                 continue
 
-            register, raw_percent_quantized, applied_flow = flow_to_register(desired_flow, cal)
             if not (0 <= register <= 32000):
                 print("Quantized register exceeds device limits")
                 continue
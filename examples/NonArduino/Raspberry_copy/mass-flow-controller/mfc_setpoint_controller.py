@@ -1,7 +1,8 @@
 import sys
-from calibration_loader import CalibrationLoader
+from calibration_index import open_calibrations
+from calibration_math import clip_flow, flow_to_register, register_to_percent
 from shared_resources import get_bus
-from socket_commands import send_setpoint_command
+from socket_commands import MfcClient
 
 CAL_FILE = '/home/pi/Documents/Radiolib/examples/NonArduino/Raspberry_copy/mass-flow-controller/MFCCalibrations-ReadDirectlyByFlareCode.txt'
 
@@ -27,14 +28,6 @@ def normalize_serial(serial: str) -> str:
     return serial.split("\x00")[0]
 
 
-def flow_to_register(desired_flow: float, cal) -> tuple[int, float, float, float]:
-    raw_percent = (desired_flow - float(cal.offset)) / float(cal.slope)
-    register = int(raw_percent * 32000 / 100)
-    applied_raw_percent = float(register) * 100.0 / 32000.0
-    applied_flow = float(cal.slope) * applied_raw_percent + float(cal.offset)
-    return register, raw_percent, applied_raw_percent, applied_flow
-
-
 def preview_quantized_setpoint(mfc_index: int, desired_flow: float, gas_code: int):
     try:
         bus = get_bus()
@@ -50,11 +43,12 @@ def preview_quantized_setpoint(mfc_index: int, desired_flow: float, gas_code: in
             print(f"INFO: No calibration preview (unsupported gas code 0x{gas_code:02X})")
             return
 
-        loader = CalibrationLoader(CAL_FILE)
+        loader = open_calibrations(CAL_FILE)
         cal = loader.get_for_gas(serial_key, gas_name)
 
-        desired_flow = max(float(cal.cal_min), min(float(cal.cal_max), desired_flow))
-        register, raw_percent, applied_raw_percent, applied_flow = flow_to_register(desired_flow, cal)
+        desired_flow = clip_flow(desired_flow, cal)
+        register, raw_percent, applied_flow = flow_to_register(desired_flow, cal)
+        applied_raw_percent = register_to_percent(register)
 
         print(
             "Quantized preview: "
@@ -84,8 +78,12 @@ def main():
     preview_quantized_setpoint(mfc_index, desired_flow, gas)
     
     print(f"Sending setpoint command: mfc_index={mfc_index}, desired_flow={desired_flow}")
-    response = send_setpoint_command(mfc_index, desired_flow, timeout=5.0)
-    
+    try:
+        with MfcClient(timeout=5.0) as client:
+            response = client.setpoint(mfc_index, desired_flow)
+    except Exception as e:
+        response = {"success": False, "message": f"Socket error: {e!r}"}
+
     if response["success"]:
         print(f"Success! {response['message']}")
     else:
@@ -1,21 +1,102 @@
+import asyncio
 import time
 import sys
 import json
+import logging
 import os
-import csv
-from calibration_loader import CalibrationLoader
+from dataclasses import dataclass
+from typing import Optional
+from calibration_loader import REGISTER_FULL_SCALE, Calibration, get_registry
+from calibration_math import clip_flow, flow_to_register, raw_to_calibrated_flow
 import gps
-from shared_resources import get_serial, get_bus, get_instrument
+from shared_resources import close_all, discover_nodes, get_arbiter, get_serial, install_arbiter
+from bus_arbiter import PRIORITY_COMMAND, PRIORITY_POLL, PRIORITY_SETPOINT, PRIORITY_SHUTDOWN
 from socket_commands import SocketServer
+from telemetry_writer import CsvTelemetryWriter
+from telemetry_store import TelemetryStoreWriter, make_reading
+from rolling_stats import RollingStats
+from status_snapshot import SnapshotStore
+from trajectory import TrajectoryEngine, decode_profile, parse_profile
+from flow_trim import FlowTrimLoop, TrimConfig
+from status_payload import PackedStatusEncoder
+from data_channel import PACKED_UPLINK, STATUS_CYCLE, DataChannel, encode_status_cycle
+from mfc_logging import get_recorder, setup_logging
+from poll_scheduler import DEFAULT_BUDGET, AdaptivePollPolicy, PollScheduler, parse_intervals
+from publisher_runtime import AsyncBusArbiter, PublisherRuntime
+from propar_ascii import (
+    DIAGNOSTIC_PARAMS,
+    MEASURE,
+    SETPOINT,
+    STATUS_PARAMS,
+    ProparError,
+    build_read_request,
+    decode_read_reply,
+)
 
 PORT = '/dev/ttyUSB0'
 BAUD = 38400
 TIMEOUT = 1
 MFC_CAL_DEBUG = os.getenv("MFC_CAL_DEBUG", "0") == "1"
+# Stdout log level (MFC_CAL_DEBUG=1 still turns on DEBUG)
+MFC_LOG_LEVEL = os.getenv("MFC_LOG_LEVEL", "DEBUG" if MFC_CAL_DEBUG else "INFO")
+MFC_STATUS_DIAGNOSTICS = os.getenv("MFC_STATUS_DIAGNOSTICS", "0") == "1"
+# "async" (default) or "blocking" (legacy SocketServer loop)
+MFC_RUNTIME = os.getenv("MFC_RUNTIME", "async")
+# Seconds between background polls of each node; 0 = only on request
+MFC_POLL_INTERVAL = float(os.getenv("MFC_POLL_INTERVAL", "0"))
+# Per-node overrides, "mfc_id=seconds,..." e.g. "0=0.5,5=10"
+MFC_NODE_POLL_INTERVALS = os.getenv("MFC_NODE_POLL_INTERVALS", "")
+# Fraction of bus time background polling may use
+MFC_BUS_BUDGET = float(os.getenv("MFC_BUS_BUDGET", str(DEFAULT_BUDGET)))
+# Adaptive polling: fast while settling/drifting, back off to
+# MFC_POLL_INTERVAL when stable; setpoint re-read every MFC_SETPOINT_AUDIT s
+MFC_ADAPTIVE_POLL = os.getenv("MFC_ADAPTIVE_POLL", "0") == "1"
+MFC_POLL_FAST = float(os.getenv("MFC_POLL_FAST", "0.5"))
+MFC_SETPOINT_AUDIT = float(os.getenv("MFC_SETPOINT_AUDIT", "60"))
+# "status" requests without a max_age accept readings up to this old (s)
+MFC_STATUS_MAX_AGE = float(os.getenv("MFC_STATUS_MAX_AGE", "5"))
+# Seconds between setpoint updates while a profile ramps
+MFC_PROFILE_RAMP_INTERVAL = float(os.getenv("MFC_PROFILE_RAMP_INTERVAL", "0.5"))
+# Closed-loop trim of the setpoint register from the measured flow (off
+# unless MFC_FLOW_TRIM=1 or enabled per node with the "trim" action).
+# Bounds and slew rate are in percent of full scale.
+MFC_FLOW_TRIM = os.getenv("MFC_FLOW_TRIM", "0") == "1"
+MFC_TRIM_KP = float(os.getenv("MFC_TRIM_KP", "0.2"))
+MFC_TRIM_KI = float(os.getenv("MFC_TRIM_KI", "0.5"))
+MFC_TRIM_MAX = float(os.getenv("MFC_TRIM_MAX", "2"))
+MFC_TRIM_RATE = float(os.getenv("MFC_TRIM_RATE", "0.5"))
+MFC_TRIM_INTERVAL = float(os.getenv("MFC_TRIM_INTERVAL", "1"))
+MFC_TRIM_SETTLE = float(os.getenv("MFC_TRIM_SETTLE", "3"))
+CAL_FILE = os.getenv(
+    "MFC_CAL_FILE",
+    "/home/pi/Documents/Radiolib/examples/NonArduino/Raspberry_copy/mass-flow-controller/MFCCalibrations-ReadDirectlyByFlareCode.txt",
+)
 CSV_LOG_FILE = os.getenv(
     "MFC_STATUS_CSV",
     "/home/pi/Documents/Radiolib/examples/NonArduino/Raspberry_copy/mass-flow-controller/data/mfc_status_log.csv",
 )
+# CSV log: rotate at this size (also daily), flush every N rows or S seconds
+MFC_CSV_MAX_BYTES = int(os.getenv("MFC_CSV_MAX_BYTES", str(16 * 1024 * 1024)))
+MFC_CSV_FLUSH_ROWS = int(os.getenv("MFC_CSV_FLUSH_ROWS", "256"))
+MFC_CSV_FLUSH_SECONDS = float(os.getenv("MFC_CSV_FLUSH_SECONDS", "10"))
+# Binary telemetry store (raw registers + calibrated values); "" disables
+TELEMETRY_STORE_FILE = os.getenv(
+    "MFC_TELEMETRY_STORE",
+    os.path.join(os.path.dirname(CSV_LOG_FILE), "mfc_telemetry.tlm"),
+)
+# Flight recorder: last N log records of every level, appended to
+# MFC_FLIGHT_DUMP on ERROR ("" disables the file) or served by debug_dump
+MFC_FLIGHT_RECORDS = int(os.getenv("MFC_FLIGHT_RECORDS", "2000"))
+MFC_FLIGHT_DUMP = os.getenv(
+    "MFC_FLIGHT_DUMP",
+    os.path.join(os.path.dirname(CSV_LOG_FILE), "mfc_flight.log"),
+)
+
+log = logging.getLogger("mfc_status_publisher")
+# One packed 0x22 frame per cycle (PACKED:<hex>) for main.cpp to uplink
+# instead of a 0x20 frame per STATUS line; keyframe every N frames
+MFC_PACKED_UPLINK = os.getenv("MFC_PACKED_UPLINK", "0") == "1"
+MFC_PACKED_KEYFRAME_EVERY = int(os.getenv("MFC_PACKED_KEYFRAME_EVERY", "10"))
 
 GAS_NAME_BY_CODE = {
     0x00: "AIR",
@@ -36,30 +117,122 @@ GAS_NAME_BY_CODE = {
 
 selected_gas_by_mfc = {}
 
+# Background poll planner (None: polling only on request)
+node_scheduler = None
+# Change-driven intervals on top of node_scheduler (None: fixed intervals)
+adaptive_policy = None
+
+# 1 min / 15 min / 1 h flow summaries per node, served by the "stats" action
+node_stats = RollingStats()
+
+# Latest node_status per MFC index with its acquisition time: serves
+# "status" requests and is what a single-node refresh merges into
+status_snapshot = SnapshotStore()
+
+# Setpoint profiles run on the Pi (created once nodes are known)
+trajectory_engine = None
+# Last register each profile wrote, to skip writes that change nothing
+profile_registers = {}
+
+# Measured-flow trim of written setpoints (created once nodes are known)
+flow_trim = None
+
+# Delta state of the packed uplink (None: per-node STATUS uplinks only)
+packed_encoder = (
+    PackedStatusEncoder(keyframe_every=MFC_PACKED_KEYFRAME_EVERY)
+    if MFC_PACKED_UPLINK else None
+)
+
+# Binary status frames to main.cpp (fd in MFC_DATA_FD, opened in main());
+# None: stdout lines
+data_channel = None
+
+# Parameters fetched per node in one chained ProPar exchange
+STATUS_READ_PARAMS = STATUS_PARAMS + (DIAGNOSTIC_PARAMS if MFC_STATUS_DIAGNOSTICS else ())
+# Same without the setpoint register (adaptive polls between audits)
+MEASURE_READ_PARAMS = tuple(spec for spec in STATUS_READ_PARAMS if spec != SETPOINT)
+
+
+# Calibrated values, then the raw 0-32000 registers they came from and
+# the calibration that converted them (recalibrate_log.py redoes the
+# conversion from these against a newer calibration file)
+CSV_HEADER = [
+    "Timestamp", "MFC Id", "Serial", "Address", "Setpoint", "Flow",
+    "Setpoint Raw", "Flow Raw", "Gas", "Cal Date", "Slope", "Offset",
+]
+csv_writer = None
+
+
+def get_csv_writer() -> CsvTelemetryWriter:
+    global csv_writer
+    if csv_writer is None:
+        csv_writer = CsvTelemetryWriter(
+            CSV_LOG_FILE,
+            CSV_HEADER,
+            max_bytes=MFC_CSV_MAX_BYTES,
+            max_rows=MFC_CSV_FLUSH_ROWS,
+            max_delay=MFC_CSV_FLUSH_SECONDS,
+        )
+    return csv_writer
+
 
 def append_status_rows_to_csv(timestamp: str, node_rows):
+    """
+    Queue status rows for the background CSV writer (no disk I/O here).
+
+    Args:
+        node_rows: node status dicts; "setpoint_raw", "flow_raw" and
+            "calibration" (the Calibration used) fill the raw register
+            and fingerprint columns when present
+    """
     if not node_rows:
         return
 
-    file_exists = os.path.exists(CSV_LOG_FILE)
-    os.makedirs(os.path.dirname(CSV_LOG_FILE), exist_ok=True)
-
-    with open(CSV_LOG_FILE, "a", newline="") as csvfile:
-        writer = csv.writer(csvfile)
-        if not file_exists:
-            writer.writerow(["Timestamp", "MFC Id", "Serial", "Address", "Setpoint", "Flow"])
-
-        for row in node_rows:
-            writer.writerow([
-                timestamp,
-                row.get("id"),
-                row.get("serial"),
-                row.get("address"),
-                row.get("setpoint"),
-                row.get("flow"),
-            ])
+    out = []
+    for row in node_rows:
+        cal = row.get("calibration")
+        out.append([
+            timestamp,
+            row.get("id"),
+            row.get("serial"),
+            row.get("address"),
+            row.get("setpoint"),
+            row.get("flow"),
+            row.get("setpoint_raw"),
+            row.get("flow_raw"),
+            cal.gas if cal is not None else None,
+            cal.cal_date if cal is not None else None,
+            cal.slope if cal is not None else None,
+            cal.offset if cal is not None else None,
+        ])
+    get_csv_writer().submit(out)
+
+
+telemetry_store_writer = None
+
+
+def record_readings(readings):
+    """Queue Reading tuples for the binary telemetry store."""
+    global telemetry_store_writer
+    if not readings or not TELEMETRY_STORE_FILE:
+        return
+    if telemetry_store_writer is None:
+        telemetry_store_writer = TelemetryStoreWriter(
+            TELEMETRY_STORE_FILE,
+            max_rows=MFC_CSV_FLUSH_ROWS,
+            max_delay=MFC_CSV_FLUSH_SECONDS,
+        )
+    telemetry_store_writer.submit(readings)
 
 
+def close_telemetry_writers():
+    global csv_writer, telemetry_store_writer
+    if csv_writer is not None:
+        csv_writer.close()
+        csv_writer = None
+    if telemetry_store_writer is not None:
+        telemetry_store_writer.close()
+        telemetry_store_writer = None
 
 
 def normalize_serial(serial: str) -> str:
@@ -76,25 +249,6 @@ def parse_raw_value(reply: bytes) -> int:
     return int(value_hex, 16)
 
 
-def raw_to_calibrated_flow(raw_value: int, cal) -> float:
-    raw_percent = float(raw_value) * 100.0 / 32000.0
-    corrected = float(cal.slope) * raw_percent + float(cal.offset)
-    return corrected
-
-
-def flow_to_register(desired_flow: float, cal) -> tuple[int, float, float]:
-    raw_percent = (desired_flow - float(cal.offset)) / float(cal.slope)
-    register = int(raw_percent * 32000 / 100)
-    applied_raw_percent = float(register) * 100.0 / 32000.0
-    applied_flow = float(cal.slope) * applied_raw_percent + float(cal.offset)
-    return register, raw_percent, applied_flow
-
-
-def debug_log(message: str):
-    if MFC_CAL_DEBUG:
-        print(f"DEBUG_CAL:{message}", flush=True)
-
-
 def node_to_protocol(node_dec):
     if not (0 <= node_dec <= 255):
         raise ValueError("Node must be 0-255")
@@ -123,87 +277,489 @@ def parse_flow(reply: bytes, max_flow: float) -> float:
     return value_int * max_flow / 32000
 
 
-def send_command(ser, cmd: bytes) -> bytes:
-    ser.reset_input_buffer()
-    ser.write(cmd)
-    reply = ser.read(100)
-    if not reply:
-        raise RuntimeError("No response")
-    return reply
+def send_command(arbiter, cmd: bytes, address=None, priority=PRIORITY_POLL) -> bytes:
+    """Raw frame exchange through the bus arbiter (blocks for the reply)."""
+    return arbiter.transact(cmd, address, priority).result()
+
+
+def read_node_registers(arbiter, address, params=STATUS_READ_PARAMS):
+    """
+    Read measure + setpoint (+ diagnostics) of one node in a single
+    chained exchange. Returns (raw_reply, {param name: value}).
+    Falls back to one request per value if the node rejects chaining.
+    """
+    try:
+        raw = send_command(arbiter, build_read_request(address, params), address)
+        return raw, decode_read_reply(raw, params)
+    except ProparError as e:
+        log.debug("CHAINED_READ_REJECTED address=%s %s", address, e)
+
+    raw = send_command(arbiter, read_status(address), address)
+    values = {"measure": parse_raw_value(raw)}
+    if SETPOINT not in params:
+        return raw, values
+    try:
+        rsp = send_command(arbiter, read_setpoint(address), address)
+        values["setpoint"] = parse_raw_value(rsp)
+    except Exception:
+        pass
+    return raw, values
+
+
+@dataclass(frozen=True)
+class SetpointPlan:
+    """A validated setpoint write, ready to go on the bus."""
+    mfc_id: int
+    address: int
+    serial: str
+    gas_name: str
+    requested: float
+    desired_flow: float
+    register: int
+    applied_flow: float
+    calibration: Optional[Calibration] = None
+
+
+def plan_setpoint(mfc_id, setpoint, calibrations=None, gas_by_serial=None) -> SetpointPlan:
+    """
+    Validate a setpoint against node list, selected gas and calibration
+    without touching the bus. Raises ValueError with the reason.
+
+    Args:
+        calibrations: calibration table to use (default: registry snapshot)
+        gas_by_serial: gas selection to check against (default: the live
+            selected_gas_by_mfc; batches pass their pending selection)
+    """
+    nodes = handle_setpoint_command.nodes
+    if mfc_id is None or setpoint is None:
+        raise ValueError("Missing setpoint command fields")
+    mfc_id = int(mfc_id)
+    setpoint = float(setpoint)
+    if mfc_id < 0 or mfc_id >= len(nodes):
+        raise ValueError(f"Invalid MFC ID {mfc_id}")
+
+    nodeinfo = nodes[mfc_id]
+    serial_num = nodeinfo.get("serial", "unknown")
+    serial_key = normalize_serial(serial_num)
+    if gas_by_serial is None:
+        gas_by_serial = selected_gas_by_mfc
+
+    if serial_key not in gas_by_serial:
+        raise ValueError(f"No gas selected yet for MFC {mfc_id}; send GAS downlink first")
+
+    gas_code = gas_by_serial[serial_key]
+    gas_name = GAS_NAME_BY_CODE.get(gas_code)
+    if gas_name is None:
+        raise ValueError(f"Unsupported gas code 0x{gas_code:02X} for MFC {mfc_id}")
+
+    if calibrations is None:
+        calibrations = get_registry(CAL_FILE).current()
+    try:
+        cal = calibrations.get_for_gas(serial_num, gas_name)
+    except KeyError as e:
+        raise ValueError(str(e))
+
+    desired_flow = clip_flow(setpoint, cal)
+    register, raw_percent, applied_flow = flow_to_register(desired_flow, cal)
+    log.debug(
+        "SETPOINT mfc=%s serial=%s gas=%s in=%.3f clipped=%.3f "
+        "slope=%.6f offset=%.6f raw_percent=%.6f",
+        mfc_id, serial_key, gas_name, setpoint, desired_flow,
+        cal.slope, cal.offset, raw_percent,
+    )
+    if not (0 <= raw_percent <= 100):
+        raise ValueError(f"Flow {desired_flow} exceeds device limits")
+
+    return SetpointPlan(
+        mfc_id=mfc_id,
+        address=nodeinfo["address"],
+        serial=serial_key,
+        gas_name=gas_name,
+        requested=setpoint,
+        desired_flow=desired_flow,
+        register=register,
+        applied_flow=applied_flow,
+        calibration=cal,
+    )
+
+
+def apply_setpoints(arbiter, plans, level=logging.INFO):
+    """
+    Write every planned setpoint back to back, then read them all back.
+    All writes are queued before waiting on any of them, so they leave
+    the bus arbiter as one burst. Returns [(plan, wrote, readback)].
+
+    Args:
+        level: log level of the per-write messages (profiles write
+            often and log them at DEBUG)
+    """
+    for plan in plans:
+        log.log(
+            level,
+            "Quantized setpoint for MFC %s: requested=%.4f, applied=%.4f, register=%s",
+            plan.mfc_id, plan.desired_flow, plan.applied_flow, plan.register,
+        )
+    if flow_trim is not None:
+        # Before queuing: a trim write for the old setpoint can no longer
+        # be queued behind these
+        for plan in plans:
+            flow_trim.set_target(plan.mfc_id, plan.desired_flow, plan.register, plan.calibration)
+    writes = [
+        arbiter.write_parameter(plan.address, 9, plan.register, PRIORITY_SETPOINT)
+        for plan in plans
+    ]
+    wrote = []
+    for future in writes:
+        try:
+            wrote.append(bool(future.result()))
+        except Exception as e:
+            log.error("Setpoint write failed: %s", e)
+            wrote.append(False)
+
+    readbacks = [
+        arbiter.read_parameter(plan.address, 9, PRIORITY_SETPOINT) if ok else None
+        for plan, ok in zip(plans, wrote)
+    ]
+    results = []
+    for plan, ok, future in zip(plans, wrote, readbacks):
+        rb = None
+        if future is not None:
+            try:
+                rb = future.result()
+            except Exception as e:
+                log.warning("Setpoint readback failed for MFC %s: %s", plan.mfc_id, e)
+        if ok:
+            log.log(level, "Set MFC %s setpoint to %.2f (readback=%s)", plan.mfc_id, plan.desired_flow, rb)
+            if adaptive_policy is not None:
+                adaptive_policy.setpoint_written(plan.mfc_id, plan.register)
+            if flow_trim is not None:
+                flow_trim.readback(plan.mfc_id, plan.register, rb)
+        else:
+            log.error("Failed to write setpoint to MFC %s", plan.mfc_id)
+            if flow_trim is not None:
+                flow_trim.release(plan.mfc_id)
+        results.append((plan, ok, rb))
+    return results
+
+
+def apply_setpoint_command(mfc_id: int, setpoint: float):
+    """
+    Plan and write one setpoint.
+
+    Returns:
+        (plan, wrote, readback) as from apply_setpoints, or None if the
+        command was invalid or the handler failed
+    """
+    try:
+        try:
+            plan = plan_setpoint(mfc_id, setpoint)
+        except ValueError as e:
+            log.error("%s", e)
+            return None
+        stop_profiles([plan.mfc_id], "manual setpoint")
+        [result] = apply_setpoints(get_arbiter(), [plan])
+        return result
+    except Exception as e:
+        log.error("Socket handler failed: %s", e)
+        return None
 
 
 def handle_setpoint_command(mfc_id: int, setpoint: float) -> bool:
     """Handler for socket commands to set MFC setpoint."""
+    result = apply_setpoint_command(mfc_id, setpoint)
+    return result is not None and result[1]
+
+
+def refresh_after_setpoints(arbiter, nodes, results):
+    """
+    Re-poll only the nodes that just got a setpoint.
+
+    The setpoint readback already is a read of the register, so each
+    node costs one measure-only exchange; the other nodes keep their
+    last known values in the published snapshot.
+
+    Args:
+        results: [(plan, wrote, readback)] from apply_setpoints
+    """
+    readbacks = {plan.mfc_id: rb for plan, ok, rb in results if ok}
+    if not readbacks:
+        return None
+    return publish_status(
+        arbiter, nodes, log_csv=True, ids=sorted(readbacks),
+        setpoint_registers={i: rb for i, rb in readbacks.items() if isinstance(rb, int)},
+        merge=True,
+    )
+
+
+def plan_batch(ops):
+    """
+    Validate a batch of operations as a whole. Gas selections earlier
+    in the batch count for setpoints later in it; every setpoint is
+    checked against one calibration snapshot.
+
+    Returns (gas_selection, setpoint_plans, wants_status); gas_selection
+    holds only the serials this batch's gas ops select, wants_status
+    is set by an explicit "refresh" op (setpoints alone only refresh
+    the nodes they wrote).
+    Raises ValueError naming the first invalid operation.
+    """
+    if not isinstance(ops, list) or not ops:
+        raise ValueError("Batch needs a non-empty list of ops")
+
+    nodes = handle_setpoint_command.nodes
+    # Live selection with the batch's gas ops applied, for validation
+    gas_view = dict(selected_gas_by_mfc)
+    gas_selection = {}
+    calibrations = get_registry(CAL_FILE).current()
+    plans = []
+    wants_status = False
+
+    for i, op in enumerate(ops):
+        try:
+            if not isinstance(op, dict):
+                raise ValueError("op must be an object")
+            action = op.get("action")
+            if action == "gas":
+                mfc_id, gas_cmd = op.get("mfc_id"), op.get("gas_cmd")
+                if mfc_id is None or gas_cmd is None:
+                    raise ValueError("Missing gas command fields")
+                mfc_id = int(mfc_id)
+                if mfc_id < 0 or mfc_id >= len(nodes):
+                    raise ValueError(f"Invalid MFC ID {mfc_id} for gas command")
+                serial_key = normalize_serial(nodes[mfc_id].get("serial", "unknown"))
+                gas_selection[serial_key] = gas_view[serial_key] = int(gas_cmd) & 0xFF
+            elif action == "setpoint":
+                plans.append(plan_setpoint(
+                    op.get("mfc_id"), op.get("setpoint"), calibrations, gas_view
+                ))
+            elif action == "refresh":
+                wants_status = True
+            else:
+                raise ValueError(f"Unsupported batch action {action!r}")
+        except (TypeError, ValueError) as e:
+            raise ValueError(f"op {i}: {e}")
+
+    # A later op may override an earlier one for the same MFC: last wins
+    latest = {plan.mfc_id: plan for plan in plans}
+    return gas_selection, list(latest.values()), wants_status
+
+
+def handle_batch_command(arbiter, nodes, ops) -> dict:
+    """
+    Apply a list of gas / setpoint / refresh operations atomically:
+    validate everything first (nothing is applied if any op is invalid),
+    write all setpoints in one burst, then publish one status: a full
+    poll if the batch asked for a refresh, else a refresh of only the
+    nodes whose setpoint was written.
+    """
+    try:
+        gas_selection, plans, wants_status = plan_batch(ops)
+    except Exception as e:
+        log.error("Batch rejected: %s", e)
+        return {"success": False, "message": str(e)}
+
+    # Only the batch's own selections: a gas command for another MFC may
+    # have landed since planning and must not be reverted
+    for serial_key, gas_code in gas_selection.items():
+        if selected_gas_by_mfc.get(serial_key) != gas_code:
+            selected_gas_by_mfc[serial_key] = gas_code
+            gas_name = GAS_NAME_BY_CODE.get(gas_code, "UNKNOWN")
+            log.info("Selected gas for %s set to 0x%02X (%s)", serial_key, gas_code, gas_name)
+
+    stop_profiles([plan.mfc_id for plan in plans], "batch setpoint")
+    results = apply_setpoints(arbiter, plans) if plans else []
+    success = all(ok for _, ok, _ in results)
+
+    response = {
+        "success": success,
+        "message": "OK" if success else "Failed",
+        "setpoints": [
+            {
+                "mfc_id": plan.mfc_id,
+                "success": ok,
+                "applied": round(plan.applied_flow, 4),
+                "register": plan.register,
+                "readback": rb,
+            }
+            for plan, ok, rb in results
+        ],
+    }
+    if wants_status:
+        response["status"] = publish_status(arbiter, nodes, log_csv=True)
+    elif results:
+        status = refresh_after_setpoints(arbiter, nodes, results)
+        if status is not None:
+            response["status"] = status
+    return response
+
+
+def apply_profile_setpoint(mfc_id: int, flow: float):
+    """
+    Trajectory engine write; skipped if the register would not change.
+
+    Returns:
+        the applied (clipped, quantized) flow, None if it failed
+    """
+    try:
+        plan = plan_setpoint(mfc_id, flow)
+    except ValueError as e:
+        log.warning("Profile setpoint for MFC %s rejected: %s", mfc_id, e)
+        return None
+    if profile_registers.get(plan.mfc_id) != plan.register:
+        [(_, wrote, _)] = apply_setpoints(get_arbiter(), [plan], logging.DEBUG)
+        if not wrote:
+            return None
+        profile_registers[plan.mfc_id] = plan.register
+    return plan.applied_flow
+
+
+def handle_profile_command(mfc_id=None, profile=None, payload=None) -> dict:
+    """
+    Start a setpoint profile from its JSON form (`mfc_id` + `profile`)
+    or its binary downlink form (`payload`, hex). A binary frame without
+    segments stops the MFC's profile instead. Every target flow is
+    validated against the selected gas and calibration before anything
+    runs.
+    """
+    if trajectory_engine is None:
+        return {"success": False, "message": "Profiles unavailable"}
     try:
+        if payload is not None:
+            mfc_id, parsed = decode_profile(bytes.fromhex(str(payload)))
+            if parsed is None:
+                stopped = stop_profiles([mfc_id], "stop downlink")
+                return {"success": True, "message": "OK", "stopped": stopped}
+        else:
+            parsed = parse_profile(mfc_id, profile)
+
         nodes = handle_setpoint_command.nodes
-        if mfc_id < 0 or mfc_id >= len(nodes):
-            print(f"ERROR: Invalid MFC ID {mfc_id}", flush=True)
-            return False
-        
-        nodeinfo = nodes[mfc_id]
-        addr = nodeinfo["address"]
-        serial_num = nodeinfo.get("serial", "unknown")
-        serial_key = normalize_serial(serial_num)
+        if not 0 <= parsed.mfc_id < len(nodes):
+            raise ValueError(f"Invalid MFC ID {parsed.mfc_id}")
+        for flow in sorted(set(parsed.flows())):
+            plan_setpoint(parsed.mfc_id, flow)
+    except (TypeError, ValueError) as e:
+        log.error("Profile rejected: %s", e)
+        return {"success": False, "message": str(e)}
+
+    last = status_snapshot.status(parsed.mfc_id)
+    start_flow = last.get("setpoint") if last is not None else None
+    # Forget the old profile's last register only once its write landed
+    progress = trajectory_engine.start(
+        parsed, start_flow or 0.0,
+        reset=lambda: profile_registers.pop(parsed.mfc_id, None),
+    )
+    log.info(
+        "Started profile on MFC %s: %d segments, %.1f s per cycle, repeat %s",
+        parsed.mfc_id, len(parsed.segments), parsed.cycle_duration,
+        parsed.repeat or "until stopped",
+    )
+    return {"success": True, "message": "OK", "profile": progress}
+
+
+def stop_profiles(mfc_ids=None, reason="requested"):
+    """Stop running profiles (default: all); returns the MFC ids stopped."""
+    if trajectory_engine is None:
+        return []
+    stopped = []
+    for mfc_id in (mfc_ids if mfc_ids is not None else [None]):
+        stopped += trajectory_engine.stop(mfc_id)
+    for mfc_id in stopped:
+        log.info("Stopped profile on MFC %s (%s)", mfc_id, reason)
+    return stopped
+
+
+def profile_progress():
+    """Progress of every profile started so far; None if there are none."""
+    if trajectory_engine is None:
+        return None
+    return trajectory_engine.progress() or None
+
+
+def read_trim_measure(mfc_id: int):
+    """Flow trim read: the measure register of one node, nothing else."""
+    addr = handle_setpoint_command.nodes[mfc_id]["address"]
+    _, values = read_node_registers(get_arbiter(), addr, (MEASURE,))
+    return values.get("measure")
+
+
+def submit_trim_register(mfc_id: int, register: int):
+    """Queue a flow trim write (Future); not read back, the next trim read checks the flow."""
+    addr = handle_setpoint_command.nodes[mfc_id]["address"]
+    future = get_arbiter().write_parameter(addr, 9, register, PRIORITY_SETPOINT)
+    policy = adaptive_policy
+    if policy is not None:
+        def written(f):
+            if not f.cancelled() and f.exception() is None and f.result():
+                policy.setpoint_trimmed(mfc_id, register)
+        future.add_done_callback(written)
+    return future
+
+
+def make_flow_trim():
+    config = TrimConfig(
+        kp=MFC_TRIM_KP,
+        ki=MFC_TRIM_KI,
+        max_trim=MFC_TRIM_MAX * REGISTER_FULL_SCALE / 100.0,
+        rate=MFC_TRIM_RATE * REGISTER_FULL_SCALE / 100.0,
+        interval=MFC_TRIM_INTERVAL,
+        settle=MFC_TRIM_SETTLE,
+    )
+    if MFC_FLOW_TRIM:
+        log.info(
+            "Flow trim on: +-%g%% of full scale, %g%%/s, every %g s",
+            MFC_TRIM_MAX, MFC_TRIM_RATE, MFC_TRIM_INTERVAL,
+        )
+    return FlowTrimLoop(read_trim_measure, submit_trim_register, config, enabled=MFC_FLOW_TRIM)
 
-        if serial_key not in selected_gas_by_mfc:
-            print(f"ERROR: No gas selected yet for MFC {mfc_id}; send GAS downlink first", flush=True)
-            return False
 
-        gas_code = selected_gas_by_mfc[serial_key]
-        gas_name = GAS_NAME_BY_CODE.get(gas_code)
-        if gas_name is None:
-            print(f"ERROR: Unsupported gas code 0x{gas_code:02X} for MFC {mfc_id}", flush=True)
-            return False
-        
-        loader = CalibrationLoader("/home/pi/Documents/Radiolib/examples/NonArduino/Raspberry_copy/mass-flow-controller/MFCCalibrations-ReadDirectlyByFlareCode.txt")
-        print(f"Searching exact calibration for {serial_num} with {gas_name}")
-        try:
-            cal = loader.get_for_gas(serial_num, gas_name)
-        except KeyError as e:
-            print(f"ERROR: {e}", flush=True)
-            return False
-        cal.cal_min = float(cal.cal_min)
-        cal.cal_max = float(cal.cal_max)
-        cal.slope = float(cal.slope)
-        cal.offset = float(cal.offset)
-        
-        desired_flow = max(cal.cal_min, min(cal.cal_max, setpoint))
-        
-        register, raw_percent, applied_flow = flow_to_register(desired_flow, cal)
-        debug_log(
-            f"SETPOINT mfc={mfc_id} serial={serial_key} gas={gas_name} "
-            f"in={setpoint:.3f} clipped={desired_flow:.3f} "
-            f"slope={cal.slope:.6f} offset={cal.offset:.6f} raw_percent={raw_percent:.6f}"
-        )
-        if not (0 <= raw_percent <= 100):
-            print(f"ERROR: Flow {desired_flow} exceeds device limits", flush=True)
-            return False
-        
-        propar_value = register
-        print(
-            f"INFO: Quantized setpoint for MFC {mfc_id}: requested={desired_flow:.4f}, applied={applied_flow:.4f}, register={propar_value}",
-            flush=True,
-        )
-        
-        node_inst = get_instrument(addr)
-        wrote = node_inst.writeParameter(9, propar_value)
-        
-        if wrote:
-            rb = node_inst.readParameter(9)
-            print(f"INFO: Set MFC {mfc_id} setpoint to {desired_flow:.2f} (readback={rb})", flush=True)
-            return True
-        else:
-            print(f"ERROR: Failed to write setpoint to MFC {mfc_id}", flush=True)
-            return False
+def _trim_write_ok(mfc_id: int, register: int) -> bool:
+    try:
+        return bool(submit_trim_register(mfc_id, register).result())
     except Exception as e:
-        print(f"ERROR: Socket handler failed: {e}", flush=True)
+        log.debug("Trim register write to MFC %s failed: %s", mfc_id, e)
         return False
 
 
+def handle_trim_command(mfc_id=None, enabled=None) -> dict:
+    """
+    Turn flow trim on/off for one MFC (`enabled` true/false) or, with
+    `enabled` omitted, just report the trim state of every node.
+    Disabling a trimmed node writes its open-loop register back.
+    """
+    if flow_trim is None:
+        return {"success": False, "message": "Flow trim unavailable"}
+    if enabled is not None:
+        try:
+            mfc_id = int(mfc_id)
+        except (TypeError, ValueError):
+            return {"success": False, "message": "Trim needs an mfc_id"}
+        nodes = handle_setpoint_command.nodes
+        if not 0 <= mfc_id < len(nodes):
+            return {"success": False, "message": f"Invalid MFC ID {mfc_id}"}
+        enabled = enabled if isinstance(enabled, bool) else str(enabled).lower() in ("1", "true", "on")
+        restore = flow_trim.enable(mfc_id, enabled)
+        log.info("Flow trim %s for MFC %s", "enabled" if enabled else "disabled", mfc_id)
+        if restore is not None and not _trim_write_ok(mfc_id, restore):
+            log.error("Failed to restore register %s on MFC %s", restore, mfc_id)
+            return {"success": False, "message": "Restoring the open-loop register failed"}
+    return {"success": True, "message": "OK", "trim": flow_trim.progress()}
+
+
+def trim_progress():
+    """Trim state of the nodes trim is enabled for; None if there are none."""
+    if flow_trim is None:
+        return None
+    progress = {
+        mfc_id: state for mfc_id, state in flow_trim.progress().items()
+        if state["state"] != "disabled"
+    }
+    return progress or None
+
+
 def handle_gas_command(mfc_id: int, gas_cmd: int) -> bool:
     try:
         if mfc_id is None or gas_cmd is None:
-            print("ERROR: Missing gas command fields", flush=True)
+            log.error("Missing gas command fields")
             return False
 
         mfc_id = int(mfc_id)
@@ -211,7 +767,7 @@ def handle_gas_command(mfc_id: int, gas_cmd: int) -> bool:
 
         nodes = handle_setpoint_command.nodes
         if mfc_id < 0 or mfc_id >= len(nodes):
-            print(f"ERROR: Invalid MFC ID {mfc_id} for gas command", flush=True)
+            log.error("Invalid MFC ID %s for gas command", mfc_id)
             return False
 
         nodeinfo = nodes[mfc_id]
@@ -219,192 +775,476 @@ def handle_gas_command(mfc_id: int, gas_cmd: int) -> bool:
 
         selected_gas_by_mfc[serial_key] = gas_code
         gas_name = GAS_NAME_BY_CODE.get(gas_code, "UNKNOWN")
-        print(f"INFO: Selected gas for MFC {mfc_id} ({serial_key}) set to 0x{gas_code:02X} ({gas_name})", flush=True)
+        log.info("Selected gas for MFC %s (%s) set to 0x%02X (%s)", mfc_id, serial_key, gas_code, gas_name)
         return True
     except Exception as e:
-        print(f"ERROR: Gas command handler failed: {e}", flush=True)
+        log.error("Gas command handler failed: %s", e)
         return False
 
 
-def publish_status(ser, nodes, log_csv=False):
-    timestamp = gps.get_timestamp()
+def publish_status(arbiter, nodes, log_csv=False, ids=None, setpoint_registers=None,
+                   merge=False, emit=True):
+    """
+    Poll nodes and print their STATUS lines plus one COMBINED line, or
+    send them as one frame write on the data channel when main.cpp set
+    one up.
+
+    Args:
+        ids: MFC indexes to poll (default: every node)
+        setpoint_registers: {MFC index: setpoint register} already read
+            (a setpoint readback); those nodes are polled without the
+            setpoint register
+        merge: COMBINED carries every node, the ones not polled with
+            their last known status, and lists the polled ones under
+            "refreshed"
+        emit: print/send the STATUS, COMBINED and PACKED output; off for
+            background polls, which only update the snapshot, stats, CSV
+            and telemetry (main.cpp uplinks every output it gets)
+    """
+    now = gps.get_time()
+    timestamp = gps.format_timestamp(now.utc)
+    epoch = now.utc.timestamp()
+    readings = []
+    packed = []
+    channel_nodes = []
+    csv_rows = []
+    use_channel = data_channel is not None and not data_channel.closed
     combined = {
         "timestamp": timestamp,
+        "gps_fix": now.fresh,
         "nodes": []
     }
+    # One table per cycle: every node sees the same calibration snapshot
+    try:
+        calibrations = get_registry(CAL_FILE).current()
+        calibration_error = None
+    except Exception as e:
+        calibrations = None
+        calibration_error = e
+
+    if ids is None:
+        ids = range(len(nodes))
+    if setpoint_registers is None:
+        setpoint_registers = {}
 
-    for idx, nodeinfo in enumerate(nodes[:2]):
+    for idx in ids:
+        nodeinfo = nodes[idx]
+        polled_at = time.monotonic()
         try:
             addr = nodeinfo["address"]
             serial_num = nodeinfo.get("serial", "unknown")
             serial_key = normalize_serial(serial_num)
 
-            loader = CalibrationLoader("/home/pi/Documents/Radiolib/examples/NonArduino/Raspberry_copy/mass-flow-controller/MFCCalibrations-ReadDirectlyByFlareCode.txt")
+            if calibrations is None:
+                raise RuntimeError(f"Calibrations unavailable: {calibration_error}")
+
             gas_code = selected_gas_by_mfc.get(serial_key)
             if gas_code in GAS_NAME_BY_CODE:
                 gas_name = GAS_NAME_BY_CODE[gas_code]
                 try:
-                    cal = loader.get_for_gas(serial_num, gas_name)
+                    cal = calibrations.get_for_gas(serial_num, gas_name)
                 except KeyError as e:
                     raise RuntimeError(str(e))
             else:
-                cal = loader.get(serial=serial_num)
+                cal = calibrations.get(serial=serial_num)
 
             if cal is None:
                 raise RuntimeError(f"No calibration for serial={serial_key} gas_code={gas_code}")
 
-            cal.device = cal.device
-            cal.cal_min = float(cal.cal_min)
-            cal.cal_max = float(cal.cal_max)
-            cal.slope = float(cal.slope)
-            cal.offset = float(cal.offset)
-
             device = cal.device
             if isinstance(device, tuple):
                 device = device[0]
             
-            raw = send_command(ser, read_status(addr))
-            flow_raw = parse_raw_value(raw)
+            params = STATUS_READ_PARAMS
+            if idx in setpoint_registers or (
+                    adaptive_policy is not None and not adaptive_policy.needs_setpoint(idx)):
+                params = MEASURE_READ_PARAMS
+            raw, values = read_node_registers(arbiter, addr, params)
+            flow_raw = values["measure"]
             flow = raw_to_calibrated_flow(flow_raw, cal)
 
-            try:
-                rsp = send_command(ser, read_setpoint(addr))
-                setpoint_raw = parse_raw_value(rsp)
+            setpoint_raw = values.get("setpoint", setpoint_registers.get(idx))
+            if adaptive_policy is not None:
+                adaptive_policy.observe(idx, flow_raw, setpoint_raw)
+                if setpoint_raw is None:
+                    setpoint_raw = adaptive_policy.setpoint_register(idx)
+            trim_target = flow_trim.target(idx) if flow_trim is not None else None
+            if trim_target is not None:
+                # The register carries the trim; the setpoint is what was asked
+                setpoint = trim_target
+            elif setpoint_raw is not None:
                 setpoint = raw_to_calibrated_flow(setpoint_raw, cal)
-            except Exception:
-                setpoint_raw = None
+            else:
                 setpoint = None
 
-            debug_log(
-                f"STATUS mfc={idx} serial={serial_key} gas_code={gas_code} "
-                f"gas={GAS_NAME_BY_CODE.get(gas_code, 'UNKNOWN')} "
-                f"slope={cal.slope:.6f} offset={cal.offset:.6f} "
-                f"cal_min={cal.cal_min:.6f} cal_max={cal.cal_max:.6f} "
-                f"raw_status='{raw.decode(errors='ignore').strip()}' flow_raw={flow_raw} flow={flow:.6f} "
-                f"raw_setpoint={setpoint_raw} setpoint={(f'{setpoint:.6f}' if setpoint is not None else 'None')}"
+            # Arguments only; formatted if DEBUG is shown or the recorder dumps
+            log.debug(
+                "STATUS mfc=%s serial=%s gas_code=%s slope=%.6f offset=%.6f "
+                "cal_min=%.6f cal_max=%.6f raw_status=%r flow_raw=%s flow=%.6f "
+                "raw_setpoint=%s setpoint=%s",
+                idx, serial_key, gas_code, cal.slope, cal.offset,
+                cal.cal_min, cal.cal_max, raw, flow_raw, flow,
+                setpoint_raw, setpoint,
             )
 
-            if setpoint is None:
+            if not emit:
+                pass
+            elif use_channel:
+                channel_nodes.append({
+                    "id": idx,
+                    "device": device,
+                    "gas": gas_code,
+                    "flow": flow,
+                    "setpoint": setpoint,
+                })
+            elif setpoint is None:
                 print(f"STATUS:{idx}:{flow:.4f}", flush=True)
             else:
                 gas_code_out = selected_gas_by_mfc.get(serial_key, -1)
                 print(f"STATUS:{device}:{idx}:{flow:.4f}:{setpoint:.4f}:{gas_code_out}", flush=True)
 
-            combined["nodes"].append({
+            node_status = {
                 "id": idx,
                 "serial": serial_num,
                 "address": addr,
                 "flow": round(flow, 4),
                 "setpoint": (round(setpoint, 4) if setpoint is not None else None)
+            }
+            diagnostics = {
+                spec.name: values[spec.name]
+                for spec in DIAGNOSTIC_PARAMS
+                if spec.name in values
+            }
+            if diagnostics:
+                node_status["diagnostics"] = diagnostics
+            combined["nodes"].append(node_status)
+            status_snapshot.record(timestamp, now.fresh, [node_status], polled_at)
+            if log_csv:
+                csv_rows.append(dict(
+                    node_status,
+                    flow_raw=flow_raw,
+                    setpoint_raw=setpoint_raw,
+                    calibration=cal,
+                ))
+            node_stats.add(idx, flow, setpoint)
+            readings.append(make_reading(
+                epoch, idx, flow_raw, flow, setpoint_raw, setpoint, now.fresh,
+            ))
+            packed.append({
+                "id": idx,
+                "flow": flow,
+                "setpoint": setpoint,
+                "scale": cal.cal_max,
+                "gas": gas_code,
             })
 
         except Exception as e:
-            print(f"ERROR:node{idx}:{e}", flush=True)
-
-    print("COMBINED:" + json.dumps(combined), flush=True)
+            log.error("node%s:%s", idx, e)
+        finally:
+            if node_scheduler is not None:
+                node_scheduler.record(idx, time.monotonic() - polled_at)
+
+    if merge:
+        polled = [node["id"] for node in combined["nodes"]]
+        combined["nodes"] = status_snapshot.nodes()
+        combined["refreshed"] = polled
+
+    profiles = profile_progress()
+    if profiles:
+        combined["profiles"] = profiles
+    trims = trim_progress()
+    if trims:
+        combined["trim"] = trims
+
+    frame = (
+        packed_encoder.encode(packed)
+        if emit and packed_encoder is not None and packed else None
+    )
+
+    if not emit:
+        pass
+    elif use_channel:
+        frames = [(STATUS_CYCLE, encode_status_cycle(epoch, now.fresh, channel_nodes))]
+        if frame is not None:
+            frames.append((PACKED_UPLINK, frame))
+        data_channel.send(frames)
+    else:
+        print("COMBINED:" + json.dumps(combined), flush=True)
+        if frame is not None:
+            print(f"PACKED:{frame.hex()}", flush=True)
 
     if log_csv:
-        append_status_rows_to_csv(timestamp, combined["nodes"])
+        append_status_rows_to_csv(timestamp, csv_rows)
+        record_readings(readings)
 
     return combined
 
 
-def main():
-    try:
-        ser = get_serial()
-    except Exception as e:
-        print(f"FATAL: Could not open serial: {e}", flush=True)
-        sys.exit(1)
+def zero_node(arbiter, addr, priority=PRIORITY_SHUTDOWN):
+    """Write a zero setpoint; returns (wrote, readback or None)."""
+    wrote = arbiter.write_parameter(addr, 9, 0, priority).result()
+    if not wrote:
+        return False, None
+    return True, arbiter.read_parameter(addr, 9, priority).result()
+
+
+def make_scheduler(nodes):
+    """Set up the background poll planner; None if polling is disabled."""
+    global node_scheduler, adaptive_policy
+    adaptive_policy = None
+    if MFC_POLL_INTERVAL <= 0:
+        node_scheduler = None
+        return None
+    node_scheduler = PollScheduler(
+        range(len(nodes)),
+        MFC_POLL_INTERVAL,
+        budget=MFC_BUS_BUDGET,
+        intervals=parse_intervals(MFC_NODE_POLL_INTERVALS),
+    )
+    log.info(
+        "Polling %d nodes every %g s (bus budget %.0f%%)",
+        len(nodes), MFC_POLL_INTERVAL, MFC_BUS_BUDGET * 100,
+    )
+    if MFC_ADAPTIVE_POLL:
+        fast = min(MFC_POLL_FAST, MFC_POLL_INTERVAL)
+        adaptive_policy = AdaptivePollPolicy(
+            node_scheduler, fast, MFC_POLL_INTERVAL, audit_interval=MFC_SETPOINT_AUDIT,
+        )
+        log.info(
+            "Adaptive polling %g-%g s, setpoint audit every %g s",
+            fast, MFC_POLL_INTERVAL, MFC_SETPOINT_AUDIT,
+        )
+    return node_scheduler
+
+
+def poll_due_nodes(arbiter, nodes) -> float:
+    """Poll whatever the scheduler says is due; returns seconds until the next poll."""
+    due = node_scheduler.due()
+    if due:
+        # Snapshot/stats/CSV only: the uplink rate must not follow the poll rate
+        publish_status(arbiter, nodes, log_csv=True, ids=due, emit=False)
+    return node_scheduler.next_wakeup()
+
+
+def make_command_handler(arbiter, nodes):
+    def poll_stale(ids):
+        publish_status(arbiter, nodes, log_csv=True, ids=ids, merge=True)
+
+    def command_handler(action, mfc_id=None, setpoint=None, gas_cmd=None, ops=None, window=None,
+                        limit=None, max_age=None, profile=None, payload=None, enabled=None):
+        if action == "batch":
+            return handle_batch_command(arbiter, nodes, ops)
+        elif action == "stats":
+            try:
+                stats = node_stats.summary(
+                    None if mfc_id is None else int(mfc_id), window
+                )
+            except (TypeError, ValueError) as e:
+                return {"success": False, "message": str(e)}
+            return {"success": True, "message": "OK", "stats": stats}
+        elif action == "debug_dump":
+            recorder = get_recorder()
+            if recorder is None:
+                return {"success": False, "message": "Flight recorder not running"}
+            try:
+                records = recorder.lines(None if limit is None else int(limit))
+            except (TypeError, ValueError) as e:
+                return {"success": False, "message": str(e)}
+            return {"success": True, "message": "OK", "records": records}
+        elif action == "setpoint":
+            result = apply_setpoint_command(mfc_id, setpoint)
+            if result is None or not result[1]:
+                return False
+            # One measure read of this node, not a full cycle, before the ack
+            refresh_after_setpoints(arbiter, nodes, [result])
+            return True
+        elif action == "gas":
+            return handle_gas_command(mfc_id, gas_cmd)
+        elif action == "profile":
+            return handle_profile_command(mfc_id, profile, payload)
+        elif action == "profile_stop":
+            try:
+                ids = None if mfc_id is None else [int(mfc_id)]
+            except (TypeError, ValueError) as e:
+                return {"success": False, "message": str(e)}
+            return {"success": True, "message": "OK", "stopped": stop_profiles(ids)}
+        elif action == "trim":
+            return handle_trim_command(mfc_id, enabled)
+        elif action == "refresh":
+            # Always a bus poll; refreshes arriving together share one
+            status_snapshot.get(0.0, poll_stale)
+            return True
+        elif action == "status":
+            try:
+                max_age = MFC_STATUS_MAX_AGE if max_age is None else max(0.0, float(max_age))
+            except (TypeError, ValueError) as e:
+                return {"success": False, "message": f"Bad max_age: {e}"}
+            status = status_snapshot.get(max_age, poll_stale)
+            profiles = profile_progress()
+            if profiles:
+                status["profiles"] = profiles
+            trims = trim_progress()
+            if trims:
+                status["trim"] = trims
+            return {"success": True, "message": "OK", "status": status}
+        return False
+
+    return command_handler
+
+
+def start_publisher(arbiter):
+    """Discover nodes, zero them once, publish the first status. Returns nodes."""
+    global trajectory_engine, flow_trim
+    # Start listening for NMEA now so a fix is usually in by the first status
+    gps.get_service()
+    nodes = arbiter.submit(discover_nodes, PRIORITY_COMMAND).result()
+    if not nodes:
+        log.critical("No nodes found")
+        return []
+
+    log.info("Found %d MFC nodes", len(nodes))
+
+    # Store nodes reference for socket handler
+    handle_setpoint_command.nodes = nodes
+    status_snapshot.set_nodes(range(len(nodes)))
+    if trajectory_engine is None:
+        trajectory_engine = TrajectoryEngine(apply_profile_setpoint, MFC_PROFILE_RAMP_INTERVAL)
+    if flow_trim is None:
+        flow_trim = make_flow_trim()
+
+    zero_flag_file = "zeroed.flag"
+    if not os.path.exists(zero_flag_file):
+        for idx, nodeinfo in enumerate(nodes):
+            try:
+                addr = nodeinfo["address"]
+                serial_num = nodeinfo.get("serial", "unknown")
+                log.info("Zeroing setpoint for node %s (%s) at address %s", idx, serial_num, addr)
+                wrote, rb = zero_node(arbiter, addr)
+                if wrote:
+                    log.info("Zeroed node %s, readback=%s", idx, rb)
+                else:
+                    log.warning("Failed to write zero to node %s", idx)
+            except Exception as e:
+                log.warning("Zeroing failed for node %s: %s", idx, e)
+
+        with open(zero_flag_file, "w") as f:
+            f.write("zeroed")
+    else:
+        log.info("Zeroing already done, skipping")
+
+    # Publish initial status
+    publish_status(arbiter, nodes)
+    return nodes
 
+
+def zero_before_exit(arbiter, nodes):
+    global trajectory_engine, flow_trim
+    # No profile or trim may write after the zeros
+    if trajectory_engine is not None:
+        trajectory_engine.close()
+        trajectory_engine = None
+    if flow_trim is not None:
+        flow_trim.close()
+        flow_trim = None
+
+    log.info("Zeroing before exit")
+
+    # Queue every write first so all nodes are zeroed in one burst
+    writes = []
+    for idx, nodeinfo in enumerate(nodes):
+        try:
+            writes.append((idx, arbiter.write_parameter(nodeinfo["address"], 9, 0, PRIORITY_SHUTDOWN)))
+        except Exception as e:
+            log.error("Failed to zero node %s: %s", idx, e)
+
+    for idx, future in writes:
+        try:
+            future.result()
+            log.info("Zeroed node %s", idx)
+        except Exception as e:
+            log.error("Failed to zero node %s: %s", idx, e)
+
+
+def run_blocking() -> int:
+    """Legacy loop: threaded bus arbiter + SocketServer polling."""
+    arbiter = get_arbiter()
+    nodes = []
     try:
-        bus = get_bus()
-        nodes = bus.master.get_nodes()
+        nodes = start_publisher(arbiter)
         if not nodes:
-            print("FATAL: No nodes found", flush=True)
-            try:
-                ser.close()
-            except Exception:
-                pass
-            sys.exit(1)
-
-        print(f"INFO: Found {len(nodes)} MFC nodes", flush=True)
-
-        # Store nodes reference for socket handler
-        handle_setpoint_command.nodes = nodes
-        
-        def command_handler(action, mfc_id=None, setpoint=None, gas_cmd=None):
-            if action == "setpoint":
-                success = handle_setpoint_command(mfc_id, setpoint)
-                if success:
-                    publish_status(ser, nodes, log_csv=True)
-                return success
-            elif action == "gas":
-                return handle_gas_command(mfc_id, gas_cmd)
-            elif action == "refresh":
-                publish_status(ser, nodes, log_csv=True)
-                return True
-            elif action == "status":
-                combined = publish_status(ser, nodes, log_csv=True)
-                return {
-                    "success": True,
-                    "message": "OK",
-                    "status": combined,
-                }
-            return False
-        
+            return 1
+
+        scheduler = make_scheduler(nodes)
+
         # Start TCP socket server for control commands
-        socket_server = SocketServer(command_handler)
+        socket_server = SocketServer(make_command_handler(arbiter, nodes))
         socket_server.start()
 
-        import os
-        zero_flag_file = "zeroed.flag"
-        if not os.path.exists(zero_flag_file):
-            for idx, nodeinfo in enumerate(nodes[:2]):
-                try:
-                    addr = nodeinfo["address"]
-                    serial_num = nodeinfo.get("serial", "unknown")
-                    print(f"INFO: Zeroing setpoint for node {idx} ({serial_num}) at address {addr}", flush=True)
-                    node_inst = get_instrument(addr)
-                    wrote = node_inst.writeParameter(9, 0)
-                    if wrote:
-                        rb = node_inst.readParameter(9)
-                        print(f"INFO: Zeroed node {idx}, readback={rb}", flush=True)
-                    else:
-                        print(f"WARNING: Failed to write zero to node {idx}", flush=True)
-                    handle_setpoint_command.nodes = nodes
-                    handle_setpoint_command.loader = CalibrationLoader('/home/pi/Documents/Radiolib/examples/NonArduino/Raspberry_copy/mass-flow-controller/MFCCalibrations-ReadDirectlyByFlareCode.txt')
-                except Exception as e:
-                    print(f"WARNING: Zeroing failed for node {idx}: {e}", flush=True)
-                
-            with open(zero_flag_file, "w") as f:
-                f.write("zeroed")
+        if scheduler is None:
+            # Now loop to handle socket commands (blocks in select while idle)
+            socket_server.serve_forever()
         else:
-            print("INFO: Zeroing already done, skipping", flush=True)
+            # Wait in select() only until the next node poll is due
+            while socket_server.running:
+                socket_server.handle_one(scheduler.next_wakeup())
+                poll_due_nodes(arbiter, nodes)
+    finally:
+        zero_before_exit(arbiter, nodes)
 
-        # Publish initial status
-        publish_status(ser, nodes)
 
-        # Now loop to handle socket commands
-        while True:
-            socket_server.handle_one()
-       
-    except Exception as e:
-        print('ERROR:', e)
+async def run_async() -> int:
+    """asyncio runtime: bus, control socket and polling on one loop."""
+    arbiter = install_arbiter(AsyncBusArbiter(get_serial))
+    arbiter.attach(asyncio.get_running_loop())
+    nodes = []
+    try:
+        nodes = await asyncio.to_thread(start_publisher, arbiter)
+        if not nodes:
+            return 1
+
+        scheduler = make_scheduler(nodes)
+        runtime = PublisherRuntime(
+            make_command_handler(arbiter, nodes),
+            poll=(lambda: poll_due_nodes(arbiter, nodes)) if scheduler else None,
+        )
+        await runtime.run()
+        return 0
     finally:
-        
-        print("Zeroing before exit")
+        await asyncio.to_thread(zero_before_exit, arbiter, nodes)
+        await arbiter.aclose()
 
-        for idx, nodeinfo in enumerate(nodes[:2]):
-            try:
-                addr = nodeinfo["address"]
-                node_inst = get_instrument(addr)
-                node_inst.writeParameter(9, 0)
-                print(f"Zeroed node {idx}")
-            except Exception as e:
-                print(f"FAILED to zero node {idx}: {e}")
 
-        ser.close()
-        print("Program closed safely")
+def main():
+    global data_channel
+    setup_logging(MFC_LOG_LEVEL, MFC_FLIGHT_RECORDS, MFC_FLIGHT_DUMP or None)
+    data_channel = DataChannel.from_env()
+
+    try:
+        get_serial()
+    except Exception as e:
+        log.critical("Could not open serial: %s", e)
+        sys.exit(1)
+
+    exit_code = 0
+    try:
+        if MFC_RUNTIME == "blocking":
+            exit_code = run_blocking()
+        else:
+            exit_code = asyncio.run(run_async())
+    except KeyboardInterrupt:
+        pass
+    except Exception as e:
+        log.exception("Publisher failed: %s", e)
+    finally:
+        close_all()
+        close_telemetry_writers()
+        if data_channel is not None:
+            data_channel.close()
+        gps.stop_service()
+        log.info("Program closed safely")
+
+    if exit_code:
+        sys.exit(exit_code)
 
 
 
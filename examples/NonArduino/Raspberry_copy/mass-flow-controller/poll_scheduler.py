@@ -0,0 +1,333 @@
+"""
+Fair polling scheduler for the MFC status publisher.
+
+Every discovered node has its own poll interval. Each cycle, due() hands
+out the nodes whose poll is due, most overdue first (ties broken by a
+rotating round-robin cursor), but only as many as the bus-time budget
+allows: a token bucket refilled at `budget` seconds of bus time per
+second of wall time, drained by the measured cost of each poll. With
+more nodes than the budget can serve at their nominal interval, every
+node's effective cadence stretches evenly instead of each cycle growing
+longer, and there is always bus time left for setpoint traffic.
+"""
+
+import threading
+import time
+from typing import Dict, Iterable, List, Optional
+
+# Fraction of wall time the background poll may keep the bus busy
+DEFAULT_BUDGET = 0.5
+# Seconds of unused budget that may accumulate (burst size)
+DEFAULT_BURST = 1.0
+# Cost assumed for a node that has never been polled (seconds)
+DEFAULT_COST = 0.02
+# EWMA weight of the latest poll duration
+COST_ALPHA = 0.25
+
+
+class _NodeState:
+    __slots__ = ("interval", "next_due", "cost", "last_polled")
+
+    def __init__(self, interval: float, now: float):
+        self.interval = interval
+        self.next_due = now
+        self.cost = DEFAULT_COST
+        self.last_polled: Optional[float] = None
+
+
+class PollScheduler:
+    """Round-robin, per-node interval, bus-budgeted poll planner."""
+
+    def __init__(self, node_ids: Iterable[int], interval: float,
+                 budget: float = DEFAULT_BUDGET, burst: float = DEFAULT_BURST,
+                 intervals: Optional[Dict[int, float]] = None):
+        """
+        Args:
+            node_ids: ids of the nodes to poll (MFC index)
+            interval: default seconds between polls of one node
+            budget: fraction (0..1] of bus time background polls may use
+            burst: seconds of bus time that may be spent in one go
+            intervals: per-node interval overrides {node id: seconds}
+        """
+        if interval <= 0:
+            raise ValueError("Poll interval must be positive")
+        if not 0 < budget <= 1:
+            raise ValueError("Bus budget must be in (0, 1]")
+
+        self.interval = interval
+        self.budget = budget
+        self.burst = burst
+
+        now = time.monotonic()
+        self._lock = threading.Lock()
+        self._nodes: Dict[int, _NodeState] = {}
+        for node_id in node_ids:
+            self._nodes[node_id] = _NodeState(interval, now)
+        for node_id, seconds in (intervals or {}).items():
+            if node_id in self._nodes:
+                self._nodes[node_id].interval = seconds
+
+        self._order: List[int] = list(self._nodes)
+        self._cursor = 0
+        self._tokens = burst
+        self._refilled = now
+
+    # --------------------------------------------------
+    # CONFIGURATION
+    # --------------------------------------------------
+
+    @property
+    def node_ids(self) -> List[int]:
+        return list(self._order)
+
+    def set_interval(self, node_id: int, seconds: float, reschedule: bool = True):
+        """Change one node's poll interval; pulls its next poll in if now sooner."""
+        with self._lock:
+            state = self._nodes[node_id]
+            state.interval = seconds
+            if reschedule and state.last_polled is not None:
+                state.next_due = min(state.next_due, state.last_polled + seconds)
+
+    def interval_of(self, node_id: int) -> float:
+        return self._nodes[node_id].interval
+
+    def poll_soon(self, node_id: int):
+        """Make a node due immediately (e.g. after a setpoint write)."""
+        with self._lock:
+            self._nodes[node_id].next_due = time.monotonic()
+
+    # --------------------------------------------------
+    # PLANNING
+    # --------------------------------------------------
+
+    def due(self, now: Optional[float] = None) -> List[int]:
+        """Nodes to poll now, fair order, within the bus budget."""
+        if now is None:
+            now = time.monotonic()
+        with self._lock:
+            self._refill(now)
+            count = len(self._order)
+            # Rotate the tie-break so equal-age nodes take turns going first
+            rank = {
+                node_id: (i - self._cursor) % count
+                for i, node_id in enumerate(self._order)
+            }
+            ready = sorted(
+                (n for n in self._order if self._nodes[n].next_due <= now),
+                key=lambda n: (self._nodes[n].next_due, rank[n]),
+            )
+
+            selected = []
+            tokens = self._tokens
+            for node_id in ready:
+                cost = self._nodes[node_id].cost
+                # The first node only needs a positive balance, so a poll
+                # costlier than the whole burst still runs (and goes into debt)
+                if cost > tokens and (selected or tokens <= 0):
+                    break
+                selected.append(node_id)
+                tokens -= cost
+
+            if selected and count:
+                self._cursor = (self._order.index(selected[-1]) + 1) % count
+            return selected
+
+    def record(self, node_id: int, duration: float, now: Optional[float] = None):
+        """Account one finished poll of `node_id` that kept the bus `duration` s."""
+        if now is None:
+            now = time.monotonic()
+        with self._lock:
+            state = self._nodes.get(node_id)
+            if state is None:
+                return
+            state.cost += COST_ALPHA * (duration - state.cost)
+            state.last_polled = now
+            # Keep the phase, but never schedule in the past or beyond one interval
+            state.next_due = min(max(state.next_due + state.interval, now), now + state.interval)
+            self._refill(now)
+            self._tokens -= duration
+
+    def next_wakeup(self, now: Optional[float] = None) -> float:
+        """Seconds until the next poll could run (due node and budget)."""
+        if now is None:
+            now = time.monotonic()
+        with self._lock:
+            if not self._nodes:
+                return self.interval
+            self._refill(now)
+            wait_due = max(0.0, min(s.next_due for s in self._nodes.values()) - now)
+            # due() needs a positive balance: time to pay off any debt
+            wait_budget = -self._tokens / self.budget if self._tokens <= 0 else 0.0
+            return max(wait_due, wait_budget)
+
+    def utilization(self) -> float:
+        """Bus fraction the current intervals would need at measured costs."""
+        with self._lock:
+            return sum(s.cost / s.interval for s in self._nodes.values())
+
+    # --------------------------------------------------
+    # INTERNALS
+    # --------------------------------------------------
+
+    def _refill(self, now: float):
+        elapsed = now - self._refilled
+        if elapsed > 0:
+            self._tokens = min(self.burst, self._tokens + elapsed * self.budget)
+            self._refilled = now
+
+
+def parse_intervals(spec: str) -> Dict[int, float]:
+    """'0=0.5,3=5' -> {0: 0.5, 3: 5.0} (per-node interval overrides)."""
+    intervals = {}
+    for part in spec.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        node, _, seconds = part.partition("=")
+        intervals[int(node)] = float(seconds)
+    return intervals
+
+
+# --------------------------------------------------
+# ADAPTIVE POLLING
+# --------------------------------------------------
+
+# Register full scale (32000 counts = 100 %)
+_FULL_SCALE = 32000
+
+
+class _AdaptiveState:
+    __slots__ = ("measure", "setpoint", "audited", "settling_since")
+
+    def __init__(self):
+        self.measure: Optional[int] = None
+        self.setpoint: Optional[int] = None
+        self.audited: Optional[float] = None
+        self.settling_since: Optional[float] = None
+
+
+class AdaptivePollPolicy:
+    """
+    Change-driven poll intervals on top of a PollScheduler.
+
+    - A node that just got a new setpoint is polled every `fast` seconds
+      until its measure is within `settle_band` of the setpoint (or
+      `settle_timeout` passes, e.g. no gas supply).
+    - A node whose measure moved more than `drift_band` since its last
+      poll goes back to `fast`.
+    - Otherwise the interval grows by `backoff` per poll up to `slow`,
+      the floor rate.
+    - The setpoint register is only re-read every `audit_interval`
+      seconds: the publisher wrote it, so in between its own value is
+      used.
+
+    Bands are in register counts (32000 = 100 % of full scale), so no
+    calibration is needed to decide how often to poll.
+    """
+
+    def __init__(self, scheduler: PollScheduler, fast: float, slow: float,
+                 backoff: float = 2.0, settle_band: float = 0.01,
+                 drift_band: float = 0.005, settle_timeout: float = 30.0,
+                 audit_interval: float = 60.0):
+        """
+        Args:
+            fast: seconds between polls while settling / drifting
+            slow: longest interval for a stable node (floor rate)
+            settle_band, drift_band: fractions of full scale
+        """
+        if not 0 < fast <= slow:
+            raise ValueError("Need 0 < fast <= slow")
+        self.scheduler = scheduler
+        self.fast = fast
+        self.slow = slow
+        self.backoff = backoff
+        self.settle_band = settle_band * _FULL_SCALE
+        self.drift_band = drift_band * _FULL_SCALE
+        self.settle_timeout = settle_timeout
+        self.audit_interval = audit_interval
+
+        self._lock = threading.Lock()
+        self._state: Dict[int, _AdaptiveState] = {
+            node_id: _AdaptiveState() for node_id in scheduler.node_ids
+        }
+        for node_id in scheduler.node_ids:
+            scheduler.set_interval(node_id, fast)
+
+    def needs_setpoint(self, node_id: int, now: Optional[float] = None) -> bool:
+        """Should this poll include the setpoint register?"""
+        state = self._state.get(node_id)
+        if state is None or state.setpoint is None or state.audited is None:
+            return True
+        if now is None:
+            now = time.monotonic()
+        return now - state.audited >= self.audit_interval
+
+    def setpoint_register(self, node_id: int) -> Optional[int]:
+        """Last known setpoint register (written or audited)."""
+        state = self._state.get(node_id)
+        return state.setpoint if state is not None else None
+
+    def setpoint_written(self, node_id: int, register: int):
+        """The publisher wrote a new setpoint: start settling, poll now."""
+        state = self._state.get(node_id)
+        if state is None:
+            return
+        with self._lock:
+            state.setpoint = int(register)
+            state.settling_since = time.monotonic()
+        self.scheduler.set_interval(node_id, self.fast)
+        self.scheduler.poll_soon(node_id)
+
+    def setpoint_trimmed(self, node_id: int, register: int):
+        """
+        A closed-loop trim moved the setpoint register by a few counts:
+        remember it so the next audit does not take it for a change
+        behind our back, but keep the current poll interval.
+        """
+        state = self._state.get(node_id)
+        if state is None:
+            return
+        with self._lock:
+            state.setpoint = int(register)
+
+    def observe(self, node_id: int, measure: int, setpoint: Optional[int] = None,
+                now: Optional[float] = None) -> float:
+        """
+        Feed one poll result (raw registers); `setpoint` only when it was
+        actually read. Returns the node's new poll interval.
+        """
+        state = self._state.get(node_id)
+        if state is None:
+            return self.scheduler.interval
+        if now is None:
+            now = time.monotonic()
+
+        with self._lock:
+            if setpoint is not None:
+                if state.setpoint is not None and setpoint != state.setpoint:
+                    # Changed behind our back (front panel, other master)
+                    state.settling_since = now
+                state.setpoint = setpoint
+                state.audited = now
+
+            drifting = (
+                state.measure is not None
+                and abs(measure - state.measure) > self.drift_band
+            )
+            state.measure = measure
+
+            if state.settling_since is not None:
+                settled = (
+                    state.setpoint is not None
+                    and abs(measure - state.setpoint) <= self.settle_band
+                )
+                if settled or now - state.settling_since > self.settle_timeout:
+                    state.settling_since = None
+
+            if state.settling_since is not None or drifting:
+                interval = self.fast
+            else:
+                interval = min(self.slow, self.scheduler.interval_of(node_id) * self.backoff)
+
+        self.scheduler.set_interval(node_id, interval, reschedule=False)
+        return interval
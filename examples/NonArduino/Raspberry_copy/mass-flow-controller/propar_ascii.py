@@ -0,0 +1,204 @@
+"""
+ProPar ASCII request builder / reply decoder for chained parameter reads.
+
+A single ProPar "request parameter" (command 04) frame may carry several
+parameters: parameters of one process are chained with bit 7 of the
+parameter byte, further processes with bit 7 of the process byte. The
+instrument answers with one "send parameter" (command 02) frame holding
+every value in the same order, so N parameters cost one bus exchange.
+
+    request : ':' LL NN 04 {proc|chain {param|chain proc param}...}... CR LF
+    reply   : ':' LL NN 02 {proc|chain {param|chain value}...}... CR LF
+    status  : ':' LL NN 00 status index CR LF   (error reply)
+    write   : ':' LL NN 01 proc param value CR LF  (answered by a status)
+
+param byte = chain (0x80) | type (0x60 mask) | index (0x1F mask)
+"""
+
+import struct
+from collections import namedtuple
+from typing import Dict, List, Sequence
+
+CMD_STATUS = 0x00
+CMD_SEND_PARAM_ACK = 0x01
+CMD_SEND_PARAM = 0x02
+CMD_REQUEST_PARAM = 0x04
+
+CHAIN = 0x80
+PROC_MASK = 0x7F
+TYPE_MASK = 0x60
+INDEX_MASK = 0x1F
+
+TYPE_CHAR = 0x00    # 1 byte
+TYPE_INT = 0x20     # 2 bytes
+TYPE_LONG = 0x40    # 4 bytes (unsigned long or IEEE float)
+TYPE_STRING = 0x60  # not supported in chained reads
+
+_VALUE_SIZE = {TYPE_CHAR: 1, TYPE_INT: 2, TYPE_LONG: 4}
+
+# name, process, parameter index, ProPar type, decode as float
+ParamSpec = namedtuple("ParamSpec", "name proc index ptype is_float")
+
+MEASURE = ParamSpec("measure", 1, 0, TYPE_INT, False)            # DDE 8
+SETPOINT = ParamSpec("setpoint", 1, 1, TYPE_INT, False)          # DDE 9
+ALARM_INFO = ParamSpec("alarm_info", 1, 20, TYPE_CHAR, False)    # DDE 28
+VALVE_OUTPUT = ParamSpec("valve_output", 114, 1, TYPE_LONG, False)  # DDE 55
+TEMPERATURE = ParamSpec("temperature", 33, 7, TYPE_LONG, True)   # DDE 142
+
+STATUS_PARAMS = (MEASURE, SETPOINT)
+DIAGNOSTIC_PARAMS = (VALVE_OUTPUT, TEMPERATURE, ALARM_INFO)
+
+# FlowDDE number -> parameter, for BusArbiter.read_parameter/write_parameter
+PARAMS_BY_DDE = {
+    8: MEASURE,
+    9: SETPOINT,
+    28: ALARM_INFO,
+    55: VALVE_OUTPUT,
+    142: TEMPERATURE,
+}
+
+
+class ProparError(RuntimeError):
+    """Instrument answered with a status (error) frame."""
+
+    def __init__(self, status: int, index: int):
+        super().__init__(f"ProPar status 0x{status:02X} at byte {index}")
+        self.status = status
+        self.index = index
+
+
+def param_for_dde(dde: int) -> ParamSpec:
+    spec = PARAMS_BY_DDE.get(dde)
+    if spec is None:
+        raise ValueError(f"No ProPar parameter known for DDE {dde}")
+    return spec
+
+
+def _frame(address: int, data: List[int]) -> bytes:
+    if not (0 <= address <= 255):
+        raise ValueError("Node must be 0-255")
+    data = [address] + data
+    return (":" + f"{len(data):02X}" + bytes(data).hex().upper() + "\r\n").encode()
+
+
+def _frame_bytes(reply: bytes) -> bytes:
+    """Length-checked bytes of an ASCII reply frame (after the ':')."""
+    body = reply.decode(errors="ignore").strip()
+    if not body.startswith(":"):
+        raise ValueError("Missing frame start")
+    try:
+        raw = bytes.fromhex(body[1:])
+    except ValueError:
+        raise ValueError(f"Bad hex in frame: {body!r}")
+
+    if len(raw) < 3 or raw[0] != len(raw) - 1:
+        raise ValueError("Short frame")
+    return raw
+
+
+def _group_by_process(specs: Sequence[ParamSpec]):
+    groups: Dict[int, List[ParamSpec]] = {}
+    for spec in specs:
+        if spec.ptype == TYPE_STRING:
+            raise ValueError(f"String parameter '{spec.name}' can't be chained")
+        groups.setdefault(spec.proc, []).append(spec)
+    return list(groups.items())
+
+
+def build_read_request(address: int, specs: Sequence[ParamSpec]) -> bytes:
+    """One chained command-04 frame requesting every parameter in `specs`."""
+    if not specs:
+        raise ValueError("No parameters requested")
+
+    groups = _group_by_process(specs)
+    data = [CMD_REQUEST_PARAM]
+
+    for g, (proc, group) in enumerate(groups):
+        data.append(proc | (CHAIN if g < len(groups) - 1 else 0))
+        for p, spec in enumerate(group):
+            code = spec.ptype | spec.index
+            data.append(code | (CHAIN if p < len(group) - 1 else 0))
+            data.append(proc)
+            data.append(code)
+
+    return _frame(address, data)
+
+
+def build_write_request(address: int, spec: ParamSpec, value) -> bytes:
+    """One command-01 frame writing `value` to `spec`; the node answers with a status."""
+    if spec.ptype == TYPE_STRING:
+        raise ValueError(f"String parameter '{spec.name}' can't be written")
+    if spec.is_float:
+        value_bytes = struct.pack(">f", float(value))
+    else:
+        value_bytes = int(value).to_bytes(_VALUE_SIZE[spec.ptype], "big")
+    return _frame(address, [CMD_SEND_PARAM_ACK, spec.proc, spec.ptype | spec.index, *value_bytes])
+
+
+def decode_write_reply(reply: bytes) -> bool:
+    """
+    Check the status frame answering a write.
+    Returns True; raises ProparError if the node rejected the value.
+    """
+    raw = _frame_bytes(reply)
+    if raw[2] != CMD_STATUS or len(raw) < 4:
+        raise ValueError(f"Unexpected command 0x{raw[2]:02X}")
+    if raw[3] != 0:
+        raise ProparError(raw[3], raw[4] if len(raw) > 4 else 0)
+    return True
+
+
+def decode_read_reply(reply: bytes, specs: Sequence[ParamSpec]) -> Dict[str, float]:
+    """
+    Decode a command-02 reply to a chained request.
+    Returns {spec.name: value}; raises ProparError on a status frame.
+    """
+    raw = _frame_bytes(reply)
+    command = raw[2]
+    if command == CMD_STATUS:
+        raise ProparError(raw[3] if len(raw) > 3 else 0, raw[4] if len(raw) > 4 else 0)
+    if command != CMD_SEND_PARAM:
+        raise ValueError(f"Unexpected command 0x{command:02X}")
+
+    by_key = {(spec.proc, spec.index): spec for spec in specs}
+    values: Dict[str, float] = {}
+    pos = 3
+
+    try:
+        more_procs = True
+        while more_procs:
+            proc_byte = raw[pos]
+            pos += 1
+            more_procs = bool(proc_byte & CHAIN)
+            proc = proc_byte & PROC_MASK
+
+            more_params = True
+            while more_params:
+                param_byte = raw[pos]
+                pos += 1
+                more_params = bool(param_byte & CHAIN)
+                ptype = param_byte & TYPE_MASK
+                index = param_byte & INDEX_MASK
+
+                size = _VALUE_SIZE.get(ptype)
+                if size is None:
+                    raise ValueError(f"Unsupported parameter type 0x{ptype:02X}")
+                chunk = raw[pos:pos + size]
+                if len(chunk) != size:
+                    raise ValueError("Short frame")
+                pos += size
+
+                spec = by_key.get((proc, index))
+                if spec is None:
+                    continue
+                if spec.is_float:
+                    values[spec.name] = struct.unpack(">f", chunk)[0]
+                else:
+                    values[spec.name] = int.from_bytes(chunk, "big")
+    except IndexError:
+        raise ValueError("Short frame")
+
+    missing = [spec.name for spec in specs if spec.name not in values]
+    if missing:
+        raise ValueError(f"Reply missing parameters: {missing}")
+    return values
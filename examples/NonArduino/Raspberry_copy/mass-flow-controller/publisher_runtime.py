@@ -0,0 +1,292 @@
+"""
+asyncio runtime for the status publisher.
+
+- AsyncBusArbiter: the bus owner runs on the event loop. Raw ProPar
+  frames (parameter reads and writes included) are exchanged through
+  loop.add_reader on the port's fd (no thread parked in read()), other
+  jobs (node discovery) are handed to a single worker thread and
+  awaited, so the port is still used by one job at a time, highest
+  priority first.
+- PublisherRuntime: serves the control socket and the periodic poll
+  concurrently on the same loop. The blocking command handlers run in
+  worker threads, so a slow node or a GPS timeout in one request never
+  delays a setpoint arriving on another connection.
+"""
+
+import asyncio
+import json
+import logging
+import signal
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Optional
+
+import serial_io
+from bus_arbiter import PRIORITY_COMMAND, PRIORITY_POLL, BusArbiter
+from socket_commands import TCP_HOST, TCP_PORT, SocketServer, dispatch_command
+
+log = logging.getLogger(__name__)
+
+
+class _RawFrame:
+    """Bus job marker: exchange one ASCII frame via the event loop."""
+
+    __slots__ = ("cmd", "address")
+
+    def __init__(self, cmd: bytes, address: Optional[int]):
+        self.cmd = cmd
+        self.address = address
+
+
+_STOP = object()
+
+
+class AsyncBusArbiter(BusArbiter):
+    """
+    BusArbiter driven by an asyncio loop instead of a dedicated thread.
+    Same submit/transact/write_parameter/read_parameter API; every call
+    is thread-safe and returns a concurrent.futures.Future.
+    """
+
+    def __init__(self, serial_factory: Callable):
+        super().__init__(serial_factory)
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._jobs: Optional[asyncio.PriorityQueue] = None
+        self._task: Optional[asyncio.Task] = None
+        # Function jobs block: run them off-loop, one at a time
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="bus-job")
+
+    # --------------------------------------------------
+    # LIFECYCLE
+    # --------------------------------------------------
+
+    def attach(self, loop: asyncio.AbstractEventLoop):
+        """Start serving jobs on `loop` (call from the loop's thread)."""
+        self._loop = loop
+        self._jobs = asyncio.PriorityQueue()
+        self._task = loop.create_task(self._run_async())
+
+    def start(self):
+        if self._task is None:
+            raise RuntimeError("AsyncBusArbiter must be attached to a running loop")
+
+    async def aclose(self):
+        """Finish the jobs already queued, then stop."""
+        if self._task is None:
+            return
+        self._jobs.put_nowait((float("inf"), next(self._seq), _STOP, None))
+        await self._task
+        self._task = None
+        self._executor.shutdown(wait=False)
+
+    def stop(self, timeout: float = 5.0):
+        if self._task is None or self._loop is None or self._loop.is_closed():
+            return
+        asyncio.run_coroutine_threadsafe(self.aclose(), self._loop).result(timeout)
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    # --------------------------------------------------
+    # JOBS
+    # --------------------------------------------------
+
+    def submit(self, fn, priority: int = PRIORITY_COMMAND) -> Future:
+        if not self.running:
+            raise RuntimeError("Bus arbiter is not running")
+        future = Future()
+        item = (priority, next(self._seq), fn, future)
+        self._loop.call_soon_threadsafe(self._jobs.put_nowait, item)
+        return future
+
+    def transact(self, cmd: bytes, address: Optional[int] = None,
+                 priority: int = PRIORITY_POLL) -> Future:
+        return self.submit(_RawFrame(cmd, address), priority)
+
+    # --------------------------------------------------
+    # INTERNALS
+    # --------------------------------------------------
+
+    async def _run_async(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            _, _, job, future = await self._jobs.get()
+            if job is _STOP:
+                break
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                if isinstance(job, _RawFrame):
+                    result = await serial_io.async_transact(
+                        self._serial_factory(), job.cmd, job.address
+                    )
+                else:
+                    result = await loop.run_in_executor(self._executor, job)
+            except Exception as e:
+                future.set_exception(e)
+            else:
+                future.set_result(result)
+
+
+class PublisherRuntime:
+    """Control socket + periodic polling on one event loop."""
+
+    def __init__(self, command_handler: Callable, poll: Optional[Callable] = None,
+                 poll_interval: float = 0.0, host: str = TCP_HOST, port: int = TCP_PORT):
+        """
+        Args:
+            command_handler: the publisher's blocking command_handler
+            poll: blocking callable run periodically; if it returns a
+                number, that is the delay (s) until its next run
+            poll_interval: seconds between polls when `poll` returns None
+        """
+        self.handler = command_handler
+        self.poll = poll
+        self.poll_interval = poll_interval
+        self.host = host
+        self.port = port
+
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._stopping: Optional[asyncio.Event] = None
+        self._clients = set()
+
+    # --------------------------------------------------
+    # AWAITABLE OPERATIONS
+    # --------------------------------------------------
+
+    async def call(self, action, *args):
+        """Run one command_handler action in a worker thread."""
+        return await asyncio.to_thread(self.handler, action, *args)
+
+    async def setpoint(self, mfc_id: int, setpoint: float):
+        return await self.call("setpoint", mfc_id, setpoint)
+
+    async def gas(self, mfc_id: int, gas_cmd: int):
+        return await self.call("gas", mfc_id, None, gas_cmd)
+
+    async def batch(self, ops: list):
+        return await asyncio.to_thread(self.handler, "batch", ops=ops)
+
+    async def status(self, max_age=None):
+        return await asyncio.to_thread(self.handler, "status", max_age=max_age)
+
+    async def stats(self, mfc_id=None, window=None):
+        return await asyncio.to_thread(self.handler, "stats", mfc_id, window=window)
+
+    async def profile(self, mfc_id=None, profile=None, payload=None):
+        return await asyncio.to_thread(
+            self.handler, "profile", mfc_id, profile=profile, payload=payload,
+        )
+
+    async def profile_stop(self, mfc_id=None):
+        return await asyncio.to_thread(self.handler, "profile_stop", mfc_id)
+
+    async def trim(self, mfc_id=None, enabled=None):
+        return await asyncio.to_thread(self.handler, "trim", mfc_id, enabled=enabled)
+
+    async def debug_dump(self, limit=None):
+        return await asyncio.to_thread(self.handler, "debug_dump", limit=limit)
+
+    async def dispatch(self, cmd: dict) -> dict:
+        return await asyncio.to_thread(dispatch_command, self.handler, cmd)
+
+    # --------------------------------------------------
+    # LIFECYCLE
+    # --------------------------------------------------
+
+    async def run(self):
+        """Serve until stop() or SIGTERM/SIGINT."""
+        self._loop = asyncio.get_running_loop()
+        self._stopping = asyncio.Event()
+
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            try:
+                self._loop.add_signal_handler(sig, self._stopping.set)
+            except (NotImplementedError, RuntimeError):
+                pass
+
+        server = await asyncio.start_server(
+            self._serve_client, self.host, self.port, reuse_address=True,
+            limit=SocketServer.MAX_LINE,
+        )
+        log.info("[PublisherRuntime] Listening on %s:%s", self.host, self.port)
+
+        tasks = []
+        if self.poll is not None:
+            tasks.append(asyncio.create_task(self._poll_loop()))
+
+        try:
+            await self._stopping.wait()
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            server.close()
+            for writer in list(self._clients):
+                writer.close()
+            await server.wait_closed()
+            log.info("[PublisherRuntime] Stopped")
+
+    def stop(self):
+        """Thread-safe request to leave run()."""
+        if self._loop is not None and self._stopping is not None:
+            self._loop.call_soon_threadsafe(self._stopping.set)
+
+    # --------------------------------------------------
+    # INTERNALS
+    # --------------------------------------------------
+
+    async def _poll_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            delay = None
+            try:
+                delay = await asyncio.to_thread(self.poll)
+            except Exception as e:
+                log.error("Periodic poll failed: %s", e)
+            if not isinstance(delay, (int, float)):
+                # Fixed cadence (once a second if no interval was given)
+                delay = (self.poll_interval or 1.0) - (loop.time() - started)
+            await asyncio.sleep(max(0.0, delay))
+
+    async def _serve_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self._clients.add(writer)
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                except ValueError:
+                    # Over the stream limit: no way to resync on a line
+                    log.warning("[PublisherRuntime] Dropping client: request line too long")
+                    response = {"success": False, "message": "Request line too long"}
+                    writer.write(json.dumps(response).encode() + b"\n")
+                    await writer.drain()
+                    break
+                if not line:
+                    break
+                if not line.strip():
+                    continue
+
+                cmd = None
+                try:
+                    cmd = json.loads(line)
+                    response = await self.dispatch(cmd)
+                except json.JSONDecodeError as e:
+                    response = {"success": False, "message": f"JSON parse error: {e}"}
+                except Exception as e:
+                    response = {"success": False, "message": f"Handler error: {e}"}
+                    if isinstance(cmd, dict) and "id" in cmd:
+                        response["id"] = cmd["id"]
+
+                writer.write(json.dumps(response).encode() + b"\n")
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self._clients.discard(writer)
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except Exception:
+                pass
@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+"""
+Re-apply a newer calibration file to a status CSV log.
+
+Usage:
+    recalibrate_log.py <calibration_file> <input.csv[.gz]> <output.csv[.gz]> [chunk_rows]
+
+The publisher logs the raw 0-32000 registers next to every calibrated
+value, with the fingerprint of the calibration that converted them
+(Gas, Cal Date, Slope, Offset). This tool streams the log through
+`chunk_rows` rows at a time (default 50000), looks up each row's
+(serial, gas) in the new calibration file, recomputes Setpoint and Flow
+from the registers and rewrites the fingerprint columns; memory use does
+not depend on the size of the log. Closed segments (.csv.gz) are read
+and written compressed.
+
+Rows whose device/gas is not in the new file, or that have no raw flow
+register, are copied unchanged and counted in the summary. Logs written
+before the raw columns existed are refused: there is nothing to
+recompute from.
+"""
+
+import csv
+import gzip
+import math
+import os
+import sys
+from typing import Dict, List, Optional, Tuple
+
+from calibration_loader import Calibration, clean_serial, iter_calibration_rows
+from calibration_math import CalibrationTable, np, raw_to_calibrated_flow, raw_to_flow_array
+
+DEFAULT_CHUNK_ROWS = 50_000
+
+REQUIRED_COLUMNS = ("Serial", "Setpoint", "Flow", "Setpoint Raw", "Flow Raw",
+                    "Gas", "Cal Date", "Slope", "Offset")
+
+
+def _open_text(path: str, mode: str, compressed: Optional[bool] = None):
+    if compressed is None:
+        compressed = path.endswith(".gz")
+    if compressed:
+        return gzip.open(path, mode + "t", newline="")
+    return open(path, mode, newline="")
+
+
+def _raw(text: str) -> Optional[int]:
+    text = text.strip()
+    return int(float(text)) if text else None
+
+
+def _float(text: str) -> Optional[float]:
+    try:
+        return float(text)
+    except ValueError:
+        return None
+
+
+def _round(value: Optional[float]):
+    return "" if value is None else round(value, 4)
+
+
+class Recalibrator:
+    """Converts chunks of CSV rows against one calibration file."""
+
+    def __init__(self, tsv_path: str, header: List[str]):
+        missing = [name for name in REQUIRED_COLUMNS if name not in header]
+        if missing:
+            raise ValueError(
+                f"Log has no {', '.join(missing)} column(s); it was written before "
+                f"raw registers were logged and cannot be recalibrated"
+            )
+        self.col = {name: header.index(name) for name in REQUIRED_COLUMNS}
+
+        entries = list(iter_calibration_rows(tsv_path))
+        # Same semantics as CalibrationLoader: last row wins per
+        # (serial, gas), the first gas seen for a serial is its default
+        self.by_key: Dict[Tuple[str, str], Calibration] = {}
+        self.default_gas: Dict[str, str] = {}
+        for serial, cal in entries:
+            self.by_key[(serial, cal.gas)] = cal
+            self.default_gas.setdefault(serial, cal.gas)
+        self.table = CalibrationTable(entries) if np is not None else None
+
+        self.converted = 0
+        self.changed = 0
+        self.unmatched = 0
+        self.no_raw = 0
+
+    def process(self, rows: List[List[str]]) -> List[List[str]]:
+        """Recalibrate `rows` in place and return them."""
+        c = self.col
+        keys = []
+        for row in rows:
+            serial = clean_serial(row[c["Serial"]])
+            gas = row[c["Gas"]].strip().upper() or self.default_gas.get(serial, "")
+            keys.append((serial, gas))
+
+        flow_raw = [_raw(row[c["Flow Raw"]]) for row in rows]
+        setpoint_raw = [_raw(row[c["Setpoint Raw"]]) for row in rows]
+        flows, setpoints = self._convert(keys, flow_raw, setpoint_raw)
+
+        for i, row in enumerate(rows):
+            cal = self.by_key.get(keys[i])
+            if cal is None:
+                self.unmatched += 1
+                continue
+            if flow_raw[i] is None:
+                self.no_raw += 1
+                continue
+            if (row[c["Cal Date"]] != (cal.cal_date or "")
+                    or _float(row[c["Slope"]]) != cal.slope
+                    or _float(row[c["Offset"]]) != cal.offset):
+                self.changed += 1
+            row[c["Flow"]] = _round(flows[i])
+            row[c["Setpoint"]] = _round(setpoints[i])
+            row[c["Gas"]] = cal.gas
+            row[c["Cal Date"]] = cal.cal_date or ""
+            row[c["Slope"]] = cal.slope
+            row[c["Offset"]] = cal.offset
+            self.converted += 1
+        return rows
+
+    def _convert(self, keys, flow_raw, setpoint_raw):
+        if self.table is not None:
+            serials = [serial for serial, _ in keys]
+            gases = [gas for _, gas in keys]
+            table_rows = self.table.rows(serials, gases)
+            raw = np.array(
+                [[math.nan if v is None else v for v in flow_raw],
+                 [math.nan if v is None else v for v in setpoint_raw]],
+                dtype=np.float64,
+            )
+            values = raw_to_flow_array(raw, self.table, table_rows)
+            flows, setpoints = values.tolist()
+            return (
+                [None if v is None else flows[i] for i, v in enumerate(flow_raw)],
+                [None if v is None else setpoints[i] for i, v in enumerate(setpoint_raw)],
+            )
+
+        flows, setpoints = [], []
+        for key, f_raw, s_raw in zip(keys, flow_raw, setpoint_raw):
+            cal = self.by_key.get(key)
+            flows.append(None if cal is None or f_raw is None else raw_to_calibrated_flow(f_raw, cal))
+            setpoints.append(None if cal is None or s_raw is None else raw_to_calibrated_flow(s_raw, cal))
+        return flows, setpoints
+
+
+def recalibrate_log(tsv_path: str, in_path: str, out_path: str,
+                    chunk_rows: int = DEFAULT_CHUNK_ROWS) -> Recalibrator:
+    """
+    Stream `in_path` into `out_path` with flows recomputed against
+    `tsv_path`. The output is written to a temporary file and renamed
+    into place, so a failed run never leaves a truncated log.
+
+    Returns:
+        the Recalibrator, for its row counters
+    """
+    if os.path.abspath(in_path) == os.path.abspath(out_path):
+        raise ValueError("Input and output must be different files")
+
+    tmp_path = out_path + ".tmp"
+    with _open_text(in_path, "r") as src:
+        reader = csv.reader(src)
+        header = next(reader, None)
+        if header is None:
+            raise ValueError(f"{in_path} is empty")
+        recalibrator = Recalibrator(tsv_path, header)
+
+        try:
+            with _open_text(tmp_path, "w", out_path.endswith(".gz")) as dst:
+                writer = csv.writer(dst)
+                writer.writerow(header)
+                chunk = []
+                for row in reader:
+                    if len(row) < len(header):
+                        # Short row (crash mid-write): keep as is
+                        writer.writerow(row)
+                        continue
+                    chunk.append(row)
+                    if len(chunk) >= chunk_rows:
+                        writer.writerows(recalibrator.process(chunk))
+                        chunk = []
+                if chunk:
+                    writer.writerows(recalibrator.process(chunk))
+            os.replace(tmp_path, out_path)
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+    return recalibrator
+
+
+if __name__ == "__main__":
+    if len(sys.argv) not in (4, 5):
+        print(f"Usage: {sys.argv[0]} <calibration_file> <input.csv[.gz]> <output.csv[.gz]> [chunk_rows]")
+        sys.exit(1)
+
+    try:
+        result = recalibrate_log(
+            sys.argv[1], sys.argv[2], sys.argv[3],
+            int(sys.argv[4]) if len(sys.argv) == 5 else DEFAULT_CHUNK_ROWS,
+        )
+    except (OSError, ValueError) as e:
+        print(f"ERROR: {e}")
+        sys.exit(1)
+
+    print(
+        f"Recalibrated {result.converted} rows ({result.changed} with a different "
+        f"calibration); {result.unmatched} without a calibration and "
+        f"{result.no_raw} without raw registers copied unchanged"
+    )
+    sys.exit(1 if result.unmatched else 0)
@@ -0,0 +1,194 @@
+"""
+In-memory rolling statistics per MFC.
+
+Each window (1 min, 15 min, 1 h by default) is a ring of fixed-width
+time buckets held in array('d') columns: count, sum, sum of squares,
+min, max, and the same moments of the setpoint tracking error
+(flow - setpoint). A reading updates one bucket per window in O(1); a
+summary folds the window's buckets (a constant 60 by default) into
+count / mean / std / min / max / tracking error without touching the
+disk or keeping raw samples.
+
+Buckets are keyed on time.monotonic(), so GPS fixes coming and going
+(wall-clock steps) can't smear or reorder the windows. Sums are taken
+around a per-node reference value to keep the variance numerically
+stable for a steady flow.
+"""
+
+import array
+import math
+import threading
+import time
+from typing import Dict, List, Optional, Sequence, Tuple
+
+# (name, window length s, buckets)
+DEFAULT_WINDOWS: Tuple[Tuple[str, float, int], ...] = (
+    ("1m", 60.0, 60),
+    ("15m", 900.0, 60),
+    ("1h", 3600.0, 60),
+)
+
+
+class RollingWindow:
+    """Ring of time buckets over the last `span` seconds."""
+
+    __slots__ = (
+        "span", "width", "buckets",
+        "ids", "count", "total", "total_sq", "low", "high",
+        "err_count", "err_total", "err_total_sq",
+    )
+
+    def __init__(self, span: float, buckets: int):
+        self.span = span
+        self.width = span / buckets
+        self.buckets = buckets
+        self.ids = array.array("q", [-1] * buckets)
+        self.count = array.array("d", [0.0] * buckets)
+        self.total = array.array("d", [0.0] * buckets)
+        self.total_sq = array.array("d", [0.0] * buckets)
+        self.low = array.array("d", [math.inf] * buckets)
+        self.high = array.array("d", [-math.inf] * buckets)
+        self.err_count = array.array("d", [0.0] * buckets)
+        self.err_total = array.array("d", [0.0] * buckets)
+        self.err_total_sq = array.array("d", [0.0] * buckets)
+
+    def add(self, now: float, value: float, shifted: float, error: Optional[float]):
+        bucket = int(now // self.width)
+        slot = bucket % self.buckets
+        if self.ids[slot] != bucket:
+            # Slot still holds a bucket from an earlier lap: recycle it
+            self.ids[slot] = bucket
+            self.count[slot] = self.total[slot] = self.total_sq[slot] = 0.0
+            self.err_count[slot] = self.err_total[slot] = self.err_total_sq[slot] = 0.0
+            self.low[slot] = math.inf
+            self.high[slot] = -math.inf
+
+        self.count[slot] += 1.0
+        self.total[slot] += shifted
+        self.total_sq[slot] += shifted * shifted
+        if value < self.low[slot]:
+            self.low[slot] = value
+        if value > self.high[slot]:
+            self.high[slot] = value
+        if error is not None:
+            self.err_count[slot] += 1.0
+            self.err_total[slot] += error
+            self.err_total_sq[slot] += error * error
+
+    def summary(self, now: float, reference: float) -> dict:
+        oldest = int(now // self.width) - self.buckets + 1
+        n = s = sq = en = es = esq = 0.0
+        low, high = math.inf, -math.inf
+        first = None
+        for slot in range(self.buckets):
+            bucket = self.ids[slot]
+            if bucket < oldest or not self.count[slot]:
+                continue
+            n += self.count[slot]
+            s += self.total[slot]
+            sq += self.total_sq[slot]
+            en += self.err_count[slot]
+            es += self.err_total[slot]
+            esq += self.err_total_sq[slot]
+            low = min(low, self.low[slot])
+            high = max(high, self.high[slot])
+            first = bucket if first is None else min(first, bucket)
+
+        if not n:
+            return {"count": 0}
+
+        mean_shifted = s / n
+        variance = max(0.0, sq / n - mean_shifted * mean_shifted)
+        result = {
+            "count": int(n),
+            "mean": round(reference + mean_shifted, 5),
+            "std": round(math.sqrt(variance * n / (n - 1)) if n > 1 else 0.0, 5),
+            "min": round(low, 5),
+            "max": round(high, 5),
+            # Time actually covered (window still filling after start-up)
+            "span": round(min(self.span, now - first * self.width), 1),
+        }
+        if en:
+            result["error_mean"] = round(es / en, 5)
+            result["error_rms"] = round(math.sqrt(esq / en), 5)
+        return result
+
+
+class _NodeStats:
+    __slots__ = ("reference", "last", "windows")
+
+    def __init__(self, windows: Sequence[Tuple[str, float, int]]):
+        self.reference: Optional[float] = None
+        self.last: Optional[Tuple[float, Optional[float]]] = None
+        self.windows: Dict[str, RollingWindow] = {
+            name: RollingWindow(span, buckets) for name, span, buckets in windows
+        }
+
+
+class RollingStats:
+    """Per-node rolling windows; thread-safe add() / summary()."""
+
+    def __init__(self, windows: Sequence[Tuple[str, float, int]] = DEFAULT_WINDOWS):
+        self.window_specs = tuple(windows)
+        self._lock = threading.Lock()
+        self._nodes: Dict[int, _NodeStats] = {}
+
+    @property
+    def window_names(self) -> List[str]:
+        return [name for name, _, _ in self.window_specs]
+
+    def add(self, node: int, flow: float, setpoint: Optional[float] = None,
+            now: Optional[float] = None):
+        """Record one reading in O(1) per window."""
+        if flow is None or math.isnan(flow):
+            return
+        if now is None:
+            now = time.monotonic()
+        error = flow - setpoint if setpoint is not None and not math.isnan(setpoint) else None
+
+        with self._lock:
+            stats = self._nodes.get(node)
+            if stats is None:
+                stats = self._nodes[node] = _NodeStats(self.window_specs)
+            if stats.reference is None:
+                stats.reference = flow
+            shifted = flow - stats.reference
+            for window in stats.windows.values():
+                window.add(now, flow, shifted, error)
+            stats.last = (flow, setpoint)
+
+    def summary(self, node: Optional[int] = None, window: Optional[str] = None,
+                now: Optional[float] = None) -> List[dict]:
+        """
+        Summaries as [{"id": node, "last": {...}, "windows": {name: {...}}}].
+
+        Args:
+            node: one MFC index (default: every node seen)
+            window: one window name (default: all windows)
+        """
+        if window is not None and window not in self.window_names:
+            raise ValueError(f"Unknown window '{window}'; have {self.window_names}")
+        if now is None:
+            now = time.monotonic()
+
+        with self._lock:
+            ids = sorted(self._nodes) if node is None else [node]
+            result = []
+            for node_id in ids:
+                stats = self._nodes.get(node_id)
+                if stats is None:
+                    continue
+                flow, setpoint = stats.last
+                result.append({
+                    "id": node_id,
+                    "last": {
+                        "flow": round(flow, 5),
+                        "setpoint": round(setpoint, 5) if setpoint is not None else None,
+                    },
+                    "windows": {
+                        name: w.summary(now, stats.reference)
+                        for name, w in stats.windows.items()
+                        if window is None or name == window
+                    },
+                })
+            return result
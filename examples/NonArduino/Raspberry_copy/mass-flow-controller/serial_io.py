@@ -0,0 +1,227 @@
+"""
+Frame-aware serial I/O for ProPar ASCII exchanges.
+
+ProPar ASCII replies are short and always end in CR LF, so instead of
+`ser.read(100)` (which waits out the whole port timeout) `read_frame`
+returns as soon as the terminator arrives. `transact` also keeps a
+per-node round-trip estimate (TCP RTO style: SRTT + 4 * RTTVAR) so the
+timeout follows the real bus latency instead of a fixed second.
+"""
+
+import asyncio
+import select
+import threading
+import time
+from typing import Dict, Optional
+
+FRAME_TERMINATOR = b"\r\n"
+MAX_FRAME_LEN = 100
+
+# RTO bounds (seconds). The initial value matches the old fixed timeout.
+INITIAL_TIMEOUT = 1.0
+MIN_TIMEOUT = 0.05
+MAX_TIMEOUT = 2.0
+
+
+class RttEstimator:
+    """
+    Per-address retransmission-timeout estimator (RFC 6298).
+
+    - sample() feeds a measured round trip into SRTT / RTTVAR
+    - backoff() doubles the timeout after a miss (Karn's rule:
+      timed-out exchanges never produce a sample)
+    """
+
+    ALPHA = 1.0 / 8.0
+    BETA = 1.0 / 4.0
+    K = 4.0
+
+    def __init__(self, initial: float = INITIAL_TIMEOUT,
+                 min_timeout: float = MIN_TIMEOUT, max_timeout: float = MAX_TIMEOUT):
+        self.initial = initial
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+
+        self._lock = threading.Lock()
+        # address -> [srtt, rttvar, rto]
+        self._state: Dict[Optional[int], list] = {}
+
+    def timeout(self, address: Optional[int]) -> float:
+        state = self._state.get(address)
+        return state[2] if state else self.initial
+
+    def srtt(self, address: Optional[int]) -> Optional[float]:
+        state = self._state.get(address)
+        return state[0] if state and state[0] is not None else None
+
+    def sample(self, address: Optional[int], rtt: float):
+        with self._lock:
+            state = self._state.get(address)
+            if state is None or state[0] is None:
+                srtt, rttvar = rtt, rtt / 2.0
+            else:
+                srtt, rttvar = state[0], state[1]
+                rttvar = (1 - self.BETA) * rttvar + self.BETA * abs(srtt - rtt)
+                srtt = (1 - self.ALPHA) * srtt + self.ALPHA * rtt
+            rto = self._clamp(srtt + self.K * rttvar)
+            self._state[address] = [srtt, rttvar, rto]
+
+    def backoff(self, address: Optional[int]):
+        with self._lock:
+            state = self._state.get(address)
+            if state is None:
+                state = [None, None, self.initial]
+            state[2] = self._clamp(state[2] * 2.0)
+            self._state[address] = state
+
+    def _clamp(self, value: float) -> float:
+        return max(self.min_timeout, min(self.max_timeout, value))
+
+
+# Pause before re-selecting when the fd was readable but held no bytes
+SPURIOUS_WAKE_DELAY = 0.001
+
+# Shared by every caller in the process (one bus, one estimate per node)
+rtt_estimator = RttEstimator()
+
+
+def read_frame(ser, timeout: float, terminator: bytes = FRAME_TERMINATOR,
+               max_len: int = MAX_FRAME_LEN) -> bytes:
+    """
+    Read until `terminator`, `max_len` bytes or `timeout` seconds,
+    whichever comes first. Waits on fd readiness, so it returns within
+    a byte time of the terminator arriving.
+    """
+    try:
+        fd = ser.fileno()
+    except Exception:
+        fd = None
+
+    if fd is None:
+        # Non-POSIX port: fall back to pyserial's own terminator search
+        previous = ser.timeout
+        ser.timeout = timeout
+        try:
+            return ser.read_until(terminator, max_len)
+        finally:
+            ser.timeout = previous
+
+    deadline = time.monotonic() + timeout
+    buf = bytearray()
+
+    while True:
+        end = buf.find(terminator)
+        if end >= 0:
+            return bytes(buf[:end + len(terminator)])
+        if len(buf) >= max_len:
+            return bytes(buf)
+
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return bytes(buf)
+
+        ready, _, _ = select.select([fd], [], [], remaining)
+        if not ready:
+            return bytes(buf)
+
+        # Only ask for what is already buffered: never blocks
+        waiting = ser.in_waiting
+        if not waiting:
+            # Readable but nothing buffered (spurious wakeup, hangup):
+            # read() would block for the port's own timeout, so go back
+            # to select instead, with a pause in case the fd stays ready
+            time.sleep(min(remaining, SPURIOUS_WAKE_DELAY))
+            continue
+        buf += ser.read(min(waiting, max_len - len(buf)))
+
+
+def address_from_frame(cmd: bytes) -> Optional[int]:
+    """Node address of an ASCII ProPar frame (':LLNN...')."""
+    try:
+        return int(cmd[3:5], 16)
+    except (ValueError, IndexError):
+        return None
+
+
+async def async_read_frame(ser, timeout: float, terminator: bytes = FRAME_TERMINATOR,
+                           max_len: int = MAX_FRAME_LEN) -> bytes:
+    """
+    Event-loop version of read_frame: waits on the port's fd through
+    loop.add_reader, so other coroutines run while the reply is on
+    the wire.
+    """
+    loop = asyncio.get_running_loop()
+    fd = ser.fileno()
+    deadline = loop.time() + timeout
+    buf = bytearray()
+
+    readable = asyncio.Event()
+    loop.add_reader(fd, readable.set)
+    try:
+        while True:
+            end = buf.find(terminator)
+            if end >= 0:
+                return bytes(buf[:end + len(terminator)])
+            if len(buf) >= max_len:
+                return bytes(buf)
+
+            waiting = ser.in_waiting
+            if waiting:
+                buf += ser.read(min(waiting, max_len - len(buf)))
+                continue
+
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                return bytes(buf)
+
+            readable.clear()
+            try:
+                await asyncio.wait_for(readable.wait(), remaining)
+            except asyncio.TimeoutError:
+                return bytes(buf)
+    finally:
+        loop.remove_reader(fd)
+
+
+def transact(ser, cmd: bytes, address: Optional[int] = None,
+             estimator: RttEstimator = rtt_estimator) -> bytes:
+    """
+    Send one ASCII frame and return the complete reply frame.
+    Raises RuntimeError on no / incomplete reply.
+    """
+    if address is None:
+        address = address_from_frame(cmd)
+
+    ser.reset_input_buffer()
+    timeout = estimator.timeout(address)
+
+    start = time.monotonic()
+    ser.write(cmd)
+    reply = read_frame(ser, timeout)
+    return _finish_exchange(address, reply, time.monotonic() - start, estimator)
+
+
+async def async_transact(ser, cmd: bytes, address: Optional[int] = None,
+                         estimator: RttEstimator = rtt_estimator) -> bytes:
+    """transact() for an asyncio bus owner; same timeouts and errors."""
+    if address is None:
+        address = address_from_frame(cmd)
+
+    ser.reset_input_buffer()
+    timeout = estimator.timeout(address)
+
+    start = time.monotonic()
+    ser.write(cmd)
+    reply = await async_read_frame(ser, timeout)
+    return _finish_exchange(address, reply, time.monotonic() - start, estimator)
+
+
+def _finish_exchange(address, reply: bytes, elapsed: float, estimator: RttEstimator) -> bytes:
+    if reply.endswith(FRAME_TERMINATOR):
+        estimator.sample(address, elapsed)
+        return reply
+
+    estimator.backoff(address)
+    if not reply:
+        raise RuntimeError("No response")
+    raise RuntimeError(f"Incomplete frame after {elapsed * 1000:.0f} ms: {reply!r}")
@@ -101,11 +101,7 @@ def handle_setpoint_command(mfc_id: int, setpoint: float) -> bool:
         if cal is None:
             print(f"ERROR: No calibration found for MFC {mfc_id} serial={serial_num} gas={gas_name}", flush=True)
             return False
-        cal.cal_min = float(cal.cal_min)
-        cal.cal_max = float(cal.cal_max)
-        cal.slope = float(cal.slope)
-        cal.offset = float(cal.offset)
-        
+
         desired_flow = max(cal.cal_min, min(cal.cal_max, setpoint))
         
         raw_percent = (desired_flow - cal.offset) / cal.slope
@@ -166,12 +162,6 @@ def publish_status(ser, nodes):
 
             loader = CalibrationLoader("/home/pi/Documents/Radiolib/examples/NonArduino/Raspberry_copy/mass-flow-controller/MFCCalibrations-ReadDirectlyByFlareCode.txt")
             cal = loader.get(serial=serial_num)
-            cal.device = cal.device
-            cal.cal_min = float(cal.cal_min)
-            cal.cal_max = float(cal.cal_max)
-            cal.slope = float(cal.slope)
-            cal.offset = float(cal.offset)
-
             device = cal.device
             if isinstance(device, tuple):
                 device = device[0]
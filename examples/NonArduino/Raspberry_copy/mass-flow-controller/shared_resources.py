@@ -1,6 +1,8 @@
 import serial
 import propar
 
+from bus_arbiter import BusArbiter
+
 # Shared configuration
 PORT = '/dev/ttyUSB0'
 BAUD = 38400
@@ -10,6 +12,7 @@ TIMEOUT = 1
 _serial = None
 _bus = None
 _instruments = {}
+_arbiter = None
 
 
 def get_serial():
@@ -42,9 +45,62 @@ def get_instrument(address):
     return inst
 
 
+def discover_nodes():
+    """Scan the bus with the propar library, then close its port handle.
+
+    propar keeps its own handle and reader thread on the port; left
+    open next to the arbiter's `get_serial()` handle it would consume
+    replies to our raw frames. Run it as an arbiter job, before any
+    other traffic; nothing in the publisher uses propar afterwards.
+    """
+    try:
+        return get_bus().master.get_nodes()
+    finally:
+        release_bus()
+
+
+def release_bus():
+    """Stop the propar master (reader thread paused, port closed)."""
+    global _bus, _instruments
+    bus = _bus or next(iter(_instruments.values()), None)
+    _bus = None
+    _instruments = {}
+    if bus is not None:
+        try:
+            bus.master.stop()
+        except Exception:
+            pass
+
+
+def get_arbiter():
+    """Return the single bus owner. All port traffic should go through it.
+
+    Every exchange, parameter reads and writes included, is a raw frame
+    on the one `get_serial()` handle, run on the arbiter's thread.
+    """
+    global _arbiter
+    if _arbiter is None:
+        _arbiter = BusArbiter(get_serial)
+        _arbiter.start()
+    return _arbiter
+
+
+def install_arbiter(arbiter):
+    """Make `arbiter` the process-wide bus owner (e.g. an AsyncBusArbiter)."""
+    global _arbiter
+    _arbiter = arbiter
+    return arbiter
+
+
 def close_all():
     """Close any opened resources. Safe to call on shutdown."""
-    global _serial, _bus, _instruments
+    global _serial, _arbiter
+    if _arbiter is not None:
+        try:
+            _arbiter.stop()
+        finally:
+            _arbiter = None
+
     try:
         if _serial is not None:
             try:
@@ -54,5 +110,4 @@ def close_all():
     finally:
         _serial = None
 
-    _instruments = {}
-    _bus = None
+    release_bus()
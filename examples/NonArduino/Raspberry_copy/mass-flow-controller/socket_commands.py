@@ -1,164 +1,511 @@
 """
-Unix socket communication for MFC control.
+TCP socket communication for MFC control.
 Allows mfc_setpoint_controller.py to send commands to mfc_status_publisher.py
 without opening the serial port twice.
 """
 
-import socket
+import itertools
 import json
-import os
+import logging
+import selectors
+import socket
+import threading
 import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from typing import Optional
+
+log = logging.getLogger(__name__)
 
 TCP_HOST = "0.0.0.0"
 TCP_PORT = 8765
 
 
+# Where clients connect (the server binds TCP_HOST)
+CLIENT_HOST = "127.0.0.1"
+
+
+class MfcClient:
+    """
+    Persistent, pipelined client for the publisher's control socket.
+
+    One TCP connection is kept open and reused; replies are framed by
+    newline and matched to their request by the "id" the server echoes,
+    so any number of requests can be in flight at once. A dropped
+    connection is re-established on the next request, with exponential
+    backoff between connect attempts.
+
+        with MfcClient() as client:
+            a = client.submit({"action": "setpoint", "mfc_id": 0, "setpoint": 1.0})
+            b = client.submit({"action": "setpoint", "mfc_id": 1, "setpoint": 2.0})
+            status = client.status()
+    """
+
+    def __init__(self, host: str = CLIENT_HOST, port: int = TCP_PORT,
+                 timeout: float = 5.0, connect_attempts: int = 5,
+                 backoff: float = 0.1, max_backoff: float = 2.0):
+        """
+        Args:
+            timeout: seconds to wait for connect and for each reply
+            connect_attempts: connect tries per request before giving up
+            backoff: first delay between connect tries, doubled per retry
+        """
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.connect_attempts = connect_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+
+        self._sock = None
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        # id -> Future, in send order (replies without id pop the oldest)
+        self._pending: "OrderedDict[int, Future]" = OrderedDict()
+
+    # --------------------------------------------------
+    # REQUESTS
+    # --------------------------------------------------
+
+    def submit(self, cmd: dict) -> Future:
+        """Send one command without waiting; the Future yields the reply dict."""
+        req_id = next(self._ids)
+        line = json.dumps(dict(cmd, id=req_id)).encode() + b"\n"
+        future = Future()
+        future.request_id = req_id
+
+        with self._lock:
+            sock = self._connect()
+            self._pending[req_id] = future
+            try:
+                sock.sendall(line)
+            except OSError as e:
+                self._disconnect(sock, ConnectionError(f"Send failed: {e}"))
+        return future
+
+    def request(self, cmd: dict, timeout: Optional[float] = None) -> dict:
+        """Send one command and wait for its reply."""
+        future = self.submit(cmd)
+        try:
+            return future.result(self.timeout if timeout is None else timeout)
+        except FutureTimeoutError:
+            with self._lock:
+                self._pending.pop(future.request_id, None)
+            raise
+
+    def setpoint(self, mfc_id: int, setpoint: float) -> dict:
+        return self.request({"action": "setpoint", "mfc_id": mfc_id, "setpoint": setpoint})
+
+    def gas(self, mfc_id: int, gas_cmd: int) -> dict:
+        return self.request({"action": "gas", "mfc_id": mfc_id, "gas_cmd": gas_cmd})
+
+    def batch(self, ops: list) -> dict:
+        """Apply gas/setpoint/refresh ops in one validated pass, one status."""
+        return self.request({"action": "batch", "ops": ops})
+
+    def refresh(self) -> dict:
+        return self.request({"action": "refresh"})
+
+    def status(self, max_age: Optional[float] = None) -> dict:
+        """
+        Latest status of every node, each with its "age" in seconds.
+        Only nodes older than `max_age` (publisher default if None) are
+        polled; 0 forces a poll.
+        """
+        cmd = {"action": "status"}
+        if max_age is not None:
+            cmd["max_age"] = max_age
+        return self.request(cmd)
+
+    def stats(self, mfc_id: Optional[int] = None, window: Optional[str] = None) -> dict:
+        """Rolling flow summaries (all nodes / windows unless narrowed)."""
+        cmd = {"action": "stats"}
+        if mfc_id is not None:
+            cmd["mfc_id"] = mfc_id
+        if window is not None:
+            cmd["window"] = window
+        return self.request(cmd)
+
+    def profile(self, mfc_id: Optional[int] = None, profile: Optional[dict] = None,
+                payload: Optional[str] = None) -> dict:
+        """
+        Start a setpoint profile: JSON form (mfc_id + profile, see
+        trajectory.parse_profile) or the 0x30 downlink bytes as hex.
+        """
+        cmd = {"action": "profile"}
+        if mfc_id is not None:
+            cmd["mfc_id"] = mfc_id
+        if profile is not None:
+            cmd["profile"] = profile
+        if payload is not None:
+            cmd["payload"] = payload
+        return self.request(cmd)
+
+    def profile_stop(self, mfc_id: Optional[int] = None) -> dict:
+        """Stop the profile of one MFC (default: all)."""
+        cmd = {"action": "profile_stop"}
+        if mfc_id is not None:
+            cmd["mfc_id"] = mfc_id
+        return self.request(cmd)
+
+    def trim(self, mfc_id: Optional[int] = None, enabled: Optional[bool] = None) -> dict:
+        """Turn flow trim on/off for one MFC; without `enabled` only report it."""
+        cmd = {"action": "trim"}
+        if mfc_id is not None:
+            cmd["mfc_id"] = mfc_id
+        if enabled is not None:
+            cmd["enabled"] = enabled
+        return self.request(cmd)
+
+    def debug_dump(self, limit: Optional[int] = None) -> dict:
+        """Newest flight recorder records (all levels), oldest first."""
+        cmd = {"action": "debug_dump"}
+        if limit is not None:
+            cmd["limit"] = limit
+        return self.request(cmd)
+
+    # --------------------------------------------------
+    # LIFECYCLE
+    # --------------------------------------------------
+
+    def close(self):
+        with self._lock:
+            if self._sock is not None:
+                self._disconnect(self._sock, ConnectionError("Client closed"))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # --------------------------------------------------
+    # INTERNALS
+    # --------------------------------------------------
+
+    def _connect(self):
+        """Return the open socket, connecting with backoff if needed (lock held)."""
+        if self._sock is not None:
+            return self._sock
+
+        delay = self.backoff
+        for attempt in range(self.connect_attempts):
+            try:
+                sock = socket.create_connection((self.host, self.port), self.timeout)
+                break
+            except OSError:
+                if attempt == self.connect_attempts - 1:
+                    raise
+                time.sleep(delay)
+                delay = min(delay * 2, self.max_backoff)
+
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        # The reader thread blocks in recv(); reply timeouts live on the Futures
+        sock.settimeout(None)
+        self._sock = sock
+        threading.Thread(
+            target=self._read_replies, args=(sock,), name="mfc-client", daemon=True
+        ).start()
+        return sock
+
+    def _disconnect(self, sock, error: Exception):
+        """Close `sock` and fail its in-flight requests (lock held)."""
+        if self._sock is sock:
+            self._sock = None
+            pending = list(self._pending.values())
+            self._pending.clear()
+            for future in pending:
+                if not future.done():
+                    future.set_exception(error)
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        sock.close()
+
+    def _read_replies(self, sock):
+        error = ConnectionError("Connection closed by server")
+        try:
+            for line in sock.makefile("rb"):
+                if not line.strip():
+                    continue
+                try:
+                    reply = json.loads(line)
+                except json.JSONDecodeError:
+                    reply = None
+                if not isinstance(reply, dict):
+                    reply = {"success": False, "message": f"Invalid response: {line!r}"}
+
+                with self._lock:
+                    if "id" in reply:
+                        # Unknown id: a late reply to a request that timed out
+                        future = self._pending.pop(reply["id"], None)
+                    elif self._pending:
+                        # e.g. a parse-error reply the server could not tag
+                        _, future = self._pending.popitem(last=False)
+                    else:
+                        future = None
+                if future is None:
+                    log.warning("Dropping reply to no pending request: %s", line[:200])
+                elif not future.done():
+                    future.set_result(reply)
+        except (OSError, ValueError) as e:
+            error = ConnectionError(f"Connection lost: {e}")
+
+        with self._lock:
+            self._disconnect(sock, error)
+
+
 def send_setpoint_command(mfc_id: int, setpoint: float, timeout: float = 5.0) -> dict:
     """
-    Send a setpoint command to the status publisher via Unix socket.
-    
+    Send a setpoint command to the status publisher over TCP.
+
     Args:
         mfc_id: MFC device index (0 or 1)
         setpoint: Desired flow setpoint in LN/min
         timeout: Socket timeout in seconds
-    
+
     Returns:
         dict with "success" (bool) and "message" (str)
     """
     try:
-        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        sock.settimeout(timeout)
-        sock.connect((TCP_HOST, TCP_PORT))
-
-        cmd = {
-            "action": "setpoint",
-            "mfc_id": mfc_id,
-            "setpoint": setpoint
+        with MfcClient(timeout=timeout) as client:
+            return client.setpoint(mfc_id, setpoint)
+    except FutureTimeoutError:
+        return {"success": False, "message": "Socket command timed out"}
+    except Exception as e:
+        return {"success": False, "message": f"Socket error: {e}"}
+
+
+def dispatch_command(handler, cmd: dict) -> dict:
+    """
+    Map one decoded JSON command onto the handler callback and build
+    the JSON-able reply. Shared by SocketServer and the asyncio runtime.
+    """
+    if not isinstance(cmd, dict):
+        # Valid JSON but not a command ([], 1, "x"): reject like a parse error
+        return {"success": False, "message": f"Command must be a JSON object, got {type(cmd).__name__}"}
+    action = cmd.get("action")
+    if action == "setpoint":
+        mfc_id = cmd.get("mfc_id")
+        setpoint = cmd.get("setpoint")
+        success = handler(action, mfc_id, setpoint)
+    elif action == "gas":
+        mfc_id = cmd.get("mfc_id")
+        gas_cmd = cmd.get("gas_cmd")
+        success = handler(action, mfc_id, None, gas_cmd)
+    elif action == "batch":
+        success = handler(action, ops=cmd.get("ops"))
+    elif action == "stats":
+        success = handler(action, mfc_id=cmd.get("mfc_id"), window=cmd.get("window"))
+    elif action == "debug_dump":
+        success = handler(action, limit=cmd.get("limit"))
+    elif action == "profile":
+        success = handler(action, mfc_id=cmd.get("mfc_id"), profile=cmd.get("profile"),
+                          payload=cmd.get("payload"))
+    elif action == "profile_stop":
+        success = handler(action, mfc_id=cmd.get("mfc_id"))
+    elif action == "trim":
+        success = handler(action, mfc_id=cmd.get("mfc_id"), enabled=cmd.get("enabled"))
+    elif action == "refresh":
+        success = handler(action)
+    elif action == "status":
+        success = handler(action, max_age=cmd.get("max_age"))
+    else:
+        success = False
+
+    if isinstance(success, dict):
+        response = dict(success)
+    else:
+        response = {
+            "success": success,
+            "message": "OK" if success else "Failed"
         }
+    # Echo the request id so pipelining clients can match replies
+    if "id" in cmd:
+        response["id"] = cmd["id"]
+    return response
 
-        sock.sendall(json.dumps(cmd).encode() + b'\n')
 
-        response = sock.recv(1024).decode().strip()
-        sock.close()
+class _Client:
+    """Per-connection buffers for SocketServer."""
 
-        try:
-            resp_json = json.loads(response)
-            return resp_json
-        except json.JSONDecodeError:
-            return {"success": False, "message": f"Invalid response: {response}"}
+    __slots__ = ("conn", "inbuf", "outbuf", "writing")
 
-    except socket.timeout:
-        return {"success": False, "message": "Socket command timed out"}
-    except Exception as e:
-        return {"success": False, "message": f"Socket error: {e}"}
+    def __init__(self, conn):
+        self.conn = conn
+        self.inbuf = bytearray()
+        self.outbuf = bytearray()
+        self.writing = False
 
 
 class SocketServer:
-    """Unix socket server for receiving MFC control commands."""
-    
-    def __init__(self, handler_callback):
+    """
+    TCP server for receiving MFC control commands.
+
+    Event-driven on `selectors`: any number of clients, connections stay
+    open across commands, and each newline-delimited JSON request is
+    dispatched as soon as its line is complete. Blocks in select() while
+    idle, so it costs no CPU between commands.
+    """
+
+    MAX_LINE = 64 * 1024
+
+    def __init__(self, handler_callback, host: str = TCP_HOST, port: int = TCP_PORT):
         """
         Initialize socket server.
-        
+
         Args:
-            handler_callback: Function(mfc_id, setpoint) -> bool. Return True if successful.
+            handler_callback: Function(action, mfc_id=None, setpoint=None, gas_cmd=None,
+                ops=None, window=None, limit=None, max_age=None, profile=None,
+                payload=None, enabled=None) -> bool or response dict.
         """
         self.handler = handler_callback
+        self.host = host
+        self.port = port
         self.socket = None
+        self.selector = None
         self.running = False
-    
+
     def start(self):
         """Start the TCP socket server (non-blocking)."""
         self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         # Allow quick restart
         self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        self.socket.bind((TCP_HOST, TCP_PORT))
+        self.socket.bind((self.host, self.port))
         self.socket.listen(5)
         self.socket.setblocking(False)
+
+        self.selector = selectors.DefaultSelector()
+        self.selector.register(self.socket, selectors.EVENT_READ, None)
         self.running = True
-        print(f"[SocketServer] Listening on {TCP_HOST}:{TCP_PORT}", flush=True)
-    
-    def handle_one(self):
+        log.info("[SocketServer] Listening on %s:%s", self.host, self.port)
+
+    def handle_one(self, timeout=None):
         """
-        Check for one incoming connection and handle it.
-        Non-blocking; returns immediately if no client.
-        
+        Wait for socket activity and handle everything that is ready.
+
+        Args:
+            timeout: seconds to wait; None blocks until something happens,
+                0 polls without waiting.
+
         Returns:
-            bool: True if a command was processed, False if no client waiting
+            bool: True if at least one command was processed
         """
         if not self.running:
             return False
-        
-        try:
-            conn, _ = self.socket.accept()
-            conn.settimeout(2.0)
 
-            data = b''
-            while True:
-                try:
-                    chunk = conn.recv(1024)
-                except socket.timeout:
-                    break
-                if not chunk:
-                    break
-                data += chunk
-
-            lines = data.decode().strip().split('\n')
-            for line in lines:
-                if not line.strip():
-                    continue
+        processed = False
+        for key, events in self.selector.select(timeout):
+            if key.data is None:
+                self._accept()
+                continue
 
-                try:
-                    cmd = json.loads(line)
-
-                    action = cmd.get("action")
-                    if action == "setpoint":
-                        mfc_id = cmd.get("mfc_id")
-                        setpoint = cmd.get("setpoint")
-                        success = self.handler(action, mfc_id, setpoint)
-                    elif action == "gas":
-                        mfc_id = cmd.get("mfc_id")
-                        gas_cmd = cmd.get("gas_cmd")
-                        success = self.handler(action, mfc_id, None, gas_cmd)
-                    elif action == "refresh":
-                        success = self.handler(action)
-                    elif action == "status":
-                        success = self.handler(action)
-                    else:
-                        success = False
+            client = key.data
+            try:
+                if events & selectors.EVENT_READ:
+                    processed |= self._read(client)
+                if events & selectors.EVENT_WRITE:
+                    self._flush(client)
+            except Exception as e:
+                log.error("[SocketServer] Error handling client: %s", e)
+                self._drop(client)
+        return processed
 
-                    if isinstance(success, dict):
-                        response = success
-                    else:
-                        response = {
-                            "success": success,
-                            "message": "OK" if success else "Failed"
-                        }
-                    conn.sendall(json.dumps(response).encode() + b'\n')
-                except json.JSONDecodeError as e:
-                    response = {"success": False, "message": f"JSON parse error: {e}"}
-                    conn.sendall(json.dumps(response).encode() + b'\n')
-
-            conn.close()
-            return True
+    def serve_forever(self):
+        while self.running:
+            self.handle_one()
 
-        except BlockingIOError:
-            # No client waiting (non-blocking socket)
-            return False
-        except Exception as e:
-            print(f"[SocketServer] Error handling client: {e}", flush=True)
-            return False
-    
     def stop(self):
         """Stop the socket server and clean up."""
         self.running = False
+        if self.selector:
+            for key in list(self.selector.get_map().values()):
+                if key.data is not None:
+                    self._drop(key.data)
+            self.selector.close()
+            self.selector = None
         if self.socket:
             try:
                 self.socket.close()
             except Exception:
                 pass
+        log.info("[SocketServer] Stopped")
+
+    # --------------------------------------------------
+    # INTERNALS
+    # --------------------------------------------------
+
+    def _accept(self):
+        try:
+            conn, _ = self.socket.accept()
+        except BlockingIOError:
+            return
+        conn.setblocking(False)
+        conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.selector.register(conn, selectors.EVENT_READ, _Client(conn))
+
+    def _read(self, client) -> bool:
+        try:
+            chunk = client.conn.recv(4096)
+        except BlockingIOError:
+            return False
+        if not chunk:
+            self._drop(client)
+            return False
+
+        client.inbuf += chunk
+        processed = False
+        while True:
+            end = client.inbuf.find(b"\n")
+            if end < 0:
+                break
+            line = bytes(client.inbuf[:end])
+            del client.inbuf[:end + 1]
+            if not line.strip():
+                continue
+
+            try:
+                cmd = json.loads(line)
+                response = dispatch_command(self.handler, cmd)
+            except json.JSONDecodeError as e:
+                response = {"success": False, "message": f"JSON parse error: {e}"}
+            client.outbuf += json.dumps(response).encode() + b"\n"
+            processed = True
+
+        if len(client.inbuf) > self.MAX_LINE:
+            log.warning("[SocketServer] Dropping client: request line too long")
+            self._drop(client)
+            return processed
+
+        self._flush(client)
+        return processed
+
+    def _flush(self, client):
+        if client.outbuf:
+            try:
+                sent = client.conn.send(client.outbuf)
+                del client.outbuf[:sent]
+            except BlockingIOError:
+                pass
+
+        # Only watch for writability while a reply is still pending
+        writing = bool(client.outbuf)
+        if writing != client.writing:
+            events = selectors.EVENT_READ | (selectors.EVENT_WRITE if writing else 0)
+            try:
+                self.selector.modify(client.conn, events, client)
+                client.writing = writing
+            except (KeyError, ValueError):
+                pass
+
+    def _drop(self, client):
+        try:
+            self.selector.unregister(client.conn)
+        except (KeyError, ValueError):
+            pass
         try:
-            os.unlink(SOCKET_FILE)
-        except FileNotFoundError:
+            client.conn.close()
+        except Exception:
             pass
-        print(f"[SocketServer] Stopped", flush=True)
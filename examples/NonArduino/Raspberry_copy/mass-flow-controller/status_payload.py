@@ -0,0 +1,259 @@
+"""
+Packed multi-node status payload for LoRa uplinks (type 0x22).
+
+One frame carries every node that changed since the last frame instead
+of one 0x20 float frame per MFC. Values are fixed point relative to each
+node's calibration range (1 LSB = scale / 16384, int16, so +-2 x range at
+~0.006 % resolution); delta frames send only the difference to the
+values the receiver already has, as int8 when it fits. Periodic
+keyframes (every `keyframe_every` frames or `keyframe_interval` seconds,
+and whenever a node's scale or gas changes) resynchronise a receiver
+that missed an uplink; the 7-bit sequence number lets it notice the gap
+and ignore deltas until the next keyframe.
+
+    byte 0       0x22
+    byte 1       bit 7: keyframe, bits 0-6: sequence
+    byte 2       N = node slots (highest MFC index + 1)
+    bitmap       ceil(N / 8) bytes, bit i%8 of byte i//8: node i present
+    records      one per present node, ascending index
+
+    keyframe record (9 bytes):
+        gas code u8 (0xFF unknown), scale f32, flow i16, setpoint i16
+    delta record:
+        header u8: bit 0 flow changed, bit 1 flow delta is i16 (else i8),
+                   bit 2 setpoint changed, bit 3 setpoint delta is i16
+        then flow delta, setpoint delta (only the changed ones)
+
+All multi-byte fields are big endian. Setpoint i16 -32768 = unknown.
+"""
+
+import math
+import struct
+import time
+from typing import Dict, List, Optional, Sequence
+
+PACKED_STATUS = 0x22
+KEYFRAME = 0x80
+SEQ_MASK = 0x7F
+
+Q_PER_SCALE = 16384
+Q_MIN, Q_MAX = -32767, 32767
+Q_UNKNOWN = -32768
+
+FLOW_CHANGED = 0x01
+FLOW_WIDE = 0x02
+SETPOINT_CHANGED = 0x04
+SETPOINT_WIDE = 0x08
+
+_KEY_RECORD = struct.Struct(">Bfhh")
+
+
+def quantize(value: Optional[float], scale: float) -> int:
+    if value is None or math.isnan(value) or not scale:
+        return Q_UNKNOWN
+    return max(Q_MIN, min(Q_MAX, round(value / scale * Q_PER_SCALE)))
+
+
+def dequantize(q: int, scale: float) -> Optional[float]:
+    if q == Q_UNKNOWN:
+        return None
+    return q * scale / Q_PER_SCALE
+
+
+class _Sent:
+    __slots__ = ("gas", "scale", "flow", "setpoint")
+
+    def __init__(self, gas: int, scale: float, flow: int, setpoint: int):
+        self.gas = gas
+        self.scale = scale
+        self.flow = flow
+        self.setpoint = setpoint
+
+
+class PackedStatusEncoder:
+    """Turns per-cycle node readings into 0x22 frames (None: nothing to send)."""
+
+    def __init__(self, keyframe_every: int = 10, keyframe_interval: float = 600.0,
+                 deadband: int = 1):
+        """
+        Args:
+            keyframe_every: frames between keyframes
+            keyframe_interval: seconds between keyframes
+            deadband: smallest change (LSB) that makes a node present
+        """
+        self.keyframe_every = keyframe_every
+        self.keyframe_interval = keyframe_interval
+        self.deadband = deadband
+
+        self._seq = 0
+        self._since_key = None          # frames since the last keyframe
+        self._key_at = 0.0
+        self._force_key = True
+        # What the receiver holds, per node (after the last frame)
+        self._sent: Dict[int, _Sent] = {}
+        # Latest reading per node (a keyframe carries every known node)
+        self._latest: Dict[int, _Sent] = {}
+
+    def force_keyframe(self):
+        self._force_key = True
+
+    def encode(self, readings: Sequence[dict], now: Optional[float] = None) -> Optional[bytes]:
+        """
+        Args:
+            readings: [{"id", "flow", "setpoint", "scale", "gas"}] for the
+                nodes polled this cycle (scale = calibration range)
+        """
+        if now is None:
+            now = time.monotonic()
+
+        for r in readings:
+            scale = float(r["scale"])
+            gas = r.get("gas")
+            latest = _Sent(
+                gas if gas is not None and 0 <= gas <= 0xFE else 0xFF,
+                scale,
+                quantize(r["flow"], scale),
+                quantize(r.get("setpoint"), scale),
+            )
+            sent = self._sent.get(r["id"])
+            if (sent is None or sent.gas != latest.gas or sent.scale != latest.scale
+                    or (latest.setpoint != sent.setpoint
+                        and Q_UNKNOWN in (latest.setpoint, sent.setpoint))
+                    or abs(latest.flow - sent.flow) > Q_MAX
+                    or abs(latest.setpoint - sent.setpoint) > Q_MAX):
+                # No delta to a new scale / unknown value, or beyond an i16
+                self._force_key = True
+            self._latest[r["id"]] = latest
+
+        if not self._latest:
+            return None
+
+        keyframe = (
+            self._force_key
+            or self._since_key is None
+            or self._since_key + 1 >= self.keyframe_every
+            or now - self._key_at >= self.keyframe_interval
+        )
+        frame = self._keyframe() if keyframe else self._delta()
+        if frame is None:
+            return None
+
+        if keyframe:
+            self._force_key = False
+            self._since_key = 0
+            self._key_at = now
+        else:
+            self._since_key += 1
+        self._seq = (self._seq + 1) & SEQ_MASK
+        return frame
+
+    # --------------------------------------------------
+    # INTERNALS
+    # --------------------------------------------------
+
+    def _header(self, flags: int, present: List[int]) -> bytearray:
+        slots = max(self._latest) + 1
+        if slots > 255:
+            raise ValueError("At most 255 node slots fit in a packed frame")
+        bitmap = bytearray((slots + 7) // 8)
+        for node in present:
+            bitmap[node // 8] |= 1 << (node % 8)
+        return bytearray([PACKED_STATUS, flags | self._seq, slots]) + bitmap
+
+    def _keyframe(self) -> bytes:
+        present = sorted(self._latest)
+        frame = self._header(KEYFRAME, present)
+        for node in present:
+            v = self._latest[node]
+            frame += _KEY_RECORD.pack(v.gas, v.scale, v.flow, v.setpoint)
+            self._sent[node] = _Sent(v.gas, v.scale, v.flow, v.setpoint)
+        return bytes(frame)
+
+    def _delta(self) -> Optional[bytes]:
+        records = []
+        for node in sorted(self._latest):
+            v = self._latest[node]
+            sent = self._sent[node]
+            header = 0
+            body = b""
+            d_flow = v.flow - sent.flow
+            if abs(d_flow) >= self.deadband:
+                header |= FLOW_CHANGED
+                if -128 <= d_flow <= 127:
+                    body += struct.pack(">b", d_flow)
+                else:
+                    header |= FLOW_WIDE
+                    body += struct.pack(">h", d_flow)
+                sent.flow = v.flow
+            d_set = v.setpoint - sent.setpoint
+            if d_set:
+                header |= SETPOINT_CHANGED
+                if -128 <= d_set <= 127:
+                    body += struct.pack(">b", d_set)
+                else:
+                    header |= SETPOINT_WIDE
+                    body += struct.pack(">h", d_set)
+                sent.setpoint = v.setpoint
+            if header:
+                records.append((node, bytes([header]) + body))
+
+        if not records:
+            return None
+        frame = self._header(0, [node for node, _ in records])
+        for _, record in records:
+            frame += record
+        return bytes(frame)
+
+
+class PackedStatusDecoder:
+    """Receiver side (mirror of decodeUplink's 0x22 branch in the broker)."""
+
+    def __init__(self):
+        self.seq: Optional[int] = None
+        self.nodes: Dict[int, _Sent] = {}
+
+    def decode(self, frame: bytes) -> Optional[List[dict]]:
+        """Node values carried by `frame`; None if it can't be applied (gap)."""
+        if len(frame) < 3 or frame[0] != PACKED_STATUS:
+            raise ValueError("Not a packed status frame")
+        keyframe = bool(frame[1] & KEYFRAME)
+        seq = frame[1] & SEQ_MASK
+        slots = frame[2]
+        pos = 3 + (slots + 7) // 8
+        bitmap = frame[3:pos]
+        present = [i for i in range(slots) if bitmap[i // 8] & (1 << (i % 8))]
+
+        if not keyframe and (self.seq is None or seq != (self.seq + 1) & SEQ_MASK):
+            # Missed a frame: deltas have no base until the next keyframe
+            self.seq = None
+            return None
+        self.seq = seq
+
+        out = []
+        for node in present:
+            if keyframe:
+                gas, scale, flow, setpoint = _KEY_RECORD.unpack_from(frame, pos)
+                pos += _KEY_RECORD.size
+                state = self.nodes[node] = _Sent(gas, scale, flow, setpoint)
+            else:
+                state = self.nodes.get(node)
+                if state is None:
+                    self.seq = None
+                    return None
+                header = frame[pos]
+                pos += 1
+                if header & FLOW_CHANGED:
+                    fmt = ">h" if header & FLOW_WIDE else ">b"
+                    state.flow += struct.unpack_from(fmt, frame, pos)[0]
+                    pos += struct.calcsize(fmt)
+                if header & SETPOINT_CHANGED:
+                    fmt = ">h" if header & SETPOINT_WIDE else ">b"
+                    state.setpoint += struct.unpack_from(fmt, frame, pos)[0]
+                    pos += struct.calcsize(fmt)
+            out.append({
+                "id": node,
+                "gas": None if state.gas == 0xFF else state.gas,
+                "flow": dequantize(state.flow, state.scale),
+                "setpoint": dequantize(state.setpoint, state.scale),
+            })
+        return out
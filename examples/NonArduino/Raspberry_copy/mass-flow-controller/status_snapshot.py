@@ -0,0 +1,135 @@
+"""
+Latest status per node, served to "status" requests without a bus poll.
+
+Every publish_status (scheduled polls, refreshes, setpoint readbacks)
+records what it read here, stamped with time.monotonic() at acquisition.
+A "status" request names the oldest data it accepts (max_age seconds);
+only nodes older than that are polled, and requests arriving while a
+poll is running wait for it instead of starting their own. With
+background polling on, dashboards and main.cpp can ask as often as they
+like and the RS-485 bus never sees more than the scheduler's polls.
+"""
+
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Sequence
+
+
+class _Entry:
+    __slots__ = ("status", "acquired", "timestamp", "gps_fix")
+
+    def __init__(self, status: dict, acquired: float, timestamp: str, gps_fix: bool):
+        self.status = status
+        self.acquired = acquired
+        self.timestamp = timestamp
+        self.gps_fix = gps_fix
+
+
+class SnapshotStore:
+    """Per-node status cache with coalesced refreshes."""
+
+    def __init__(self, clock: Callable[[], float] = time.monotonic):
+        self._clock = clock
+        self._cond = threading.Condition()
+        self._entries: Dict[int, _Entry] = {}
+        self._node_ids: Sequence[int] = ()
+        self._polling = False
+        self._poll_started: Optional[float] = None
+        self._poll_done = 0          # completed polls (wakes waiters)
+
+    def set_nodes(self, node_ids: Sequence[int]):
+        """The nodes a complete snapshot must cover."""
+        with self._cond:
+            self._node_ids = tuple(node_ids)
+
+    def record(self, timestamp: str, gps_fix: bool, statuses: Sequence[dict],
+               acquired: Optional[float] = None):
+        """Store freshly read node statuses (dicts with an "id")."""
+        if acquired is None:
+            acquired = self._clock()
+        with self._cond:
+            for status in statuses:
+                self._entries[status["id"]] = _Entry(status, acquired, timestamp, gps_fix)
+
+    def nodes(self) -> List[dict]:
+        """Last known status of every node that was ever read, by id."""
+        with self._cond:
+            return [self._entries[i].status for i in sorted(self._entries)]
+
+    def status(self, node_id: int) -> Optional[dict]:
+        """Last known status of one node, None if it was never read."""
+        with self._cond:
+            entry = self._entries.get(node_id)
+            return entry.status if entry is not None else None
+
+    def stale(self, max_age: float, now: Optional[float] = None) -> List[int]:
+        """Nodes never read or read more than `max_age` seconds ago."""
+        if now is None:
+            now = self._clock()
+        with self._cond:
+            return self._stale(max_age, now)
+
+    def get(self, max_age: float, refresh: Callable[[List[int]], object]) -> dict:
+        """
+        Snapshot no older than `max_age`, polling only what is too old.
+
+        Args:
+            refresh: called with the stale node ids (outside the lock);
+                must record() what it reads. At most one runs at a time;
+                concurrent callers wait for it and reuse its readings.
+
+        Returns:
+            {"timestamp", "gps_fix", "nodes"}, each node with its "age" in
+            seconds. Nodes that failed to answer keep their last status
+            (older than max_age) rather than failing the request.
+        """
+        asked = self._clock()
+        with self._cond:
+            while True:
+                stale = self._stale(max_age, self._clock())
+                if not stale:
+                    break
+                if self._polling:
+                    started, done = self._poll_started, self._poll_done
+                    while self._poll_done == done:
+                        self._cond.wait()
+                    if started >= asked:
+                        # That poll began after we asked: as fresh as it gets
+                        break
+                    continue
+                self._polling = True
+                self._poll_started = self._clock()
+                self._cond.release()
+                try:
+                    refresh(stale)
+                finally:
+                    self._cond.acquire()
+                    self._polling = False
+                    self._poll_done += 1
+                    self._cond.notify_all()
+                break
+            return self._snapshot(self._clock())
+
+    # --------------------------------------------------
+    # INTERNALS
+    # --------------------------------------------------
+
+    def _stale(self, max_age: float, now: float) -> List[int]:
+        stale = []
+        for i in self._node_ids:
+            entry = self._entries.get(i)
+            if entry is None or now - entry.acquired > max_age:
+                stale.append(i)
+        return stale
+
+    def _snapshot(self, now: float) -> dict:
+        entries = [(i, self._entries[i]) for i in sorted(self._entries)]
+        newest = max((e for _, e in entries), key=lambda e: e.acquired, default=None)
+        return {
+            "timestamp": newest.timestamp if newest is not None else None,
+            "gps_fix": newest.gps_fix if newest is not None else False,
+            "nodes": [
+                dict(e.status, age=round(now - e.acquired, 3))
+                for _, e in entries
+            ],
+        }
@@ -0,0 +1,359 @@
+"""
+Append-only binary telemetry store with a per-block time index.
+
+Every publisher reading is one fixed-width record; records are grouped
+in blocks of BLOCK_RECORDS, and each sealed block gets an entry in a
+sidecar index (time range + bitmap of the nodes it contains). The
+reader mmaps both files and answers "node n between t0 and t1" by
+binary-searching the index and decoding only the blocks that can hold
+matching records, so a query over months of data touches a few pages.
+
+Data file (little endian):
+
+    header  : magic "MFCTELEM", version u16, record size u16,
+              block records u32, padded to HEADER_SIZE bytes
+    records : appended in arrival order
+
+    t            f64   UTC epoch seconds
+    node         u16   MFC index
+    flags        u8    bit 0: setpoint valid, bit 1: timestamp from GPS fix
+    (pad)        1x
+    measure_raw  u16   measure register (32000 = 100 %)
+    setpoint_raw u16   setpoint register
+    flow         f32   calibrated flow
+    setpoint     f32   calibrated setpoint (NaN if unknown)
+
+Index file (<data>.idx): same header with magic "MFCTLIDX", then one
+entry per sealed block: t_min f64, t_max f64, node mask u64 (bit n for
+node n, bit 63 for nodes >= 63).
+
+Timestamps need not be monotonic (GPS fix lost / regained): queries use
+the running maximum of t_max and the running minimum (from the end) of
+t_min, which are monotonic, to bound the block range exactly.
+"""
+
+import array
+import bisect
+import math
+import mmap
+import os
+import struct
+import sys
+from collections import namedtuple
+from datetime import datetime, timezone
+from typing import Iterator, List, Optional
+
+from telemetry_writer import BatchingWriter
+
+STORE_MAGIC = b"MFCTELEM"
+INDEX_MAGIC = b"MFCTLIDX"
+STORE_VERSION = 1
+INDEX_SUFFIX = ".idx"
+
+HEADER = struct.Struct("<8sHHI")
+HEADER_SIZE = 32
+
+RECORD = struct.Struct("<dHBxHHff")
+INDEX_ENTRY = struct.Struct("<ddQ")
+BLOCK_RECORDS = 256
+
+FLAG_SETPOINT = 0x01
+FLAG_GPS = 0x02
+
+Reading = namedtuple(
+    "Reading", "t node flags measure_raw setpoint_raw flow setpoint"
+)
+
+
+def _node_bit(node: int) -> int:
+    return 1 << min(node, 63)
+
+
+def _header(magic: bytes, entry_size: int) -> bytes:
+    return HEADER.pack(magic, STORE_VERSION, entry_size, BLOCK_RECORDS).ljust(HEADER_SIZE, b"\x00")
+
+
+def _check_header(raw: bytes, magic: bytes, entry_size: int, path: str):
+    if len(raw) < HEADER_SIZE:
+        raise ValueError(f"{path} is truncated")
+    got_magic, version, size, block = HEADER.unpack_from(raw, 0)
+    if got_magic != magic or version != STORE_VERSION:
+        raise ValueError(f"{path} is not a v{STORE_VERSION} telemetry file")
+    if size != entry_size or block != BLOCK_RECORDS:
+        raise ValueError(f"{path} has an unexpected layout")
+
+
+def make_reading(t: float, node: int, measure_raw: int, flow: float,
+                 setpoint_raw: Optional[int] = None, setpoint: Optional[float] = None,
+                 gps_fix: bool = False) -> Reading:
+    flags = (FLAG_SETPOINT if setpoint_raw is not None else 0) | (FLAG_GPS if gps_fix else 0)
+    return Reading(
+        t, node, flags, measure_raw,
+        setpoint_raw if setpoint_raw is not None else 0,
+        flow,
+        setpoint if setpoint is not None else math.nan,
+    )
+
+
+# --------------------------------------------------
+# WRITE
+# --------------------------------------------------
+
+class TelemetryStoreWriter(BatchingWriter):
+    """
+    Background appender: submit() Reading tuples, the writer thread packs
+    each batch into one write. The data file is fsynced before the index
+    entry of a sealed block is written, so the index never points past
+    durable data; a torn tail is trimmed on the next open.
+    """
+
+    def __init__(self, path: str, **kwargs):
+        self.path = path
+        self.index_path = path + INDEX_SUFFIX
+        self._data = None
+        self._index = None
+        self._count = 0
+        self._block = None
+        super().__init__(name="telemetry-store", **kwargs)
+
+    def _open(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self._data = self._open_file(self.path, STORE_MAGIC, RECORD.size)
+        self._index = self._open_file(self.index_path, INDEX_MAGIC, INDEX_ENTRY.size)
+
+        self._count = (self._data.seek(0, os.SEEK_END) - HEADER_SIZE) // RECORD.size
+        sealed = self._count // BLOCK_RECORDS
+        indexed = (self._index.seek(0, os.SEEK_END) - HEADER_SIZE) // INDEX_ENTRY.size
+
+        if indexed > sealed:
+            self._index.truncate(HEADER_SIZE + sealed * INDEX_ENTRY.size)
+            indexed = sealed
+        # Blocks sealed by a crashed writer before their index entry landed
+        entries = bytearray()
+        for block in range(indexed, sealed):
+            entries += INDEX_ENTRY.pack(*self._scan_block(block, BLOCK_RECORDS))
+        self._index.seek(0, os.SEEK_END)
+        self._index.write(entries)
+
+        partial = self._count - sealed * BLOCK_RECORDS
+        self._block = list(self._scan_block(sealed, partial)) if partial else None
+        self._data.seek(0, os.SEEK_END)
+
+    def _open_file(self, path: str, magic: bytes, entry_size: int):
+        f = open(path, "a+b")
+        f.seek(0)
+        head = f.read(HEADER_SIZE)
+        if not head:
+            f.write(_header(magic, entry_size))
+            f.flush()
+            return f
+        _check_header(head, magic, entry_size, path)
+        end = f.seek(0, os.SEEK_END)
+        whole = HEADER_SIZE + (end - HEADER_SIZE) // entry_size * entry_size
+        if whole != end:
+            # Torn write at power loss
+            f.truncate(whole)
+        return f
+
+    def _scan_block(self, block: int, count: int):
+        self._data.seek(HEADER_SIZE + block * BLOCK_RECORDS * RECORD.size)
+        raw = self._data.read(count * RECORD.size)
+        t_min, t_max, mask = math.inf, -math.inf, 0
+        for t, node, *_ in RECORD.iter_unpack(raw):
+            t_min = min(t_min, t)
+            t_max = max(t_max, t)
+            mask |= _node_bit(node)
+        return t_min, t_max, mask
+
+    def _write_batch(self, readings):
+        if self._data is None:
+            self._open()
+
+        packed = bytearray()
+        entries = bytearray()
+        for r in readings:
+            packed += RECORD.pack(*r)
+            if self._block is None:
+                self._block = [r.t, r.t, 0]
+            block = self._block
+            block[0] = min(block[0], r.t)
+            block[1] = max(block[1], r.t)
+            block[2] |= _node_bit(r.node)
+            self._count += 1
+            if self._count % BLOCK_RECORDS == 0:
+                entries += INDEX_ENTRY.pack(*block)
+                self._block = None
+
+        self._data.write(packed)
+        self._data.flush()
+        if entries:
+            os.fsync(self._data.fileno())
+            self._index.write(entries)
+            self._index.flush()
+            os.fsync(self._index.fileno())
+
+    def _close_output(self):
+        for f in (self._data, self._index):
+            if f is not None:
+                f.flush()
+                os.fsync(f.fileno())
+                f.close()
+        self._data = self._index = None
+
+
+# --------------------------------------------------
+# READ
+# --------------------------------------------------
+
+class TelemetryStore:
+    """Memory-mapped reader: range queries without loading the file."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.index_path = path + INDEX_SUFFIX
+        self._mm = None
+        self._count = 0
+        self._blocks = 0
+        self._masks = array.array("Q")
+        self._t_min = array.array("d")
+        self._t_max = array.array("d")
+        self._max_before = array.array("d")     # running max of t_max
+        self._min_after = array.array("d")      # running min of t_min, from the end
+        self.refresh()
+
+    def __len__(self):
+        return self._count
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if self._mm is not None:
+            self._mm.close()
+            self._mm = None
+
+    def refresh(self):
+        """Pick up records appended since the store was opened."""
+        with open(self.path, "rb") as f:
+            _check_header(f.read(HEADER_SIZE), STORE_MAGIC, RECORD.size, self.path)
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.close()
+        self._mm = mm
+        self._count = (len(mm) - HEADER_SIZE) // RECORD.size
+
+        try:
+            with open(self.index_path, "rb") as f:
+                raw = f.read()
+            _check_header(raw, INDEX_MAGIC, INDEX_ENTRY.size, self.index_path)
+        except FileNotFoundError:
+            raw = b""
+
+        entries = (len(raw) - HEADER_SIZE) // INDEX_ENTRY.size if raw else 0
+        # Only blocks whose records are all in the data file count
+        entries = min(entries, self._count // BLOCK_RECORDS)
+        for i in range(self._blocks, entries):
+            t_min, t_max, mask = INDEX_ENTRY.unpack_from(raw, HEADER_SIZE + i * INDEX_ENTRY.size)
+            self._t_min.append(t_min)
+            self._t_max.append(t_max)
+            self._masks.append(mask)
+            self._max_before.append(max(t_max, self._max_before[-1]) if i else t_max)
+        self._blocks = entries
+
+        # Suffix minimum changes with every new block: rebuild (O(blocks))
+        min_after = array.array("d", self._t_min)
+        for i in range(len(min_after) - 2, -1, -1):
+            if min_after[i + 1] < min_after[i]:
+                min_after[i] = min_after[i + 1]
+        self._min_after = min_after
+
+    # --------------------------------------------------
+    # QUERIES
+    # --------------------------------------------------
+
+    def query(self, node: Optional[int] = None, t0: float = -math.inf,
+              t1: float = math.inf) -> Iterator[Reading]:
+        """Readings of `node` (None: all nodes) with t0 <= t <= t1, in file order."""
+        bit = _node_bit(node) if node is not None else None
+        first = bisect.bisect_left(self._max_before, t0)
+        last = bisect.bisect_right(self._min_after, t1)
+
+        for block in range(first, last):
+            if bit is not None and not self._masks[block] & bit:
+                continue
+            if self._t_max[block] < t0 or self._t_min[block] > t1:
+                continue
+            yield from self._scan(block * BLOCK_RECORDS, BLOCK_RECORDS, node, t0, t1)
+
+        # Records of the open block (not indexed yet)
+        tail = self._blocks * BLOCK_RECORDS
+        yield from self._scan(tail, self._count - tail, node, t0, t1)
+
+    def between(self, node: Optional[int], t0: float, t1: float) -> List[Reading]:
+        return list(self.query(node, t0, t1))
+
+    def time_range(self):
+        """(first t, last t) over the whole store, or None if empty."""
+        lows, highs = [], []
+        if self._blocks:
+            lows.append(self._min_after[0])
+            highs.append(self._max_before[-1])
+        tail = self._blocks * BLOCK_RECORDS
+        for r in self._scan(tail, self._count - tail, None, -math.inf, math.inf):
+            lows.append(r.t)
+            highs.append(r.t)
+        return (min(lows), max(highs)) if lows else None
+
+    # --------------------------------------------------
+    # INTERNALS
+    # --------------------------------------------------
+
+    def _scan(self, start: int, count: int, node, t0: float, t1: float):
+        if count <= 0:
+            return
+        off = HEADER_SIZE + start * RECORD.size
+        view = memoryview(self._mm)[off:off + count * RECORD.size]
+        try:
+            for rec in RECORD.iter_unpack(view):
+                if t0 <= rec[0] <= t1 and (node is None or rec[1] == node):
+                    yield Reading(*rec)
+        finally:
+            view.release()
+
+
+def parse_time(text: str) -> float:
+    """Epoch seconds or ISO-8601 ('2024-06-20T16:32:24Z') -> epoch seconds."""
+    try:
+        return float(text)
+    except ValueError:
+        ts = datetime.fromisoformat(text.replace("Z", "+00:00"))
+        if ts.tzinfo is None:
+            ts = ts.replace(tzinfo=timezone.utc)
+        return ts.timestamp()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print(f"Usage: {sys.argv[0]} <store_file> [node|*] [t0] [t1]")
+        sys.exit(1)
+
+    node_arg = sys.argv[2] if len(sys.argv) > 2 else "*"
+    with TelemetryStore(sys.argv[1]) as store:
+        rows = store.query(
+            None if node_arg == "*" else int(node_arg),
+            parse_time(sys.argv[3]) if len(sys.argv) > 3 else -math.inf,
+            parse_time(sys.argv[4]) if len(sys.argv) > 4 else math.inf,
+        )
+        print("Timestamp,MFC Id,Measure Raw,Setpoint Raw,Flow,Setpoint,GPS")
+        for r in rows:
+            ts = datetime.fromtimestamp(r.t, timezone.utc).isoformat(timespec="milliseconds")
+            setpoint = f"{r.setpoint:.4f}" if r.flags & FLAG_SETPOINT else ""
+            print(
+                f"{ts.replace('+00:00', 'Z')},{r.node},{r.measure_raw},{r.setpoint_raw},"
+                f"{r.flow:.4f},{setpoint},{1 if r.flags & FLAG_GPS else 0}"
+            )
@@ -0,0 +1,287 @@
+"""
+Background telemetry writers for the status publisher.
+
+publish_status used to open, append and close the CSV log on every
+cycle, in the command path, so a slow SD card stalled setpoint replies.
+Writers here take rows through submit(), which only appends to an
+in-memory batch, and a daemon thread writes each batch with a single
+write() once it holds `max_rows` rows or its oldest row is `max_delay`
+seconds old.
+
+CsvTelemetryWriter rotates the active file by size or UTC day, gzips
+closed segments and fsyncs only at segment boundaries: a power cut loses
+at most the rows of the open segment not yet written back by the kernel,
+and never corrupts a closed segment. An active file left behind with a
+different header (an older column layout) is rotated out as a closed
+segment instead of being appended to.
+"""
+
+import abc
+import csv
+import glob
+import gzip
+import io
+import logging
+import os
+import shutil
+import threading
+import time
+from typing import List, Optional, Sequence
+
+log = logging.getLogger(__name__)
+
+# Flush thresholds
+DEFAULT_MAX_ROWS = 256
+DEFAULT_MAX_DELAY = 10.0
+# Rows kept in memory if the disk can't keep up; oldest dropped first
+DEFAULT_MAX_PENDING = 100_000
+# Rotate the active CSV at this size (bytes)
+DEFAULT_MAX_BYTES = 16 * 1024 * 1024
+
+
+def _fsync_dir(path: str):
+    try:
+        fd = os.open(path or ".", os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+class BatchingWriter(abc.ABC):
+    """
+    Row queue + writer thread. Subclasses implement _write_batch(rows)
+    and may override _close_output().
+    """
+
+    def __init__(self, max_rows: int = DEFAULT_MAX_ROWS,
+                 max_delay: float = DEFAULT_MAX_DELAY,
+                 max_pending: int = DEFAULT_MAX_PENDING, name: str = "telemetry"):
+        self.max_rows = max_rows
+        self.max_delay = max_delay
+        self.max_pending = max_pending
+
+        self._cond = threading.Condition()
+        self._rows: List = []
+        self._first_at: Optional[float] = None
+        self._flush_requested = False
+        self._closing = False
+        self._dropped = 0
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    # --------------------------------------------------
+    # PUBLIC
+    # --------------------------------------------------
+
+    def submit(self, rows: Sequence):
+        """Queue rows for writing; never touches the disk."""
+        if not rows:
+            return
+        with self._cond:
+            if self._closing:
+                return
+            if not self._rows:
+                self._first_at = time.monotonic()
+            self._rows.extend(rows)
+            overflow = len(self._rows) - self.max_pending
+            if overflow > 0:
+                del self._rows[:overflow]
+                self._dropped += overflow
+            if len(self._rows) >= self.max_rows:
+                self._cond.notify_all()
+
+    def flush(self, timeout: float = 5.0):
+        """Ask the writer thread to write whatever is queued now."""
+        with self._cond:
+            self._flush_requested = True
+            self._cond.notify_all()
+            deadline = time.monotonic() + timeout
+            while (self._rows or self._flush_requested) and self._thread.is_alive():
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+
+    def close(self, timeout: float = 10.0):
+        """Write everything queued, close the output, stop the thread."""
+        with self._cond:
+            self._closing = True
+            self._cond.notify_all()
+        self._thread.join(timeout)
+
+    # --------------------------------------------------
+    # INTERNALS
+    # --------------------------------------------------
+
+    def _take_batch(self):
+        with self._cond:
+            while True:
+                if self._closing or self._flush_requested:
+                    break
+                if len(self._rows) >= self.max_rows:
+                    break
+                if self._rows:
+                    wait = self._first_at + self.max_delay - time.monotonic()
+                    if wait <= 0:
+                        break
+                    self._cond.wait(wait)
+                else:
+                    self._cond.wait()
+
+            rows, self._rows = self._rows, []
+            self._first_at = None
+            dropped, self._dropped = self._dropped, 0
+            return rows, dropped, self._closing
+
+    def _run(self):
+        closing = False
+        while not closing:
+            rows, dropped, closing = self._take_batch()
+            if dropped:
+                log.warning("Telemetry writer dropped %d rows (disk too slow)", dropped)
+            if rows:
+                try:
+                    self._write_batch(rows)
+                except Exception as e:
+                    log.error("Telemetry write failed, %d rows lost: %s", len(rows), e)
+            with self._cond:
+                self._flush_requested = False
+                self._cond.notify_all()
+
+        try:
+            self._close_output()
+        except Exception as e:
+            log.error("Telemetry close failed: %s", e)
+
+    @abc.abstractmethod
+    def _write_batch(self, rows):
+        """Write one batch of rows (runs on the writer thread)."""
+
+    def _close_output(self):
+        pass
+
+
+class CsvTelemetryWriter(BatchingWriter):
+    """
+    Batched CSV log with size/day rotation and gzip of closed segments.
+
+    The active segment is always `path`; closed segments become
+    '<stem>-YYYYMMDD-HHMMSS.csv.gz' next to it.
+    """
+
+    def __init__(self, path: str, header: Sequence[str],
+                 max_bytes: int = DEFAULT_MAX_BYTES, rotate_daily: bool = True,
+                 compress: bool = True, **kwargs):
+        self.path = path
+        self.header = list(header)
+        self.max_bytes = max_bytes
+        self.rotate_daily = rotate_daily
+        self.compress = compress
+
+        self._file = None
+        self._size = 0
+        self._day = None
+        super().__init__(name="csv-writer", **kwargs)
+
+    # --------------------------------------------------
+    # SEGMENTS
+    # --------------------------------------------------
+
+    def _open_segment(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # Segments left uncompressed by a crash during rotation
+        if self.compress:
+            for leftover in sorted(glob.glob(self._segment_pattern())):
+                self._compress(leftover)
+
+        if self._has_other_header():
+            log.info("%s has an older column layout; starting a new segment", self.path)
+            self._rotate()
+            return
+
+        self._file = open(self.path, "a", newline="")
+        self._size = self._file.tell()
+        if self._size:
+            self._day = time.gmtime(os.fstat(self._file.fileno()).st_mtime)[:3]
+        else:
+            self._day = time.gmtime()[:3]
+            self._write_text(self._format([self.header]))
+
+    def _has_other_header(self) -> bool:
+        try:
+            with open(self.path, newline="") as f:
+                first = next(csv.reader(f), None)
+        except FileNotFoundError:
+            return False
+        return first is not None and first != self.header
+
+    def _close_segment(self):
+        if self._file is None:
+            return
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+        self._file = None
+
+    def _rotate(self):
+        self._close_segment()
+        stamp = time.strftime("%Y%m%d-%H%M%S", time.gmtime())
+        stem, ext = os.path.splitext(self.path)
+        closed = f"{stem}-{stamp}{ext}"
+        n = 0
+        # Never overwrite an earlier segment closed in the same second
+        while os.path.exists(closed) or os.path.exists(closed + ".gz"):
+            n += 1
+            closed = f"{stem}-{stamp}-{n}{ext}"
+        os.replace(self.path, closed)
+        _fsync_dir(os.path.dirname(self.path))
+        if self.compress:
+            self._compress(closed)
+        self._open_segment()
+
+    def _compress(self, source: str):
+        target = source + ".gz"
+        tmp = target + ".tmp"
+        with open(source, "rb") as src, gzip.open(tmp, "wb") as dst:
+            shutil.copyfileobj(src, dst)
+        with open(tmp, "rb") as f:
+            os.fsync(f.fileno())
+        os.replace(tmp, target)
+        os.remove(source)
+        _fsync_dir(os.path.dirname(source))
+
+    def _segment_pattern(self) -> str:
+        stem, ext = os.path.splitext(self.path)
+        return f"{glob.escape(stem)}-*{ext}"
+
+    # --------------------------------------------------
+    # WRITING
+    # --------------------------------------------------
+
+    def _format(self, rows) -> str:
+        buf = io.StringIO()
+        csv.writer(buf).writerows(rows)
+        return buf.getvalue()
+
+    def _write_text(self, text: str):
+        self._file.write(text)
+        self._file.flush()
+        self._size += len(text)
+
+    def _write_batch(self, rows):
+        if self._file is None:
+            self._open_segment()
+        elif (self._size >= self.max_bytes
+              or (self.rotate_daily and time.gmtime()[:3] != self._day)):
+            self._rotate()
+        self._write_text(self._format(rows))
+
+    def _close_output(self):
+        self._close_segment()
@@ -0,0 +1,463 @@
+"""
+Setpoint trajectories executed on the Pi.
+
+A profile is a list of segments run `repeat` times (0: until stopped)
+against one MFC:
+
+    step   jump to `flow`, then hold it for `duration` seconds
+    ramp   go linearly from the current target to `flow` in `duration`
+    dwell  hold the current target for `duration` seconds
+
+One downlink (or one socket command) starts a whole experiment; the
+TrajectoryEngine thread then writes setpoints itself. Every segment
+boundary is computed from the profile's start on time.monotonic(), so a
+slow bus write delays one setpoint but never shifts the rest of the
+schedule. Ramps are re-targeted every `ramp_interval` seconds; the
+publisher skips writes that would not change the register.
+
+Binary form (downlink 0x30, forwarded by main.cpp as hex):
+
+    byte 0       0x30
+    byte 1       MFC index
+    byte 2       repeat count (0 = until stopped)
+    segments     op u8, then for step/ramp a f16 flow (SLPM), then
+                 u16 duration; op bit 7 set: duration in seconds,
+                 else in tenths of a second
+
+    op 0x01 step, 0x02 ramp, 0x03 dwell (no flow)
+
+Multi-byte fields are big endian, like the 0x10 setpoint downlink. A
+0x30 frame with no segments stops the MFC's profile. Half floats keep
+three significant digits over the whole 0.06-300 SLPM range of the
+calibrations, which is finer than the step between ramp writes.
+"""
+
+import bisect
+import logging
+import math
+import struct
+import threading
+import time
+from collections import namedtuple
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Sequence, Set, Tuple
+
+log = logging.getLogger(__name__)
+
+PROFILE_CMD = 0x30
+
+OP_STEP = 0x01
+OP_RAMP = 0x02
+OP_DWELL = 0x03
+OP_SECONDS = 0x80
+OP_KIND = 0x7F
+
+KIND_BY_OP = {OP_STEP: "step", OP_RAMP: "ramp", OP_DWELL: "dwell"}
+OP_BY_KIND = {kind: op for op, kind in KIND_BY_OP.items()}
+
+MAX_SEGMENTS = 64
+MAX_REPEAT = 255
+MAX_DURATION = 65535.0          # seconds (u16 in seconds)
+
+DEFAULT_RAMP_INTERVAL = 0.5
+# Consecutive failed writes before a profile is aborted
+DEFAULT_MAX_FAILURES = 3
+
+_HEADER = struct.Struct(">BBB")
+_FLOW = struct.Struct(">e")
+_DURATION = struct.Struct(">H")
+
+Segment = namedtuple("Segment", ["kind", "flow", "duration"])
+
+
+@dataclass(frozen=True)
+class Profile:
+    mfc_id: int
+    segments: Tuple[Segment, ...]
+    repeat: int = 1
+
+    @property
+    def cycle_duration(self) -> float:
+        return sum(seg.duration for seg in self.segments)
+
+    def flows(self) -> List[float]:
+        """Every flow the profile targets (for validation)."""
+        return [seg.flow for seg in self.segments if seg.flow is not None]
+
+
+# --------------------------------------------------
+# PARSING / ENCODING
+# --------------------------------------------------
+
+def _check_segment(kind: str, flow: Optional[float], duration: float) -> Segment:
+    if kind not in OP_BY_KIND:
+        raise ValueError(f"Unknown segment type {kind!r}")
+    if not (0 <= duration <= MAX_DURATION) or math.isnan(duration):
+        raise ValueError(f"Segment duration {duration} out of range")
+    if kind == "dwell":
+        flow = None
+    elif flow is None or not math.isfinite(flow) or flow < 0:
+        raise ValueError(f"{kind} needs a flow >= 0 (got {flow!r})")
+    if kind == "ramp" and duration == 0:
+        raise ValueError("ramp needs a duration > 0")
+    return Segment(kind, flow, duration)
+
+
+def _check_profile(mfc_id: int, segments: Sequence[Segment], repeat: int) -> Profile:
+    if not segments:
+        raise ValueError("Profile needs at least one segment")
+    if len(segments) > MAX_SEGMENTS:
+        raise ValueError(f"At most {MAX_SEGMENTS} segments per profile")
+    if not 0 <= repeat <= MAX_REPEAT:
+        raise ValueError(f"repeat must be 0-{MAX_REPEAT}")
+    if repeat == 0 and not any(seg.duration for seg in segments):
+        raise ValueError("A repeating profile needs a non-zero duration")
+    return Profile(int(mfc_id), tuple(segments), int(repeat))
+
+
+def parse_profile(mfc_id, spec: dict) -> Profile:
+    """
+    Profile from its JSON form:
+
+        {"repeat": 2, "segments": [
+            {"type": "step", "flow": 1.0, "duration": 30},
+            {"type": "ramp", "flow": 2.0, "duration": 60},
+            {"type": "dwell", "duration": 10}]}
+
+    Raises ValueError with the reason.
+    """
+    if mfc_id is None:
+        raise ValueError("Missing mfc_id")
+    if not isinstance(spec, dict):
+        raise ValueError("profile must be an object")
+    raw_segments = spec.get("segments")
+    if not isinstance(raw_segments, list):
+        raise ValueError("profile needs a list of segments")
+
+    segments = []
+    for i, seg in enumerate(raw_segments):
+        try:
+            if not isinstance(seg, dict):
+                raise ValueError("segment must be an object")
+            flow = seg.get("flow")
+            segments.append(_check_segment(
+                seg.get("type"),
+                None if flow is None else float(flow),
+                float(seg.get("duration", 0)),
+            ))
+        except (TypeError, ValueError) as e:
+            raise ValueError(f"segment {i}: {e}")
+    try:
+        repeat = int(spec.get("repeat", 1))
+    except (TypeError, ValueError):
+        raise ValueError("repeat must be an integer")
+    return _check_profile(int(mfc_id), segments, repeat)
+
+
+def decode_profile(payload: bytes) -> Tuple[int, Optional[Profile]]:
+    """
+    Returns:
+        (mfc_id, profile); profile is None for a stop frame
+    """
+    if len(payload) < 2 or payload[0] != PROFILE_CMD:
+        raise ValueError("Not a profile frame")
+    mfc_id = payload[1]
+    if len(payload) == 2:
+        return mfc_id, None
+    repeat = payload[2]
+
+    segments = []
+    pos = _HEADER.size
+    while pos < len(payload):
+        op = payload[pos]
+        pos += 1
+        kind = KIND_BY_OP.get(op & OP_KIND)
+        if kind is None:
+            raise ValueError(f"Unknown segment op 0x{op:02X} at byte {pos - 1}")
+        flow = None
+        try:
+            if kind != "dwell":
+                flow = _FLOW.unpack_from(payload, pos)[0]
+                pos += _FLOW.size
+            duration = _DURATION.unpack_from(payload, pos)[0]
+        except struct.error:
+            raise ValueError(f"Truncated {kind} segment at byte {pos}")
+        pos += _DURATION.size
+        segments.append(_check_segment(
+            kind, flow, float(duration) if op & OP_SECONDS else duration / 10.0,
+        ))
+    if not segments:
+        return mfc_id, None
+    return mfc_id, _check_profile(mfc_id, segments, repeat)
+
+
+def encode_profile(profile: Optional[Profile], mfc_id: Optional[int] = None) -> bytes:
+    """
+    Binary form of `profile`; with profile None, the stop frame for
+    `mfc_id`. Durations up to 6553.5 s are sent in tenths of a second,
+    longer ones in whole seconds.
+    """
+    if profile is None:
+        return bytes([PROFILE_CMD, mfc_id & 0xFF])
+    out = bytearray(_HEADER.pack(PROFILE_CMD, profile.mfc_id, profile.repeat))
+    for seg in profile.segments:
+        tenths = round(seg.duration * 10)
+        if tenths <= 0xFFFF:
+            op, duration = OP_BY_KIND[seg.kind], tenths
+        else:
+            op, duration = OP_BY_KIND[seg.kind] | OP_SECONDS, round(seg.duration)
+        out.append(op)
+        if seg.kind != "dwell":
+            try:
+                out += _FLOW.pack(seg.flow)
+            except OverflowError:
+                raise ValueError(f"Flow {seg.flow} does not fit a half float")
+        out += _DURATION.pack(duration)
+    return bytes(out)
+
+
+# --------------------------------------------------
+# EXECUTION
+# --------------------------------------------------
+
+_Piece = namedtuple("_Piece", ["start", "end", "kind", "start_flow", "end_flow", "segment"])
+
+
+def _pieces(profile: Profile, start_flow: float) -> Tuple[List[_Piece], float]:
+    """One cycle as time pieces from the cycle start; returns (pieces, end flow)."""
+    pieces = []
+    t = 0.0
+    flow = start_flow
+    for i, seg in enumerate(profile.segments):
+        target = flow if seg.kind == "dwell" else seg.flow
+        pieces.append(_Piece(t, t + seg.duration, seg.kind, flow, target, i))
+        t += seg.duration
+        flow = target
+    return pieces, flow
+
+
+class _Run:
+    """Execution state of one started profile."""
+
+    def __init__(self, profile: Profile, start_flow: float, now: float):
+        self.profile = profile
+        self.first, end_flow = _pieces(profile, start_flow)
+        # Later cycles start from where the previous one ended
+        self.later, self.end_flow = _pieces(profile, end_flow)
+        self.starts = [p.start for p in self.first]
+        self.cycle = profile.cycle_duration
+        self.t0 = now
+        self.next_at = now
+        self.state = "running"
+        self.failures = 0
+        self.cycle_index = 0
+        self.segment = 0
+        self.target: Optional[float] = None
+        self.applied: Optional[float] = None
+
+    def evaluate(self, now: float, ramp_interval: float) -> Tuple[float, bool]:
+        """Target at `now`; schedules next_at. Returns (flow, finished)."""
+        elapsed = now - self.t0
+        total = self.cycle * self.profile.repeat
+        if self.profile.repeat and elapsed >= total:
+            self.cycle_index = self.profile.repeat - 1
+            self.segment = len(self.profile.segments) - 1
+            self.target = self.end_flow
+            return self.target, True
+
+        cycle_index = int(elapsed // self.cycle) if self.cycle else 0
+        within = elapsed - cycle_index * self.cycle
+        pieces = self.first if cycle_index == 0 else self.later
+        piece = pieces[max(0, bisect.bisect_right(self.starts, within) - 1)]
+
+        if piece.kind == "ramp":
+            frac = min(1.0, (within - piece.start) / (piece.end - piece.start))
+            flow = piece.start_flow + (piece.end_flow - piece.start_flow) * frac
+        else:
+            flow = piece.end_flow
+
+        boundary = self.t0 + cycle_index * self.cycle + piece.end
+        if piece.kind == "ramp":
+            self.next_at = min(boundary, now + ramp_interval)
+        else:
+            self.next_at = boundary
+        self.cycle_index = cycle_index
+        self.segment = piece.segment
+        self.target = flow
+        return flow, False
+
+    def progress(self, now: float) -> dict:
+        elapsed = now - self.t0 if self.state == "running" else None
+        total = self.cycle * self.profile.repeat if self.profile.repeat else None
+        return {
+            "state": self.state,
+            "segment": self.segment,
+            "segments": len(self.profile.segments),
+            "cycle": self.cycle_index + 1,
+            "repeat": self.profile.repeat,
+            "elapsed": round(elapsed, 3) if elapsed is not None else None,
+            "remaining": (
+                round(max(0.0, total - elapsed), 3)
+                if total is not None and elapsed is not None else None
+            ),
+            "target": round(self.target, 4) if self.target is not None else None,
+            "applied": round(self.applied, 4) if self.applied is not None else None,
+        }
+
+
+class TrajectoryEngine:
+    """Runs at most one profile per MFC on a background thread."""
+
+    def __init__(self, apply: Callable[[int, float], Optional[float]],
+                 ramp_interval: float = DEFAULT_RAMP_INTERVAL,
+                 max_failures: int = DEFAULT_MAX_FAILURES,
+                 clock: Callable[[], float] = time.monotonic):
+        """
+        Args:
+            apply: writes one setpoint (mfc_id, flow) and returns the flow
+                actually applied (clipped/quantized), None on failure;
+                called from the engine thread, never with the lock held
+            ramp_interval: seconds between setpoint updates on a ramp
+            max_failures: consecutive failed writes that abort a profile
+        """
+        self.apply = apply
+        self.ramp_interval = ramp_interval
+        self.max_failures = max_failures
+        self._clock = clock
+
+        self._cond = threading.Condition()
+        self._runs: Dict[int, _Run] = {}
+        # MFC ids whose apply() is in progress on the engine thread
+        self._applying: Set[int] = set()
+        self._closed = False
+        self._thread = threading.Thread(target=self._loop, name="trajectory", daemon=True)
+        self._thread.start()
+
+    # --------------------------------------------------
+    # PUBLIC
+    # --------------------------------------------------
+
+    def start(self, profile: Profile, start_flow: float = 0.0,
+              reset: Optional[Callable[[], None]] = None) -> dict:
+        """
+        Run `profile` now, replacing the MFC's current profile.
+
+        Args:
+            start_flow: where a leading ramp starts (the current setpoint)
+            reset: called under the engine lock once no write of the
+                replaced profile is in flight, before the new one runs
+                (e.g. to forget the last register the old one wrote)
+        """
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("Trajectory engine is closed")
+            old = self._runs.get(profile.mfc_id)
+            if old is not None and old.state == "running":
+                old.state = "stopped"
+            self._drain(profile.mfc_id)
+            if reset is not None:
+                reset()
+            run = _Run(profile, start_flow, self._clock())
+            self._runs[profile.mfc_id] = run
+            self._cond.notify_all()
+            return run.progress(run.t0)
+
+    def stop(self, mfc_id: Optional[int] = None) -> List[int]:
+        """
+        Stop the profile of `mfc_id` (default: all); returns the ids stopped.
+
+        Returns only once no write of those profiles is in flight, so a
+        setpoint queued by the caller afterwards cannot be overwritten.
+        """
+        stopped = []
+        with self._cond:
+            for run_id, run in self._runs.items():
+                if run.state == "running" and mfc_id in (None, run_id):
+                    run.state = "stopped"
+                    stopped.append(run_id)
+            self._cond.notify_all()
+            self._drain(mfc_id)
+        return stopped
+
+    def running(self, mfc_id: int) -> bool:
+        with self._cond:
+            run = self._runs.get(mfc_id)
+            return run is not None and run.state == "running"
+
+    def progress(self) -> Dict[int, dict]:
+        """State of every profile started so far (the last one per MFC)."""
+        with self._cond:
+            now = self._clock()
+            return {i: run.progress(now) for i, run in sorted(self._runs.items())}
+
+    def close(self, timeout: float = 5.0):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join(timeout)
+
+    # --------------------------------------------------
+    # INTERNALS
+    # --------------------------------------------------
+
+    def _drain(self, mfc_id: Optional[int]):
+        """Wait (lock held) until no apply() of `mfc_id` (None: any) is in flight."""
+        if threading.current_thread() is self._thread:
+            return
+        while any(mfc_id in (None, i) for i in self._applying):
+            self._cond.wait()
+
+    def _loop(self):
+        while True:
+            with self._cond:
+                while True:
+                    if self._closed:
+                        return
+                    now = self._clock()
+                    active = [r for r in self._runs.values() if r.state == "running"]
+                    due = [r for r in active if r.next_at <= now]
+                    if due:
+                        break
+                    wait = min((r.next_at for r in active), default=None)
+                    self._cond.wait(None if wait is None else wait - now)
+                work = [(run, *run.evaluate(now, self.ramp_interval)) for run in due]
+
+            for run, flow, finished in work:
+                mfc_id = run.profile.mfc_id
+                with self._cond:
+                    # Stopped or replaced since evaluate(): don't write
+                    if self._runs.get(mfc_id) is not run or run.state != "running":
+                        continue
+                    self._applying.add(mfc_id)
+                try:
+                    applied = self.apply(mfc_id, flow)
+                except Exception as e:
+                    log.error("Profile write for MFC %s failed: %s", mfc_id, e)
+                    applied = None
+                self._record(run, applied, finished)
+
+    def _record(self, run: _Run, applied: Optional[float], finished: bool):
+        with self._cond:
+            self._applying.discard(run.profile.mfc_id)
+            self._cond.notify_all()
+            if self._runs.get(run.profile.mfc_id) is not run or run.state != "running":
+                return          # replaced or stopped while writing
+            if applied is not None:
+                run.failures = 0
+                run.applied = applied
+                if finished:
+                    run.state = "done"
+                    log.info("Profile on MFC %s finished at %.4f", run.profile.mfc_id, applied)
+                return
+            run.failures += 1
+            if run.failures >= self.max_failures:
+                run.state = "aborted"
+                log.error(
+                    "Profile on MFC %s aborted after %d failed writes",
+                    run.profile.mfc_id, run.failures,
+                )
+            else:
+                # Retry soon, still on the original schedule
+                now = self._clock()
+                retry = now + self.ramp_interval
+                run.next_at = min(run.next_at, retry) if run.next_at > now else retry